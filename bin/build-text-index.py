@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+"""
+Script to build the text recommender's local text index for a given
+Wikipedia language edition from an article dump, so the text server can
+find similar articles without searching CirrusSearch.
+
+Copyright (C) 2005-2023 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+"""
+
+import logging
+
+from suggestbot import config
+from suggestbot.recommenders import textindex
+
+def main():
+    # Parse CLI options
+    import argparse
+    cli_parser = argparse.ArgumentParser(
+        description="Script to build the text index for a specific language from an article dump"
+        )
+
+    # Add verbosity option
+    cli_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='Be more verbose')
+
+    # Add required language parameter
+    cli_parser.add_argument('lang',
+                            help='language code of the Wikipedia we are processing')
+
+    cli_parser.add_argument('dump',
+                            help='path to the article dump, an XML page dump or a JSON lines dump, optionally compressed with bzip2 or gzip')
+
+    cli_parser.add_argument('-f', '--format', choices=['xml', 'json'],
+                            default=None,
+                            help='format of the dump (default from its file name)')
+
+    cli_parser.add_argument('-o', '--output', type=str, default=None,
+                            help='directory to write the index to (default from config)')
+
+    args = cli_parser.parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    dump_format = args.format
+    if dump_format is None:
+        dump_format = 'json' if '.json' in args.dump else 'xml'
+
+    output_dir = args.output
+    if output_dir is None:
+        output_dir = config.text_index_dir.format(args.lang)
+
+    if dump_format == 'json':
+        articles = textindex.read_json_dump(args.dump)
+    else:
+        articles = textindex.read_xml_dump(args.dump)
+
+    index = textindex.TextIndex.build(args.lang, articles)
+    index.save(output_dir)
+    logging.info("text index for {}wiki has {} articles and {} terms".format(args.lang, len(index), len(index.terms)))
+    return()
+
+if __name__ == "__main__":
+    main()
@@ -43,18 +43,34 @@ def main():
     # Add verbosity option
     cli_parser.add_argument('-v', '--verbose', action='store_true',
                             help='Be more verbose')
+
+    # Languages we build in-memory co-edit indexes for
+    cli_parser.add_argument('-i', '--index', action='append', default=[],
+                            metavar='LANG',
+                            help='build an in-memory co-edit index for the given language (can be repeated)')
+
+    # Languages we load item-item similarity tables for
+    cli_parser.add_argument('-s', '--similarities', action='append',
+                            default=[], metavar='LANG',
+                            help='load the item-item similarity table for the given language (can be repeated)')
     args = cli_parser.parse_args()
 
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
 
     recserver = Recommender()
+    for lang in args.index:
+        recserver.load_index(lang)
+    for lang in args.similarities:
+        recserver.load_similarities(lang)
+
     server = SimpleXMLRPCServer(
         (config.coedit_hostname, config.coedit_hostport),
         allow_none=True)
 
     server.register_introspection_functions()
     server.register_function(recserver.recommend, 'recommend')
+    server.register_function(recserver.recommend_batch, 'recommend_batch')
     print("Co-edit rec server is running...")
 
     # Run the server's main loop
@@ -43,12 +43,26 @@ def main():
     # Add verbosity option
     cli_parser.add_argument('-v', '--verbose', action='store_true',
                             help='Be more verbose')
+
+    # Languages we load local link graph snapshots for
+    cli_parser.add_argument('-g', '--graph', action='append', default=[],
+                            metavar='LANG',
+                            help='load the link graph snapshot for the given language (can be repeated)')
     args = cli_parser.parse_args()
 
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
 
-    recserver = Recommender()
+    recserver = Recommender(
+        expansion=config.links_expansion,
+        beam_width=config.links_beam_width,
+        scoring=config.links_scoring,
+        pagerank_iterations=config.links_pagerank_iterations,
+        pagerank_tolerance=config.links_pagerank_tolerance,
+        db_pool_size=config.links_db_pool_size,
+        fetch_workers=config.links_fetch_workers)
+    for lang in args.graph:
+        recserver.load_link_graph(lang, config.links_graph_dir.format(lang))
     server = SimpleXMLRPCServer(
         (config.links_hostname, config.links_hostport),
         allow_none=True)
@@ -58,7 +72,10 @@ def main():
     print("Links rec server is running...")
 
     # Run the server's main loop
-    server.serve_forever()
+    try:
+        server.serve_forever()
+    finally:
+        recserver.close_pools()
 
 if __name__ == "__main__":
     main()
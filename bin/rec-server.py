@@ -55,6 +55,7 @@ def main():
 
     server.register_introspection_functions()
     server.register_function(recserver.recommend, 'recommend')
+    server.register_function(recserver.prefetch, 'prefetch')
     print("Recommendation server is running...")
 
     # Run the server's main loop
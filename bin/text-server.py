@@ -23,6 +23,8 @@ Boston, MA  02110-1301, USA.
 
 import logging
 
+from socketserver import ThreadingMixIn
+
 from suggestbot import config
 from suggestbot.recommenders.text import Recommender
 
@@ -33,6 +35,11 @@ from xmlrpc.server import SimpleXMLRPCRequestHandler
 class RequestHandler(SimpleXMLRPCRequestHandler):
     rpc_paths = ('/RPC2',)
 
+# Handle each request in its own thread, so requests for different users
+# can share searches for the same articles (see text.SingleFlight)
+class ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
 def main():
     # Parse CLI options
     import argparse
@@ -43,13 +50,20 @@ def main():
     # Add verbosity option
     cli_parser.add_argument('-v', '--verbose', action='store_true',
                             help='Be more verbose')
+
+    # Languages we log in to at startup, others are logged in to
+    # on their first request
+    cli_parser.add_argument('-l', '--lang', action='append', default=[],
+                            help='log in to the Wikipedia of the given language at startup (can be repeated)')
     args = cli_parser.parse_args()
 
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
 
     recserver = Recommender()
-    server = SimpleXMLRPCServer(
+    for lang in args.lang:
+        recserver.get_site(lang)
+    server = ThreadingXMLRPCServer(
         (config.textmatch_hostname, config.textmatch_hostport),
         allow_none=True)
 
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+"""
+Script to update the snapshot of the co-edit recommender's in-memory
+index for a given Wikipedia language edition, so the co-edit server
+can map it at startup instead of reading the whole revision table.
+
+Copyright (C) 2005-2017 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+"""
+
+import os
+import logging
+
+from suggestbot import config
+from suggestbot.recommenders.coeditindex import CoeditIndex
+
+def main():
+    # Parse CLI options
+    import argparse
+    cli_parser = argparse.ArgumentParser(
+        description="Script to update the co-edit index snapshot for a specific language"
+        )
+
+    # Add verbosity option
+    cli_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='Be more verbose')
+    
+    # Add required language parameter
+    cli_parser.add_argument('lang',
+                            help='language code of the Wikipedia we are processing')
+
+    # Option to rebuild the snapshot, dropping expired revisions
+    cli_parser.add_argument('--rebuild', action='store_true',
+                            help='build the snapshot from the whole revision table instead of adding newer revisions to it')
+
+    args = cli_parser.parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    snapshot_path = config.coedit_index_snapshot_dir.format(args.lang)
+
+    index = None
+    if not args.rebuild and os.path.isdir(snapshot_path):
+        index = CoeditIndex.load(snapshot_path)
+
+    if index is None:
+        index = CoeditIndex.from_database(args.lang)
+        if index is None:
+            return()
+    else:
+        num_revisions = index.update_from_database()
+        if num_revisions is None:
+            return()
+        logging.info("added {} revisions to the snapshot".format(
+            num_revisions))
+        if not num_revisions:
+            return()
+
+    index.save(snapshot_path)
+    return()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+#!/bin/bash
+
+# Shell script to launch the update of the co-edit index snapshot
+# for a given language, pass --rebuild as the second argument to
+# build it from scratch.
+
+LAUNCH_DIR=`dirname "$0"`;
+cd $LAUNCH_DIR/../
+source set_paths.sh;
+
+cd bin;
+$PYTHON_EXECUTABLE update-coedit-index.py $1 $2;
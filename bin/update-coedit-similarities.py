@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+"""
+Script to compute the item-item co-edit similarity table for a given
+Wikipedia language edition from its revision table, used by the co-edit
+recommender's item-based mode.
+
+Copyright (C) 2005-2017 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+"""
+
+import os
+import shutil
+import logging
+
+from suggestbot import config
+from suggestbot.recommenders.coeditindex import CoeditIndex
+from suggestbot.recommenders.coeditsimilarity import ItemSimilarityTable
+
+def main():
+    # Parse CLI options
+    import argparse
+    cli_parser = argparse.ArgumentParser(
+        description="Script to compute the item-item co-edit similarity table for a specific language"
+        )
+
+    # Add verbosity option
+    cli_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='Be more verbose')
+    
+    # Add required language parameter
+    cli_parser.add_argument('lang',
+                            help='language code of the Wikipedia we are processing')
+
+    cli_parser.add_argument('-k', type=int, default=config.coedit_similarity_k,
+                            help='number of similar articles to keep per article')
+
+    cli_parser.add_argument('--min-coeditors', type=int,
+                            default=config.coedit_similarity_min_coeditors,
+                            help='minimum number of users two articles need in common')
+
+    cli_parser.add_argument('--max-user-articles', type=int,
+                            default=config.coedit_similarity_max_user_articles,
+                            help='leave out users who edited more articles than this')
+
+    cli_parser.add_argument('-o', '--output', type=str, default=None,
+                            help='directory to write the table to (default from config)')
+
+    args = cli_parser.parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    output_dir = args.output
+    if output_dir is None:
+        output_dir = config.coedit_similarity_dir.format(args.lang)
+
+    index = CoeditIndex.from_database(args.lang)
+    if index is None:
+        return()
+
+    table = ItemSimilarityTable.from_index(
+        index, k=args.k, min_coeditors=args.min_coeditors,
+        max_user_articles=args.max_user_articles)
+    logging.info("computed {} similar article pairs for {}wiki".format(
+        len(table), args.lang))
+
+    # Write to a new directory and swap it in, so a running server
+    # never sees a half-written table.
+    new_dir = '{}.new'.format(output_dir)
+    old_dir = '{}.old'.format(output_dir)
+    if os.path.isdir(new_dir):
+        shutil.rmtree(new_dir)
+    table.save(new_dir)
+    if os.path.isdir(output_dir):
+        os.rename(output_dir, old_dir)
+    os.rename(new_dir, output_dir)
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
+    return()
+
+if __name__ == "__main__":
+    main()
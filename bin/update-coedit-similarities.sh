@@ -0,0 +1,11 @@
+#!/bin/bash
+
+# Shell script to launch the update of the co-edit similarity table
+# for a given language
+
+LAUNCH_DIR=`dirname "$0"`;
+cd $LAUNCH_DIR/../
+source set_paths.sh;
+
+cd bin;
+$PYTHON_EXECUTABLE update-coedit-similarities.py $1;
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+"""
+Script to rebuild the link recommender's local snapshot of the links
+between articles for a given Wikipedia language edition, so the links
+server can expand recommendations in memory.
+
+Copyright (C) 2005-2023 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+"""
+
+import logging
+
+from suggestbot import config
+from suggestbot.recommenders.links import Recommender
+
+def main():
+    # Parse CLI options
+    import argparse
+    cli_parser = argparse.ArgumentParser(
+        description="Script to rebuild the link graph snapshot for a specific language"
+        )
+
+    # Add verbosity option
+    cli_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='Be more verbose')
+    
+    # Add required language parameter
+    cli_parser.add_argument('lang',
+                            help='language code of the Wikipedia we are processing')
+
+    cli_parser.add_argument('--block-size', type=int, default=100000,
+                            help='size of the ranges of page IDs we get links for at a time')
+
+    cli_parser.add_argument('-o', '--output', type=str, default=None,
+                            help='directory to write the snapshot to (default from config)')
+
+    args = cli_parser.parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    output_dir = args.output
+    if output_dir is None:
+        output_dir = config.links_graph_dir.format(args.lang)
+
+    recommender = Recommender()
+    graph = recommender.build_link_graph(args.lang, output_dir,
+                                         block_size=args.block_size)
+    if graph is not None:
+        logging.info("link graph for {}wiki has {} pages and {} links".format(args.lang, len(graph.page_ids), len(graph)))
+    return()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+#!/bin/bash
+
+# Shell script to launch the rebuild of the link graph snapshot
+# for a given language.
+
+LAUNCH_DIR=`dirname "$0"`;
+cd $LAUNCH_DIR/../
+source set_paths.sh;
+
+cd bin;
+$PYTHON_EXECUTABLE update-link-graph.py $1;
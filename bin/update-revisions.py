@@ -24,7 +24,9 @@ Boston, MA  02110-1301, USA.
 import argparse
 import logging
 
+from suggestbot import db
 from suggestbot.utilities.rcdaemon import RecentChangesDaemon
+import suggestbot.utilities.userstats as sus
 
 def main():
     # Parse CLI options
@@ -41,10 +43,24 @@ def main():
     cli_parser.add_argument('lang',
                             help='language code of the Wikipedia we are processing')
 
+    # Option to rebuild the user statistics table instead of updating
+    cli_parser.add_argument('--rebuild-stats', action='store_true',
+                            help='rebuild the user statistics table from the revision table and exit')
+
     args = cli_parser.parse_args()
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
 
+    if args.rebuild_stats:
+        sbdb = db.SuggestBotDatabase()
+        if not sbdb.connect():
+            logging.error("unable to connect to the SuggestBot database")
+            return()
+        (db_conn, db_cursor) = sbdb.getConnection()
+        sus.rebuild_user_stats(db_conn, db_cursor, args.lang)
+        sbdb.disconnect()
+        return()
+
     daemon = RecentChangesDaemon()
     daemon.update(args.lang)
     return()
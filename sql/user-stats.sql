@@ -0,0 +1,24 @@
+-- Format of the xxwiki_userstats table, used to store per-user
+-- edit statistics for the co-edit and collaborator recommenders,
+-- so they don't have to count(*) the revision table for every user.
+-- Maintained incrementally by the recent changes daemon from the
+-- matching xxwiki_revisions table.
+
+DROP TABLE IF EXISTS enwiki_userstats;
+CREATE TABLE enwiki_userstats (
+       us_user VARCHAR(255) BINARY NOT NULL, -- username
+       us_edits INT UNSIGNED NOT NULL DEFAULT 0, -- number of revisions
+       us_major_edits INT UNSIGNED NOT NULL DEFAULT 0, -- non-minor, non-reverting revisions
+       us_articles INT UNSIGNED NOT NULL DEFAULT 0, -- number of distinct articles edited
+       us_major_articles INT UNSIGNED NOT NULL DEFAULT 0, -- distinct articles with non-minor, non-reverting revisions
+       us_max_article_edits INT UNSIGNED NOT NULL DEFAULT 0, -- most revisions to a single article
+       PRIMARY KEY(us_user)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_bin;
+
+CREATE TABLE nowiki_userstats LIKE enwiki_userstats;
+CREATE TABLE svwiki_userstats LIKE enwiki_userstats;
+CREATE TABLE ptwiki_userstats LIKE enwiki_userstats;
+CREATE TABLE ruwiki_userstats LIKE enwiki_userstats;
+CREATE TABLE fawiki_userstats LIKE enwiki_userstats;
+CREATE TABLE huwiki_userstats LIKE enwiki_userstats;
+CREATE TABLE frwiki_userstats LIKE enwiki_userstats;
@@ -630,6 +630,20 @@ revision_table = {
     'fr': 'frwiki_revisions',
 }
 
+# Configuration of database tables used to store per-user edit statistics
+# computed from the revision tables (used by the co-edit and collaborator
+# recommenders, updated by the recent changes daemon)
+userstats_table = {
+    'en': 'enwiki_userstats',
+    'no': 'nowiki_userstats',
+    'sv': 'svwiki_userstats',
+    'pt': 'ptwiki_userstats',
+    'fa': 'fawiki_userstats',
+    'ru': 'ruwiki_userstats',
+    'hu': 'huwiki_userstats',
+    'fr': 'frwiki_userstats',
+}
+
 # Configuration of what templates to use.  Complete title
 # to the Wikipedia userspace article that contains the template.
 # Each key is a language code, which then contains a dictionary
@@ -1094,6 +1108,29 @@ coedit_hostname = "localhost"
 coedit_hostport = 10001
 textmatch_hostname = "localhost"
 textmatch_hostport = 10003
+
+## Maximum number of morelike searches the text recommender runs at the
+## same time.  If the API reports database lag or rate limiting for one of
+## them, all searches against that site wait until its retry is due.
+text_search_workers = 4
+
+## Number of seconds the text recommender reuses a logged-in site before
+## checking its login and user rights again
+text_site_ttl = 60*60
+
+## Cache of morelike search results used by the text recommender,
+## results expire after text_cache_ttl seconds and at most text_cache_size
+## are kept.  Set the path to None to disable the cache.
+text_cache_path = "../data/morelike-cache.sqlite"
+text_cache_ttl = 7*24*60*60
+text_cache_size = 1000000
+
+## Where the text recommender searches for similar articles: "cirrussearch"
+## uses the morelike: search of the Wikipedia's API, "bm25" a local text
+## index built from an article dump (see bin/build-text-index.py) and
+## stored in text_index_dir.
+text_backend = "cirrussearch"
+text_index_dir = "../data/text-index-{0}"
 edit_server_hostname = "localhost"
 edit_server_hostport = 10007
 filter_server_hostname = "localhost"
@@ -1104,6 +1141,41 @@ filter_server_hostport = 10009
 links_hostname = "localhost"
 links_hostport = 10006
 
+## Directory template for the link recommender's local link graph
+## snapshots, see bin/update-link-graph.py
+links_graph_dir = "../data/link-graph-{0}"
+
+## How the link recommender follows links at each depth: "exhaustive"
+## follows all pages found so far, "frontier" only the (at most
+## links_beam_width) highest-scoring pages found at the previous depth.
+## On the synthetic graph in tests/benchmark_links_expansion.py (64-article
+## profiles, 20,000 candidates) recall of the top 100 candidates found by
+## exhaustive expansion is 0.35 with a beam of 100, 0.49 with 500, and
+## 0.88 with 2000, beyond which it no longer improves.  Narrower beams
+## fetch fewer link rows; rerun the benchmark on a real snapshot
+## (--lang) before lowering it.
+links_expansion = "exhaustive"
+links_beam_width = 2000
+
+## How the link recommender scores candidates: "links" counts links to
+## them weighted by inlink counts, "pagerank" uses personalized PageRank
+## over the local link graph snapshot (languages without one are scored
+## by links).  Snapshots built by bin/update-link-graph.py include the
+## article titles, so "pagerank" serves without database connections.
+## The PageRank iteration stops after links_pagerank_iterations
+## iterations or once scores change less than links_pagerank_tolerance.
+links_scoring = "links"
+links_pagerank_iterations = 50
+links_pagerank_tolerance = 1e-6
+
+## Maximum number of connections the links server keeps open to each
+## database (the replicated Wikipedia and the tool database) per language
+links_db_pool_size = 8
+
+## Number of slices of articles the links server fetches links for at
+## the same time, each on its own pooled connection to the replica
+links_fetch_workers = 4
+
 # How many contributions do grab from the API to base our recommendations on?
 nedits = 128
 
@@ -1111,6 +1183,10 @@ nedits = 128
 nrecs_per_taskcat = 3
 nrecs_per_server = 2500
 
+# Number of subscribers we prepare co-edit recommendations for in a
+# single batch when posting to subscribers
+rec_batch_size = 50
+
 ## Task categories, matching the relevant labels in the task database
 task_categories = {
     'en' : "STUB1,STUB2,SOURCE1,SOURCE2,CLEANUP,EXPAND,MERGE,WIKIFY,ORPHAN,UNENC",
@@ -1137,6 +1213,49 @@ coedit_min_threshold = 1
 coedit_assoc_threshold = 0.0001
 coedit_filter_threshold = 18 
 
+## How the co-edit recommender gathers candidate articles from the
+## neighbourhood: "exhaustive" visits every neighbour, "top-n" visits
+## them in descending order of association and stops once the rest
+## cannot change the top recommendations.
+coedit_aggregation = 'exhaustive'
+
+## How the co-edit recommender queries languages without an in-memory
+## index: "loop" looks up the editors of every article and the articles
+## of every neighbour one at a time, "join" finds the neighbourhood and
+## the candidate articles with one grouped query each, which moves the
+## work to the database server.  The "join" mode needs the user
+## statistics table (see userstats_table) to be up to date.
+coedit_sql_mode = 'loop'
+
+## Directory template for snapshots of the co-edit recommender's
+## in-memory index.  Servers map the snapshot as-is, run
+## bin/update-coedit-index.py to add newer revisions to it.
+coedit_index_snapshot_dir = "../data/coedit-index-{0}"
+
+## Approximate neighbour search in the co-edit recommender using MinHash
+## and LSH, mapping language codes to the number of LSH bands and rows
+## per band.  Only used for languages with an in-memory co-edit index,
+## those not listed here use exact neighbour search.  More bands and
+## fewer rows gives better recall but more candidates to score, use
+## tests/benchmark_coedit_lsh.py to pick a setting, e.g. 'en': (64, 1)
+coedit_lsh = {}
+
+## Mode of the co-edit recommender: "user-based" finds neighbours of the
+## user and recommends what they edited, "item-based" merges precomputed
+## lists of articles similar to the ones the user edited.  Item-based
+## mode is only used for languages with a similarity table loaded.
+coedit_mode = 'user-based'
+
+## Directory template for the item-item similarity tables written by
+## bin/update-coedit-similarities.py, number of similar articles kept
+## per article, minimum number of co-editors for two articles to be
+## similar, and maximum number of articles edited by a user for them
+## to be included when computing similarities.
+coedit_similarity_dir = "../data/coedit-similarities-{0}"
+coedit_similarity_k = 50
+coedit_similarity_min_coeditors = 2
+coedit_similarity_max_user_articles = 5000
+
 ## API endpoint URLs for access to page views and article quality predictions
 pageview_url = "https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article/"
 ORES_url = "https://ores.wikimedia.org/v2/scores/"
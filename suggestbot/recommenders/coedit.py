@@ -21,29 +21,284 @@ Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 Boston, MA  02110-1301, USA.
 '''
 
+import os
 import sys
 import logging
+import itertools
 
 from suggestbot import config
 from suggestbot import db
+import suggestbot.utilities.userstats as sus
+from suggestbot.recommenders.coeditindex import CoeditIndex
+from suggestbot.recommenders.coeditlsh import CoeditLSH
+from suggestbot.recommenders.coeditsimilarity import ItemSimilarityTable
+from suggestbot.recommenders.neighbours import NeighbourTable
+
+import numpy as np
 
 from operator import itemgetter
 
+# Number of neighbours we visit between checks for whether the
+# top-N aggregation can stop early.
+TOPN_CHECK_INTERVAL = 10
+
+# Number of users whose articles we fetch with one query when
+# scoring the neighbourhood with SQL queries.
+USER_BATCH_SIZE = 500
+
+class TopNAggregator:
+    '''
+    Accumulates scores and co-edit counts of candidate articles while
+    neighbours are visited in descending order of association.  Used to
+    find out when the neighbours we have not visited yet can no longer
+    change which articles make the top N, so we can stop early.
+    Articles are identified by integer IDs.
+    '''
+    def __init__(self, nrecs, threshold, size=1024):
+        '''
+        :param nrecs: Number of recommendations we need
+        :type nrecs: int
+        :param threshold: Minimum number of co-edits for a candidate
+        :type threshold: int
+        :param size: Initial number of article IDs we can hold
+        :type size: int
+        '''
+        self.nrecs = nrecs
+        self.threshold = threshold
+
+        self.scores = np.zeros(size, dtype=np.float64)
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.excluded = np.zeros(size, dtype=bool)
+
+        # IDs of articles that have been given a score, as a list of
+        # arrays that gets concatenated when needed.
+        self.touched = []
+
+    def _grow(self, size):
+        '''
+        Make sure we can hold article IDs up to `size`.
+        '''
+        if size <= len(self.scores):
+            return()
+        new_size = max(size, 2*len(self.scores))
+        extra = new_size - len(self.scores)
+        self.scores = np.concatenate(
+            (self.scores, np.zeros(extra, dtype=np.float64)))
+        self.counts = np.concatenate(
+            (self.counts, np.zeros(extra, dtype=np.int64)))
+        self.excluded = np.concatenate(
+            (self.excluded, np.zeros(extra, dtype=bool)))
+
+    def exclude(self, ids):
+        '''
+        Exclude the given articles from the candidates.
+
+        :param ids: IDs of the articles
+        :type ids: numpy.ndarray
+        '''
+        if not len(ids):
+            return()
+        self._grow(int(ids.max()) + 1)
+        self.excluded[ids] = True
+
+    def update(self, ids, scores, counts):
+        '''
+        Add the given scores and co-edit counts to the given articles.
+        The same article can occur more than once in `ids`.
+
+        :param ids: IDs of the articles
+        :type ids: numpy.ndarray
+        :param scores: score to add for each entry in `ids`
+        :type scores: numpy.ndarray
+        :param counts: co-edits to add for each entry in `ids`
+        :type counts: numpy.ndarray
+        '''
+        if not len(ids):
+            return()
+        self._grow(int(ids.max()) + 1)
+        new_ids = ids[self.counts[ids] == 0]
+        if len(new_ids):
+            self.touched.append(np.unique(new_ids))
+        np.add.at(self.scores, ids, scores)
+        np.add.at(self.counts, ids, counts)
+
+    def add(self, ids, nrevs, weight):
+        '''
+        Add a neighbour's edits, weighted by their association.
+        Each article should only occur once in `ids`.
+
+        :param ids: IDs of the articles the neighbour edited
+        :type ids: numpy.ndarray
+        :param nrevs: number of revisions the neighbour made to each article
+        :type nrevs: numpy.ndarray
+        :param weight: the neighbour's association with the user
+        :type weight: float
+        '''
+        if not len(ids):
+            return()
+        self._grow(int(ids.max()) + 1)
+        new_ids = ids[self.counts[ids] == 0]
+        if len(new_ids):
+            self.touched.append(new_ids)
+        self.scores[ids] += weight * nrevs
+        self.counts[ids] += nrevs
+
+    def candidates(self):
+        '''
+        IDs of all articles that have a score and are not excluded,
+        in the order they were first given a score.
+        '''
+        if not self.touched:
+            return(np.zeros(0, dtype=np.int64))
+        if len(self.touched) > 1:
+            self.touched = [np.concatenate(self.touched)]
+        ids = self.touched[0]
+        return(ids[~self.excluded[ids]])
+
+    def top(self):
+        '''
+        Find the current top N articles with enough co-edits.  Returns
+        a tuple of their IDs (including any ties with the N-th article)
+        and the N-th highest score, or None if we do not have N yet.
+        '''
+        ids = self.candidates()
+        eligible = ids[self.counts[ids] >= self.threshold]
+        if len(eligible) < self.nrecs:
+            return(eligible, None)
+
+        scores = self.scores[eligible]
+        nth = len(scores) - self.nrecs
+        nth_score = np.partition(scores, nth)[nth]
+        return(eligible[scores >= nth_score], nth_score)
+
+    def can_stop(self, remaining):
+        '''
+        Can any article outside the current top N still make it, given
+        that the neighbours left to visit add at most `remaining` to the
+        score of any single article?  Articles in the top N can only gain
+        score and co-edits, so they stay above the N-th score.
+
+        :param remaining: upper bound on the score left to add to an article
+        :type remaining: float
+        '''
+        (top_ids, nth_score) = self.top()
+        if nth_score is None or remaining >= nth_score:
+            return(False)
+
+        ids = self.candidates()
+        others = ids[~np.isin(ids, top_ids)]
+        # Articles nobody has edited yet start from zero
+        best_other = 0.0
+        if len(others):
+            best_other = max(best_other, float(self.scores[others].max()))
+        return(best_other + remaining < nth_score)
+
+    def result(self, ids):
+        '''
+        Get the scores and co-edit counts of the given articles.
+        '''
+        return(self.scores[ids], self.counts[ids])
+
 class Recommender:
     def __init__(self):
+        # In-memory co-edit indexes, mapping language codes to
+        # CoeditIndex objects.  Languages without an index are
+        # served from the revision table with SQL queries.
+        self.indexes = {}
+
+        # LSH tables for approximate neighbour search, mapping language
+        # codes to CoeditLSH objects.  Only built for languages with
+        # an in-memory index that are listed in config.coedit_lsh.
+        self.lsh_tables = {}
+
+        # Precomputed item-item similarity tables for the item-based
+        # mode, mapping language codes to ItemSimilarityTable objects.
+        self.similarity_tables = {}
+
         # Easier to have these SQL queries as global variables,
         # rather than pass them around.  Does make for possible
         # errors if they're not prepared properly before execution, though.
+        self.get_users_by_article_query = ''
+        self.get_minor_users_by_article_query = ''
         self.get_articles_by_user_query = ''
         self.get_articles_by_expert_user_query = ''
+        self.get_articles_by_users_query = ''
         self.get_editcount_query = ''
+        self.get_coedits_query = ''
+        self.get_neighbourhood_query = ''
+        self.get_candidates_query = ''
+
+        # Cache of database lookups shared by all users in a batch, see
+        # `recommend_batch()`.  None when we're not processing a batch.
+        self.batch_cache = None
 
+        self.sbdb = None
         self.dbconn = None
         self.dbcursor = None
-        
+
+    def load_index(self, lang):
+        '''
+        Load the in-memory co-edit index for the given language, replacing
+        any index we already have.  If there is a snapshot of the index
+        (see config.coedit_index_snapshot_dir) it is memory-mapped as-is,
+        so processes serving the same language share its pages through
+        the OS page cache.  Newer revisions are added to the snapshot by
+        bin/update-coedit-index.py, call this again to pick them up.
+        Without a snapshot the index is built from the whole revision
+        table and a snapshot is saved.
+
+        :param lang: Language code of the Wikipedia we're indexing
+        :type lang: str
+        '''
+        snapshot_path = config.coedit_index_snapshot_dir.format(lang)
+        index = None
+        if os.path.isdir(snapshot_path):
+            index = CoeditIndex.load(snapshot_path)
+
+        if index is None:
+            index = CoeditIndex.from_database(lang)
+            if index is None:
+                logging.warning("Unable to build co-edit index for {}wiki, using SQL queries".format(lang))
+                return(False)
+            try:
+                index.save(snapshot_path)
+            except (IOError, OSError) as e:
+                logging.warning("Unable to save co-edit index snapshot for {}wiki: {}".format(lang, e))
+            else:
+                # Map the snapshot rather than keeping our private copy
+                index = CoeditIndex.load(snapshot_path) or index
+        else:
+            logging.info("using co-edit index snapshot for {}wiki with revisions up to {}".format(lang, index.max_timestamp))
+
+        self.indexes[lang] = index
+        self.lsh_tables.pop(lang, None)
+        if lang in config.coedit_lsh:
+            (bands, rows) = config.coedit_lsh[lang]
+            self.lsh_tables[lang] = CoeditLSH(index, bands=bands, rows=rows)
+        return(True)
+
+    def load_similarities(self, lang):
+        '''
+        Load the precomputed item-item similarity table for the given
+        language (see config.coedit_similarity_dir), replacing any table
+        we already have.
+
+        :param lang: Language code of the Wikipedia we're loading for
+        :type lang: str
+        '''
+        table = ItemSimilarityTable.load(
+            config.coedit_similarity_dir.format(lang))
+        if table is None:
+            logging.warning("Unable to load similarity table for {}wiki, item-based mode not available".format(lang))
+            return(False)
+
+        self.similarity_tables[lang] = table
+        return(True)
+
     def recommend(self, username, lang, user_edits,
                   nrecs=None, threshold=None,
-                  backoff=None, min_threshold=None):
+                  backoff=None, min_threshold=None, aggregation=None,
+                  mode=None):
         '''
         Try to recommend `nrecs` articles to `username` in `lang`
         Wikipedia, using the given `threshold` and `backoff` if
@@ -61,8 +316,68 @@ class Recommender:
         :type backoff: bool
         :param min_threshold: Minimum association required to be a candidate
         :type min_threshold: float
+        :param aggregation: How to gather candidates from the neighbourhood,
+                            "exhaustive" or "top-n"
+        :type aggregation: str
+        :param mode: "user-based" to find neighbours of the user, or
+                     "item-based" to use precomputed similar articles
+        :type mode: str
         '''
+        params = self.get_params(nrecs, threshold, backoff, min_threshold,
+                                 aggregation, mode)
 
+        if not self.connect(lang):
+            logging.error("Unable to connect to the SuggestBot database")
+            return([])
+
+        recs = self.get_recs(lang, username, user_edits, params)
+        self.disconnect()
+        return(recs)
+
+    def recommend_batch(self, lang, user_edits,
+                        nrecs=None, threshold=None,
+                        backoff=None, min_threshold=None, aggregation=None,
+                        mode=None):
+        '''
+        Recommend articles to several users in `lang` Wikipedia at once.
+        Editors of articles, articles edited by users, and edit counts are
+        looked up once for the whole batch, so users with overlapping
+        profiles share the work.  Returns a dict mapping each username
+        to their list of recommendations.
+
+        :param lang: Language code of the Wikipedia we're on
+        :param user_edits: Dictionary mapping usernames to lists of
+                           articles they edited
+        :type user_edits: dict
+
+        See `recommend()` for the other parameters.
+        '''
+        params = self.get_params(nrecs, threshold, backoff, min_threshold,
+                                 aggregation, mode)
+
+        if not self.connect(lang):
+            logging.error("Unable to connect to the SuggestBot database")
+            return({})
+
+        self.batch_cache = {'article_editors': {},
+                            'user_articles': {},
+                            'edit_counts': {}}
+        results = {}
+        for (username, edits) in user_edits.items():
+            results[username] = self.get_recs(lang, username, edits,
+                                              dict(params))
+
+        self.batch_cache = None
+        self.disconnect()
+        return(results)
+
+    def get_params(self, nrecs=None, threshold=None, backoff=None,
+                   min_threshold=None, aggregation=None, mode=None):
+        '''
+        Get the recommendation parameters, using defaults from the
+        configuration for those not given.  See `recommend()` for
+        the parameters.
+        '''
         params = {
             'backoff': config.coedit_backoff,
             'nrecs' : config.nrecs_per_server,
@@ -70,6 +385,9 @@ class Recommender:
             'min-threshold' : config.coedit_min_threshold,
             'association-threshold': config.coedit_assoc_threshold,
             'filter-threshold' : config.coedit_filter_threshold,
+            'aggregation': config.coedit_aggregation,
+            'mode': config.coedit_mode,
+            'sql-mode': config.coedit_sql_mode,
         }
 
         if backoff is not None and backoff != params['backoff']:
@@ -82,26 +400,64 @@ class Recommender:
             params['threshold'] = threshold
 
         if min_threshold:
-            param['min-threshold'] = min_threshold
+            params['min-threshold'] = min_threshold
+
+        if aggregation:
+            params['aggregation'] = aggregation
+
+        if mode:
+            params['mode'] = mode
+
+        return(params)
+
+    def get_recs(self, lang, username, user_edits, params):
+        '''
+        Recommend articles to `username` in `lang` Wikipedia, backing
+        off on the co-edit threshold if needed and allowed.  Expects
+        that we're connected, see `connect()`.
 
+        :param lang: Language code of the Wikipedia we're on
+        :param username: Name of the user we're recommending to
+        :param user_edits: List of articles the user has edited
+        :param params: Recommendation parameters, see `get_params()`
+        :type params: dict
+        '''
         sys.stderr.write("Got request to recommend {} articles to {}:User:{} based on {} edited articles\n".format(
             params['nrecs'], lang, username, len(user_edits)))
 
-        # Get some recs.
-        recs = self.get_recs_at_coedit_threshold(lang, username,
-                                                 user_edits, params)
+        if params['mode'] == 'item-based' \
+           and lang in self.similarity_tables:
+            # The similar articles are already known, so all candidates
+            # are found by merging their lists.
+            nhood = None
+            (rec_map, coedit_count) = self.get_item_based_candidates(
+                lang, username, user_edits)
+            complete = True
+        else:
+            # Find the neighbourhood once, then get some recs.
+            nhood = self.get_neighbourhood(lang, username, user_edits,
+                                           params)
+            (rec_map, coedit_count, complete) = self.gather_candidates(
+                lang, username, user_edits, nhood, params)
+        recs = self.rank_candidates(rec_map, coedit_count,
+                                    params['threshold'], params['nrecs'])
 
         # sys.stderr.write("Got {} recs back\n".format(len(recs)))
         
         # If we're allowed to back off on the coedit threshold and don't
         # have enough recs, ease off on the threshold and try again.
+        # Only the threshold changes, so the neighbourhood is reused,
+        # and so are the candidates if we gathered all of them.
         while params['backoff'] \
               and (params['threshold'] > params['min-threshold']) \
               and (len(recs) < params['nrecs']):
             # sys.stderr.write("Backing off threshold...\n")
             params['threshold'] -= 1
-            recs = self.get_recs_at_coedit_threshold(lang, username,
-                                                     user_edits, params)
+            if not complete:
+                (rec_map, coedit_count, complete) = self.gather_candidates(
+                    lang, username, user_edits, nhood, params)
+            recs = self.rank_candidates(rec_map, coedit_count,
+                                        params['threshold'], params['nrecs'])
 
         sys.stderr.write("Done recommeding for {}:User:{}, returning {} recommendations\n".format(lang, username, len(recs)))
 
@@ -109,6 +465,91 @@ class Recommender:
         return(recs[:params['nrecs']])
 
     def get_recs_at_coedit_threshold(self, lang, username, contribs, params):
+        '''
+        Get recommendations for `username` at the co-edit threshold
+        given in `params`.
+
+        :param lang: Language code of the Wikipedia we're recommending for
+        :param username: Name of the user we're recommending to
+        :param contribs: List of articles the user has edited
+        :param params: Recommendation parameters
+        :type params: dict
+        '''
+        (rec_map, coedit_count) = self.get_candidates(lang, username,
+                                                      contribs, params)
+        return(self.rank_candidates(rec_map, coedit_count,
+                                    params['threshold'], params['nrecs']))
+
+    def rank_candidates(self, rec_map, coedit_count, threshold, nrecs):
+        '''
+        Rank candidate articles with at least `threshold` co-edits
+        and return the top `nrecs` of them.
+
+        :param rec_map: Candidate articles mapped to their scores
+        :type rec_map: dict
+        :param coedit_count: Candidate articles mapped to their number
+                             of co-edits by the neighbourhood
+        :type coedit_count: dict
+        :param threshold: Minimum number of co-edits
+        :type threshold: int
+        :param nrecs: Number of recommendations to return
+        :type nrecs: int
+        '''
+        recs = []
+        for (item, value) in sorted(
+                ((k, v) for (k, v) in rec_map.items()
+                 if coedit_count[k] >= threshold),
+                key=itemgetter(1),
+                reverse=True)[:nrecs]:
+            recs.append({'item': item,
+                         'value': value})
+        return(recs)
+
+    def connect(self, lang):
+        '''
+        Connect to the SuggestBot database and prepare the SQL queries
+        for the given language, unless it is served from an in-memory
+        index.  Returns True if we're ready to recommend.
+
+        :param lang: Language code of the Wikipedia we're recommending for
+        :type lang: str
+        '''
+        if lang in self.indexes:
+            return(True)
+
+        if self.sbdb is not None:
+            self.prepare_queries(lang)
+            return(True)
+
+        self.sbdb = db.SuggestBotDatabase()
+        if not self.sbdb.connect():
+            self.sbdb = None
+            return(False)
+
+        (self.dbconn, self.dbcursor) = self.sbdb.getConnection()
+        self.prepare_queries(lang)
+        return(True)
+
+    def disconnect(self):
+        '''
+        Disconnect from the SuggestBot database, if connected.
+        '''
+        if self.sbdb is None:
+            return()
+
+        self.dbconn = None
+        self.dbcursor = None
+        self.sbdb.disconnect()
+        self.sbdb = None
+
+    def prepare_queries(self, lang):
+        '''
+        Prepare the SQL queries we use for the given language.
+
+        :param lang: Language code of the Wikipedia we're recommending for
+        :type lang: str
+        '''
+
         # NOTE: because rev_user and rev_title currently are VARCHAR(255) and
         # UTF-8, they're assumed to consume ~765 bytes in memory, and
         # therefore MySQL chooses to use a temp file table rather than
@@ -118,7 +559,7 @@ class Recommender:
 
         # First query gets users who made non-minor, non-reverting edits
         # to this article.  These are _always_ potential neighbours.
-        get_users_by_article_query = """
+        self.get_users_by_article_query = """
             SELECT DISTINCT rev_user 
             FROM {}
             WHERE rev_title=%(title)s
@@ -129,7 +570,7 @@ class Recommender:
         # Second query gets the other users (either minor or reverting),
         # these are only interesting if they're below the threshold for total
         # number of edits, as they otherwise know what they were doing.
-        get_minor_users_by_article_query = """
+        self.get_minor_users_by_article_query = """
             SELECT DISTINCT rev_user
             FROM {}
             WHERE rev_title=%(title)s
@@ -155,6 +596,15 @@ class Recommender:
 	    AND rev_comment_is_revert=0""".format(
                 config.revision_table[lang])
     
+        # Query to get the articles edited by a set of users, the list of
+        # users is filled in later.  Whether a revision counts for an
+        # expert is decided from its flags after fetching.
+        self.get_articles_by_users_query = """
+            SELECT rev_user, rev_title, rev_is_minor, rev_comment_is_revert
+            FROM {}
+            WHERE rev_user IN ({{userlist}})""".format(
+                config.revision_table[lang])
+
         # Query to get the number of edits a user has made (in our dataset)
         self.get_editcount_query = """
             SELECT count(*) AS num_edits
@@ -162,182 +612,761 @@ class Recommender:
 	    WHERE rev_user=%(username)s""".format(
                 config.revision_table[lang])
 
-        # Return this many recs
-        N = params['nrecs']
+        # Query to get the revisions a set of users made to a set of
+        # articles, the lists of users and articles are filled in later.
+        self.get_coedits_query = """
+            SELECT rev_user, rev_title
+            FROM {}
+            WHERE rev_user IN ({{userlist}})
+            AND rev_title IN ({{titlelist}})""".format(
+                config.revision_table[lang])
 
-        # Exclude items edited by this user.
-        user_for_query = username
+        # Queries for the "join" SQL mode.  The first finds everyone who
+        # edited one of the user's articles, counts how many of them they
+        # edited, and scores them against the user with the per-user
+        # article counts from the statistics table.  Experts are compared
+        # on non-minor, non-reverting edits only, and inexperienced users
+        # with only minor edits or reverts are kept, same as in
+        # `get_neighbourhood()`.  Multiplying by 1.0E0 makes MySQL divide
+        # in floating point rather than as decimals.
+        self.get_neighbourhood_query = """
+            SELECT rev_user, assoc
+            FROM (SELECT overlap.rev_user AS rev_user,
+                         CASE WHEN us_edits >= %(filter_threshold)s
+                         THEN shared_major * 1.0E0 /
+                              (%(basket_size)s + us_major_articles
+                               - shared_major)
+                         ELSE shared_all * 1.0E0 /
+                              (%(basket_size)s + us_articles - shared_all)
+                         END AS assoc
+                  FROM (SELECT rev_user,
+                               COUNT(DISTINCT rev_title) AS shared_all,
+                               COUNT(DISTINCT CASE WHEN rev_is_minor=0
+                                                   AND rev_comment_is_revert=0
+                                                   THEN rev_title END)
+                               AS shared_major
+                        FROM {revision_table}
+                        WHERE rev_title IN ({{titlelist}})
+                        AND rev_user != %(username)s
+                        GROUP BY rev_user) AS overlap
+                  JOIN {userstats_table}
+                  ON us_user=overlap.rev_user
+                  WHERE shared_major > 0
+                  OR us_edits < %(filter_threshold)s) AS neighbours
+            WHERE assoc >= %(assoc_threshold)s
+            ORDER BY assoc DESC, rev_user
+            LIMIT %(k)s""".format(
+                revision_table=config.revision_table[lang],
+                userstats_table=config.userstats_table[lang])
 
-        # Neighbours must have at least this much association.
-        association_threshold = params['association-threshold']
+        # The second sums up the association of the neighbours who edited
+        # each article, once per revision, leaving out articles the user
+        # edited.  The neighbourhood is filled in later as a derived table
+        # of (nh_user, nh_assoc) rows.
+        self.get_candidates_query = """
+            SELECT rev_title, SUM(nh_assoc) AS score, COUNT(*) AS coedits
+            FROM {revision_table}
+            JOIN ({{nhood}}) AS nhood
+            ON rev_user=nh_user
+            WHERE rev_title NOT IN ({{titlelist}})
+            AND rev_title NOT IN (SELECT rev_title
+                                  FROM {revision_table}
+                                  WHERE rev_user=%(username)s)
+            GROUP BY rev_title
+            HAVING COUNT(*) >= %(min_coedits)s""".format(
+                revision_table=config.revision_table[lang])
 
-        # Recommendations we found
-        recs = []
-        
-        sbdb = db.SuggestBotDatabase()
-        if not sbdb.connect():
+    def get_candidates(self, lang, username, contribs, params):
+        '''
+        Find the neighbourhood of `username` and gather up the articles
+        its members edited, weighted by association.  Articles the user
+        already edited are left out.  Returns a tuple of two dicts, one
+        mapping articles to scores and one mapping articles to number
+        of co-edits by the neighbourhood.
+
+        :param lang: Language code of the Wikipedia we're recommending for
+        :param username: Name of the user we're recommending to
+        :param contribs: List of articles the user has edited
+        :param params: Recommendation parameters
+        :type params: dict
+        '''
+        if not self.connect(lang):
             logging.error("Unable to connect to the SuggestBot database")
-            return(recs)
+            return({}, {})
 
-        (self.dbconn, self.dbcursor) = sbdb.getConnection()
-        
-        rec_map = {}
+        nhood = self.get_neighbourhood(lang, username, contribs, params)
+        (rec_map, coedit_count, complete) = self.gather_candidates(
+            lang, username, contribs, nhood,
+            dict(params, aggregation='exhaustive'))
 
-        # How many different users have coedited a given item with something
-        # in the basket
-        coedit_count = {}
+        self.disconnect()
+        return(rec_map, coedit_count)
 
-        # Find users who rated the given items
-        coeditor_map = {}
-        user_assoc = {}
-        user_shared = {}
+    def get_neighbourhood(self, lang, username, contribs, params):
+        '''
+        Find the neighbourhood of `username`, the top k users most
+        associated with the articles in `contribs`, sorted in descending
+        order of association.  For languages with an in-memory index this
+        is a tuple of arrays of user IDs and associations, otherwise it
+        is a list of (username, association) tuples.
+
+        :param lang: Language code of the Wikipedia we're recommending for
+        :param username: Name of the user we're recommending to
+        :param contribs: List of articles the user has edited
+        :param params: Recommendation parameters
+        :type params: dict
+        '''
+        if lang in self.indexes:
+            return(self.get_neighbourhood_from_index(
+                self.indexes[lang], username, contribs, params,
+                lsh=self.lsh_tables.get(lang)))
+
+        if params['sql-mode'] == 'join':
+            return(self.get_neighbourhood_in_db(username, contribs, params))
+
+        # Exclude items edited by this user.
+        user_for_query = username
+
+        # Neighbours must have at least this much association.
+        association_threshold = params['association-threshold']
+
+        # Find users who rated the given items, split into major stakeholders
+        # and those who only made minor edits or reverts.  Dicts are used
+        # as ordered sets.
+        major_editors = {}
+        minor_editors = {}
+        neighbours = NeighbourTable()
 
         for item in contribs:
-	    # For each article the user has edited, find other editors.
-            other_editors = {}
+	    # For each article the user has edited, find other editors,
+            # both major stakeholders in the article (non-minor/non-reverting
+            # edits) and those with minor edits and reverts.  Whether the
+            # latter are kept is decided below once we know their edit counts.
             # sys.stderr.write("Looking for contributors to {}\n".format(item))
-
-	    # First we get major stakeholders in the article
-            # (non-minor/non-reverting edits)
-            self.dbcursor.execute(get_users_by_article_query,
-                             {'title': item.encode('utf-8')})
-            for row in self.dbcursor:
-                # Only compute each thing once
-                user = row['rev_user'].decode('utf-8')
-                if user in coeditor_map:
-                    continue
-                
+            (majors, minors) = self.get_article_editors(item)
+            for user in majors:
                 # User can't be their own neighbour
                 if user == user_for_query:
                     continue
                 
-                # OK, add user to hash
-                other_editors[user] = 1
-                
-	    # Then we check minor edits and reverts, and keep those users
-            # who are not in the top 10% of users (see param filter-threshold
-            # defined earlier).
-
-	    # Users we've seen (so we don't re-run SQL queries all the time)...
-            seen_minors = {}
-            self.dbcursor.execute(get_minor_users_by_article_query,
-                             {'title' : item.encode('utf-8')})
-
-            # Note: using fetchall() to allow us to execute further queries
-            for row in self.dbcursor.fetchall():
-                user = row['rev_user'].decode('utf-8')
+                major_editors[user] = 1
                 
-	        # If user has already been seen, move along...
-                if user in coeditor_map:
+            for user in minors:
+                if user == user_for_query:
                     continue
 
-                # If user is a major stakeholder, move along...
-                if user in other_editors:
-                    continue
+                minor_editors[user] = 1
 
-                # If we tested this user already...
-                if user in seen_minors:
-                    continue
+        # A major stakeholder in any article is always a potential neighbour
+        for user in major_editors:
+            minor_editors.pop(user, None)
 
-                # User can't be their own neighbour
-                if user == user_for_query:
-                    continue
+        edit_counts = self.get_edit_counts(
+            lang, itertools.chain(major_editors, minor_editors))
 
-                # Passed tests, add as a minor user
-                seen_minors[user] = 1
+        # Experts are compared on their non-minor, non-reverting edits
+        experts = {user: edit_counts[user] >= params['filter-threshold']
+                   for user in itertools.chain(major_editors, minor_editors)}
 
-	        # Is user above threshold?  If so, skip...
-                self.dbcursor.execute(self.get_editcount_query,
-                                      {'username': user.encode('utf-8')})
-                nedit_row = self.dbcursor.fetchone()
-                self.dbcursor.fetchall() # flush cursor
-                if nedit_row['num_edits'] >= params['filter-threshold']:
-                    continue
+        # Minor users are kept if they are not in the top 10% of users
+        # (see param filter-threshold defined earlier).
+        candidates = list(major_editors)
+        candidates.extend(user for user in minor_editors
+                          if not experts[user])
 
-                # Passed all criteria, adding the user
-                other_editors[user] = 1;
-            
-	    # Now we have all relevant stakeholders in the article, and can
-	    # compute the appropriate association.
-            for user in other_editors.keys():
-	        # Add user to coeditor-map so we'll skip this user later
-                coeditor_map[user] = 1
-
-                (assoc, shared) = self.user_association(
-                    user, contribs, params['filter-threshold'])
-                if assoc < association_threshold:
-                    continue
+        # Fetch the articles of all candidates in batches, then score them
+        user_articles = self.get_users_articles(candidates, experts)
+        basket = set(contribs)
+        for user in candidates:
+            user_edits = set(user_articles[user])
+            shared = len(basket & user_edits)
+            assoc = shared / (len(contribs) + len(user_edits) - shared)
+            if assoc < association_threshold:
+                continue
 
-                user_assoc[user] = assoc
-                user_shared[user] = shared
+            neighbours.add(user, assoc, shared)
 
         sys.stderr.write("Found {} pre-neighbours\n".format(
-            len(user_assoc)))
+            len(neighbours)))
+        logging.info("neighbour table uses {} bytes".format(
+            neighbours.memory_usage()))
 
         # Find nhood of top k users
         k = 250  # Larger nhood for more recs, hopefully
-        nhood = sorted(user_assoc,
-                       key=itemgetter(1),
-                       reverse=True)[:k]
+        return(neighbours.records(k))
+
+    def get_neighbourhood_from_index(self, index, username, contribs, params,
+                                     lsh=None):
+        '''
+        Find the neighbourhood of `username` using the in-memory co-edit
+        index instead of querying the revision table.  Associations are
+        the same as on the SQL path, see `get_neighbourhood()`, but users
+        tied in association are ordered by user ID in the index rather
+        than in the order the SQL path finds them, so the neighbourhoods
+        can differ among users tied at the k-th association.  If LSH
+        tables are given, candidate neighbours are only those who share
+        an LSH bucket with the user's articles.
+
+        :param index: The co-edit index of the Wikipedia we're recommending for
+        :type index: CoeditIndex
+        :param username: Name of the user we're recommending to
+        :param contribs: List of articles the user has edited
+        :param params: Recommendation parameters
+        :type params: dict
+        :param lsh: LSH tables for approximate neighbour search
+        :type lsh: CoeditLSH
+        '''
+        basket = index.get_title_ids(contribs)
+        user_id = index.user_ids.get(username)
+
+        if lsh is not None:
+            # Users similar to the basket.  Those who share no articles
+            # with it get zero association and are filtered out below,
+            # so this is a subset of what find_neighbours() returns.
+            candidates = lsh.candidates(basket)
+            if user_id is not None:
+                candidates = candidates[candidates != user_id]
+        else:
+            # Everyone who has a non-minor, non-reverting edit to an article
+            # in the basket, plus inexperienced users with minor edits/reverts.
+            candidates = index.find_neighbours(basket, user_id,
+                                               params['filter-threshold'])
+
+        # Score all candidates against the basket in one go
+        (assoc, shared) = index.batch_association(
+            candidates, basket, params['filter-threshold'],
+            basket_size=len(contribs))
+        keep = (assoc >= params['association-threshold']) & (shared > 0)
+        candidates = candidates[keep]
+        assoc = assoc[keep]
+
+        sys.stderr.write("Found {} pre-neighbours\n".format(
+            len(candidates)))
+
+        # Find nhood of top k users, candidates are in order of user ID
+        # so a stable sort breaks ties on it
+        k = 250
+        top = np.argsort(-assoc, kind='stable')[:k]
+        return(candidates[top], assoc[top])
+
+    def get_neighbourhood_in_db(self, username, contribs, params):
+        '''
+        Find the neighbourhood of `username` with a single query, see
+        `prepare_queries()`.  Gives the same associations as
+        `get_neighbourhood()` for users in the user statistics table,
+        those missing from it are left out.  Ties in association are
+        broken on username rather than in order of discovery, so the
+        neighbourhoods can differ among users tied at the k-th association.
+
+        :param username: Name of the user we're recommending to
+        :param contribs: List of articles the user has edited
+        :param params: Recommendation parameters
+        :type params: dict
+        '''
+        if not contribs:
+            return([])
+
+        query_params = {'username': username.encode('utf-8'),
+                        'basket_size': len(contribs),
+                        'filter_threshold': params['filter-threshold'],
+                        'assoc_threshold': params['association-threshold'],
+                        'k': 250}
+        titlelist = []
+        for (i, title) in enumerate(contribs):
+            titlelist.append('%(title{})s'.format(i))
+            query_params['title{}'.format(i)] = title.encode('utf-8')
+
+        self.dbcursor.execute(self.get_neighbourhood_query.format(
+            titlelist=','.join(titlelist)), query_params)
+        nhood = [(row['rev_user'].decode('utf-8'), float(row['assoc']))
+                 for row in self.dbcursor]
+
+        sys.stderr.write("Found {} neighbours\n".format(len(nhood)))
+        return(nhood)
+
+    def gather_candidates(self, lang, username, contribs, nhood, params):
+        '''
+        Gather up the articles edited by the neighbourhood, weighted by
+        association.  Articles the user already edited are left out.
+        Returns a tuple of two dicts, one mapping articles to scores and
+        one mapping articles to number of co-edits by the neighbourhood,
+        and a flag telling if all candidate articles are included.
+
+        If params['aggregation'] is "top-n" we only gather enough to
+        know the top params['nrecs'] articles with at least
+        params['threshold'] co-edits, and only those are returned.
+        If params['sql-mode'] is "join" the articles are gathered by
+        the database, see `gather_candidates_in_db()`.
+
+        :param lang: Language code of the Wikipedia we're recommending for
+        :param username: Name of the user we're recommending to
+        :param contribs: List of articles the user has edited
+        :param nhood: The user's neighbourhood, see `get_neighbourhood()`
+        :param params: Recommendation parameters
+        :type params: dict
+        '''
+        top_n = params['aggregation'] == 'top-n'
+        if lang in self.indexes:
+            if top_n:
+                return(self.gather_top_candidates_from_index(
+                    self.indexes[lang], username, contribs, nhood, params))
+            return(self.gather_candidates_from_index(
+                self.indexes[lang], username, contribs, nhood))
+
+        if params['sql-mode'] == 'join':
+            return(self.gather_candidates_in_db(username, contribs, nhood,
+                                                params))
+
+        if top_n:
+            return(self.gather_top_candidates(lang, username, contribs,
+                                              nhood, params))
+
+        rec_map = {}
+
+        # How many different users have coedited a given item with something
+        # in the basket
+        coedit_count = {}
 
         # Gather up preds
-        for user in nhood: 
-            # sys.stderr.write("user {} assoc {} shared {}\n".format(user, user_assoc[user], user_shared[user]))
+        for (user, assoc) in nhood:
+            # sys.stderr.write("user {} assoc {}\n".format(user, assoc))
 
             # Find other items they've rated
-            self.dbcursor.execute(self.get_articles_by_user_query,
-                                  {'username' : user.encode('utf-8')})
-            for row in self.dbcursor:
-                new_item = row['rev_title'].decode('utf-8')
-                rec_map[new_item] = rec_map.get(new_item, 0) + \
-                                    user_assoc[user]
+            for new_item in self.get_user_articles(user):
+                rec_map[new_item] = rec_map.get(new_item, 0) + assoc
                 coedit_count[new_item] = coedit_count.get(new_item, 0) + 1
 
         # sys.stderr.write("Gathered predictions from neighbourhood, now have {} recs\n".format(len(rec_map)))
                 
-        # Take out items already given 
-        for item in contribs:
+        # Take out items already given, and items from user
+        for item in self.get_excluded_articles(lang, username, contribs):
             if item in rec_map:
                 del(rec_map[item])
 
-        # sys.stderr.write("Took out existing contribs, now {} recs\n".format(len(rec_map)))
-                
-        # Take out items from user
-        self.dbcursor.execute(self.get_articles_by_user_query,
-                              {'username': user_for_query.encode('utf-8')})
-        for row in self.dbcursor:
-            page_title = row['rev_title'].decode('utf-8')
-            if page_title in rec_map:
-                del(rec_map[page_title])
-
         # sys.stderr.write("Took out all known articles by user, now {} recs\n".format(len(rec_map)))
         
-        # Filter by coedit thresh
-        rec_map = {k:v for k,v in rec_map.items()
-                   if coedit_count[k] >= params['threshold']}
+        return(rec_map, coedit_count, True)
 
-        # sys.stderr.write("Filtered by coedit threshold, now {} recs\n".format(len(rec_map)))
-        
-        # Done with the database, disconnect
-        self.dbconn = None
-        self.dbcursor = None
-        sbdb.disconnect()
-        
-        # Rank 'em and spit out 'nrecs' of them
-        for (item, value) in sorted(rec_map.items(),
-                                    key=itemgetter(1),
-                                    reverse=True)[:params['nrecs']]:
-            recs.append({'item': item,
-                         'value': value})
-        return(recs)
+    def get_excluded_articles(self, lang, username, contribs):
+        '''
+        Get the set of articles we should not recommend to `username`:
+        those in `contribs` and everything else they edited.
 
-    def user_association(self, user, basket_ref, exp_threshold):
+        :param lang: Language code of the Wikipedia we're recommending for
+        :param username: Name of the user we're recommending to
+        :param contribs: List of articles the user has edited
+        '''
+        exclude = set(contribs)
+        if lang in self.indexes:
+            index = self.indexes[lang]
+            user_id = index.user_ids.get(username)
+            if user_id is not None:
+                (user_titles, _, _) = index.user_row(user_id)
+                exclude.update(index.titles[title] for title in user_titles)
+            return(exclude)
+
+        exclude.update(self.get_user_articles(username))
+        return(exclude)
+
+    def get_item_based_candidates(self, lang, username, contribs):
+        '''
+        Find candidate articles by merging the precomputed lists of
+        articles similar to the ones in `contribs`.  Articles the user
+        already edited are left out.  Returns a tuple of two dicts, one
+        mapping articles to their summed similarity, and one mapping
+        articles to the number of articles in `contribs` they are
+        similar to, which is what the co-edit threshold applies to.
+
+        :param lang: Language code of the Wikipedia we're recommending for
+        :param username: Name of the user we're recommending to
+        :param contribs: List of articles the user has edited
+        '''
+        (rec_map, coedit_count) = self.similarity_tables[lang].merge(contribs)
+        for item in self.get_excluded_articles(lang, username, contribs):
+            if item in rec_map:
+                del(rec_map[item])
+        return(rec_map, coedit_count)
+
+    def gather_candidates_in_db(self, username, contribs, nhood, params):
+        '''
+        Gather up the articles edited by the neighbourhood with a single
+        grouped query, see `prepare_queries()`.  Only articles with enough
+        co-edits to be recommended at the lowest threshold we can back off
+        to are returned, so the result is complete for `get_recs()`.
+        See `gather_candidates()` for parameters and return value.
+        '''
+        if not nhood or not contribs:
+            return({}, {}, True)
+
+        min_coedits = params['threshold']
+        if params['backoff']:
+            min_coedits = min(min_coedits, params['min-threshold'])
+
+        query_params = {'username': username.encode('utf-8'),
+                        'min_coedits': min_coedits}
+
+        # The neighbourhood as a derived table, one row per neighbour
+        neighbours = []
+        for (i, (user, assoc)) in enumerate(nhood):
+            neighbours.append(
+                'SELECT %(user{0})s AS nh_user, %(assoc{0})s * 1.0E0 AS nh_assoc'.format(i))
+            query_params['user{}'.format(i)] = user.encode('utf-8')
+            query_params['assoc{}'.format(i)] = assoc
+
+        titlelist = []
+        for (i, title) in enumerate(contribs):
+            titlelist.append('%(title{})s'.format(i))
+            query_params['title{}'.format(i)] = title.encode('utf-8')
+
+        rec_map = {}
+        coedit_count = {}
+        self.dbcursor.execute(self.get_candidates_query.format(
+            nhood=' UNION ALL '.join(neighbours),
+            titlelist=','.join(titlelist)), query_params)
+        for row in self.dbcursor:
+            title = row['rev_title'].decode('utf-8')
+            rec_map[title] = float(row['score'])
+            coedit_count[title] = row['coedits']
+
+        return(rec_map, coedit_count, True)
+
+    def gather_top_candidates(self, lang, username, contribs, nhood, params):
+        '''
+        Gather candidates from the neighbourhood in descending order of
+        association, stopping once the neighbours we have not visited can
+        no longer change the top params['nrecs'] articles.  The scores and
+        co-edit counts of the top articles are then completed with a single
+        query.  See `gather_candidates()` for parameters and return value.
+
+        Each neighbour can add at most their association times the number of
+        revisions they made to a single article (from the user statistics
+        table) to an article's score.  If a neighbour is missing from that
+        table we cannot bound their contribution and have to visit them.
+        '''
+        exclude = self.get_excluded_articles(lang, username, contribs)
+        aggregator = TopNAggregator(params['nrecs'], params['threshold'])
+
+        # Articles are numbered in the order we first see them
+        title_ids = {}
+        titles = []
+
+        user_stats = sus.get_user_stats(self.dbcursor, lang,
+                                        [user for (user, assoc) in nhood])
+        bounds = np.array(
+            [assoc * user_stats[user]['max_article_edits']
+             if user in user_stats else np.inf
+             for (user, assoc) in nhood], dtype=np.float64)
+        # remaining[i] = most that neighbours i, i+1, ... can add
+        remaining = np.append(np.cumsum(bounds[::-1])[::-1], 0.0)
+
+        num_visited = len(nhood)
+        for (i, (user, assoc)) in enumerate(nhood):
+            if i and not i % TOPN_CHECK_INTERVAL \
+               and aggregator.can_stop(remaining[i]):
+                num_visited = i
+                break
+
+            edited = []
+            excluded = []
+            for new_item in self.get_user_articles(user):
+                if new_item not in title_ids:
+                    title_ids[new_item] = len(titles)
+                    titles.append(new_item)
+                    if new_item in exclude:
+                        excluded.append(title_ids[new_item])
+                edited.append(title_ids[new_item])
+
+            # One row per revision, so count the revisions per article
+            (edited, nrevs) = np.unique(np.array(edited, dtype=np.int64),
+                                        return_counts=True)
+            aggregator.exclude(np.array(excluded, dtype=np.int64))
+            aggregator.add(edited, nrevs, assoc)
+
+        if num_visited == len(nhood):
+            item_ids = aggregator.candidates()
+        else:
+            sys.stderr.write("Stopped aggregation after {} of {} neighbours\n".format(num_visited, len(nhood)))
+
+            # Complete the scores of the top articles with the co-edits
+            # of the neighbours we did not visit.
+            (item_ids, nth_score) = aggregator.top()
+            item_ids = np.sort(item_ids)
+            unvisited = dict(nhood[num_visited:])
+            users = list(unvisited)
+            items = [titles[item_id] for item_id in item_ids.tolist()]
+
+            coedited = []
+            coedit_scores = []
+            self.dbcursor.execute(
+                self.get_coedits_query.format(
+                    userlist=','.join(['%s'] * len(users)),
+                    titlelist=','.join(['%s'] * len(items))),
+                [user.encode('utf-8') for user in users] \
+                + [item.encode('utf-8') for item in items])
+            for row in self.dbcursor:
+                coedited.append(title_ids[row['rev_title'].decode('utf-8')])
+                coedit_scores.append(
+                    unvisited[row['rev_user'].decode('utf-8')])
+
+            aggregator.update(np.array(coedited, dtype=np.int64),
+                              np.array(coedit_scores, dtype=np.float64),
+                              np.ones(len(coedited), dtype=np.int64))
+
+        (scores, counts) = aggregator.result(item_ids)
+        rec_map = {}
+        coedit_count = {}
+        for (item_id, score, count) in zip(item_ids.tolist(), scores.tolist(),
+                                           counts.tolist()):
+            rec_map[titles[item_id]] = score
+            coedit_count[titles[item_id]] = count
+
+        return(rec_map, coedit_count, num_visited == len(nhood))
+
+    def gather_candidates_from_index(self, index, username, contribs, nhood):
+        '''
+        Gather candidate articles using the in-memory co-edit index
+        instead of querying the revision table.  Gives the same results
+        as the SQL path for the same neighbourhood, see
+        `gather_candidates()`.
+
+        :param index: The co-edit index of the Wikipedia we're recommending for
+        :type index: CoeditIndex
+        :param username: Name of the user we're recommending to
+        :param contribs: List of articles the user has edited
+        :param nhood: The user's neighbourhood, see `get_neighbourhood()`
+        '''
+        (users, assoc) = nhood
+        if not len(users):
+            return({}, {}, True)
+
+        (edited, scores, coedit_count) = index.aggregate(users, assoc)
+
+        # Take out items already given, and any other item edited by the user
+        exclude = set(contribs)
+        user_id = index.user_ids.get(username)
+        if user_id is not None:
+            (user_titles, _, _) = index.user_row(user_id)
+            exclude.update(index.titles[title] for title in user_titles)
+
+        rec_map = {}
+        coedit_map = {}
+        for (title_id, score, count) in zip(edited.tolist(), scores.tolist(),
+                                            coedit_count.tolist()):
+            item = index.titles[title_id]
+            if item in exclude:
+                continue
+            rec_map[item] = score
+            coedit_map[item] = count
+
+        return(rec_map, coedit_map, True)
+
+    def gather_top_candidates_from_index(self, index, username, contribs,
+                                         nhood, params):
+        '''
+        Top-N aggregation using the in-memory co-edit index, see
+        `gather_top_candidates()`.  The index knows how many revisions
+        each neighbour made to a single article, so every neighbour
+        has a bound.
+
+        :param index: The co-edit index of the Wikipedia we're recommending for
+        :type index: CoeditIndex
+        '''
+        (users, assoc) = nhood
+
+        aggregator = TopNAggregator(params['nrecs'], params['threshold'],
+                                    size=len(index.titles))
+        aggregator.exclude(index.get_title_ids(contribs))
+        user_id = index.user_ids.get(username)
+        if user_id is not None:
+            (user_titles, _, _) = index.user_row(user_id)
+            aggregator.exclude(user_titles)
+
+        bounds = assoc * index.user_maxrevs[users]
+        # remaining[i] = most that neighbours i, i+1, ... can add
+        remaining = np.append(np.cumsum(bounds[::-1])[::-1], 0.0)
+
+        # Neighbours are visited in blocks, checking in between
+        num_visited = len(users)
+        for start in range(0, len(users), TOPN_CHECK_INTERVAL):
+            if start and aggregator.can_stop(remaining[start]):
+                num_visited = start
+                break
+
+            block = slice(start, start + TOPN_CHECK_INTERVAL)
+            (titles, nrevs, row_idx) = index.user_rows(users[block])
+            aggregator.update(titles, assoc[block][row_idx] * nrevs, nrevs)
+
+        if num_visited == len(users):
+            title_ids = np.sort(aggregator.candidates())
+        else:
+            sys.stderr.write("Stopped aggregation after {} of {} neighbours\n".format(num_visited, len(users)))
+
+            # Complete the scores of the top articles with the co-edits
+            # of the neighbours we did not visit.
+            (title_ids, nth_score) = aggregator.top()
+            title_ids = np.sort(title_ids)
+            (scores, counts) = index.aggregate_titles(
+                title_ids, users[num_visited:], assoc[num_visited:])
+            aggregator.update(title_ids, scores, counts)
+
+        (scores, counts) = aggregator.result(title_ids)
+        rec_map = {}
+        coedit_map = {}
+        for (title_id, score, count) in zip(title_ids.tolist(),
+                                            scores.tolist(), counts.tolist()):
+            rec_map[index.titles[title_id]] = score
+            coedit_map[index.titles[title_id]] = count
+
+        return(rec_map, coedit_map, num_visited == len(users))
+
+    def get_article_editors(self, title):
+        '''
+        Get the users who edited the given article.  Returns a tuple of
+        two lists, users with non-minor, non-reverting edits, and users
+        with minor edits or reverts.
+
+        :param title: Title of the article
+        :type title: str
+        '''
+        if self.batch_cache is not None \
+           and title in self.batch_cache['article_editors']:
+            return(self.batch_cache['article_editors'][title])
+
+        major_editors = []
+        self.dbcursor.execute(self.get_users_by_article_query,
+                              {'title': title.encode('utf-8')})
+        for row in self.dbcursor:
+            major_editors.append(row['rev_user'].decode('utf-8'))
+
+        minor_editors = []
+        self.dbcursor.execute(self.get_minor_users_by_article_query,
+                              {'title': title.encode('utf-8')})
+        for row in self.dbcursor:
+            minor_editors.append(row['rev_user'].decode('utf-8'))
+
+        if self.batch_cache is not None:
+            self.batch_cache['article_editors'][title] = (major_editors,
+                                                          minor_editors)
+        return(major_editors, minor_editors)
+
+    def get_user_articles(self, user, expert=False):
+        '''
+        Get the articles the given user edited, with one entry per revision.
+
+        :param user: The user we're examining.
+        :param expert: Only use non-minor, non-reverting revisions?
+        :type expert: bool
+        '''
+        if self.batch_cache is not None \
+           and (user, expert) in self.batch_cache['user_articles']:
+            return(self.batch_cache['user_articles'][(user, expert)])
+
+        user_query = self.get_articles_by_user_query
+        if expert:
+            user_query = self.get_articles_by_expert_user_query
+
+        self.dbcursor.execute(user_query,
+                              {'username': user.encode('utf-8')})
+        articles = [row['rev_title'].decode('utf-8')
+                    for row in self.dbcursor]
+
+        if self.batch_cache is not None:
+            self.batch_cache['user_articles'][(user, expert)] = articles
+        return(articles)
+
+    def get_users_articles(self, users, experts):
+        '''
+        Get the articles edited by each of the given users, with one
+        entry per revision, using one query for every `USER_BATCH_SIZE`
+        users.  Returns a dict mapping usernames to lists of articles.
+
+        :param users: The users we're examining.
+        :type users: list
+        :param experts: Maps each user to whether we only use their
+                        non-minor, non-reverting revisions
+        :type experts: dict
+        '''
+        user_articles = {}
+        cached = {}
+        if self.batch_cache is not None:
+            cached = self.batch_cache['user_articles']
+
+        to_fetch = []
+        for user in users:
+            if (user, experts[user]) in cached:
+                user_articles[user] = cached[(user, experts[user])]
+            else:
+                user_articles[user] = []
+                to_fetch.append(user)
+
+        for i in range(0, len(to_fetch), USER_BATCH_SIZE):
+            batch = to_fetch[i:i + USER_BATCH_SIZE]
+            self.dbcursor.execute(
+                self.get_articles_by_users_query.format(
+                    userlist=','.join(['%s'] * len(batch))),
+                [user.encode('utf-8') for user in batch])
+            for row in self.dbcursor:
+                user = row['rev_user'].decode('utf-8')
+                if experts[user] and (row['rev_is_minor'] \
+                                      or row['rev_comment_is_revert']):
+                    continue
+                user_articles[user].append(row['rev_title'].decode('utf-8'))
+
+        if self.batch_cache is not None:
+            for user in to_fetch:
+                cached[(user, experts[user])] = user_articles[user]
+        return(user_articles)
+
+    def get_edit_counts(self, lang, users):
+        '''
+        Get the edit counts of the given users in one query from the
+        user statistics table.  Users missing from it (e.g. if the table
+        lags behind the revision table) are counted the old way.
+        Returns a dict mapping usernames to edit counts.
+
+        :param lang: Language code of the Wikipedia we're recommending for
+        :param users: The users we're examining.
+        :type users: iterable
+        '''
+        cached = {}
+        if self.batch_cache is not None:
+            cached = self.batch_cache['edit_counts']
+
+        users = list(users)
+        edit_counts = sus.get_edit_counts(
+            self.dbcursor, lang, [user for user in users
+                                  if user not in cached])
+        for user in users:
+            if user in cached:
+                edit_counts[user] = cached[user]
+            elif user not in edit_counts:
+                edit_counts[user] = self.get_editcount(user)
+
+        if self.batch_cache is not None:
+            cached.update(edit_counts)
+        return(edit_counts)
+
+    def get_editcount(self, user):
+        '''
+        Count the number of edits the given user has made (in our dataset).
+
+        :param user: The user we're examining.
+        '''
+        self.dbcursor.execute(self.get_editcount_query,
+                              {'username': user.encode('utf-8')})
+        row = self.dbcursor.fetchone()
+        self.dbcursor.fetchall() # flush cursor
+        return(row['num_edits'])
+
+    def user_association(self, user, basket_ref, exp_threshold,
+                         editcount=None):
         '''
         Calculate the association between the given user and a list of edits.
         
         :param user: The user we're examining.
         :param contribs: A list of edits we're comparing `user` to.
         :param exp_threshold: Threshold for being an "expert" user.
+        :param editcount: The user's number of edits, if already known.
         '''
         shared = 0
         user_edits_ref = {}
@@ -347,24 +1376,12 @@ class Recommender:
         # If they are (as defined by filter-threshold) we'll only use
         # non-minor, non-reverting article edits for comparison.
         # Otherwise, we use all articles the user edited.
-        self.dbcursor.execute(self.get_editcount_query,
-                              {'username': user.encode('utf-8')})
-        row = self.dbcursor.fetchone()
-        self.dbcursor.fetchall() # flush cursor
-        user_editcount = row['num_edits']
+        user_editcount = editcount
+        if user_editcount is None:
+            user_editcount = self.get_editcount(user)
 
-        user_query = self.get_articles_by_user_query # default is non-expert
-        if user_editcount >= exp_threshold:
-            # sys.stderr.write("User {} is expert.\n".format(user))
-            user_query = self.get_articles_by_expert_user_query
-        else:
-            # sys.stderr.write("User {} is not expert.\n".format(user))
-            pass
-            
-        self.dbcursor.execute(user_query,
-                              {'username': user.encode('utf-8')})
-        for row in self.dbcursor:
-            page_title = row['rev_title'].decode('utf-8')
+        for page_title in self.get_user_articles(
+                user, expert=(user_editcount >= exp_threshold)):
             user_edits_ref[page_title] = 1
 
         for item in basket_ref:
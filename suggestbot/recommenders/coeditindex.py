@@ -0,0 +1,711 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+In-memory sparse index of which users edited which articles, used by
+the co-edit recommender to avoid per-article and per-user SQL queries.
+
+The index is a bipartite user/article graph stored twice, once in
+compressed sparse row order (grouped by user) and once in compressed
+sparse column order (grouped by article).  Users and article titles are
+interned to integer IDs.  Each (user, article) pair records the number
+of revisions the user made to the article and flags telling us whether
+any of them were non-minor/non-reverting ("major") or minor/reverting.
+
+Copyright (C) 2016 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+'''
+
+import os
+import json
+import shutil
+import logging
+
+from array import array
+from datetime import datetime
+
+import numpy as np
+import scipy.sparse as sps
+import MySQLdb
+
+from suggestbot import config
+from suggestbot import db
+
+# Flags set on a (user, article) pair
+MAJOR = 1 # at least one non-minor, non-reverting edit
+MINOR = 2 # at least one minor or reverting edit
+
+# Version of the snapshot format, bumped when it changes
+SNAPSHOT_VERSION = 1
+
+# Arrays stored in a snapshot, one .npy file each
+SNAPSHOT_ARRAYS = ['user_offsets', 'user_titles', 'user_flags', 'user_nrevs',
+                   'title_offsets', 'title_users', 'title_flags',
+                   'title_nrevs', 'user_editcount', 'user_nmajor',
+                   'user_maxrevs']
+
+# Format of timestamps in a snapshot header
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+class CoeditIndex:
+    def __init__(self, lang):
+        '''
+        Instantiate an empty index.  Use `from_revisions()` or
+        `from_database()` to get one with data in it.
+
+        :param lang: Language code of the Wikipedia this index covers
+        :type lang: str
+        '''
+        self.lang = lang
+
+        # Interned users and article titles, mapping IDs to names
+        # and names to IDs.
+        self.users = []
+        self.titles = []
+        self.user_ids = {}
+        self.title_ids = {}
+
+        # Rows grouped by user: articles, flags, and number of revisions
+        self.user_offsets = np.zeros(1, dtype=np.int64)
+        self.user_titles = np.zeros(0, dtype=np.int32)
+        self.user_flags = np.zeros(0, dtype=np.uint8)
+        self.user_nrevs = np.zeros(0, dtype=np.int32)
+
+        # Columns grouped by article: users, flags, and number of revisions
+        self.title_offsets = np.zeros(1, dtype=np.int64)
+        self.title_users = np.zeros(0, dtype=np.int32)
+        self.title_flags = np.zeros(0, dtype=np.uint8)
+        self.title_nrevs = np.zeros(0, dtype=np.int32)
+
+        # Per-user statistics: total number of revisions (what the SQL
+        # path gets from count(*)), and number of articles with
+        # non-minor, non-reverting edits.
+        self.user_editcount = np.zeros(0, dtype=np.int64)
+        self.user_nmajor = np.zeros(0, dtype=np.int32)
+
+        # Most revisions a user made to any single article, which bounds
+        # how much they can add to the score of a candidate article.
+        self.user_maxrevs = np.zeros(0, dtype=np.int32)
+
+        # Sparse user x article matrices used for batch association
+        # scoring, one with all edited articles and one with only articles
+        # with non-minor, non-reverting edits.  Created when first needed.
+        self._edit_matrix = None
+        self._major_matrix = None
+
+        # Timestamp of the most recent revision in the index
+        self.max_timestamp = None
+
+    def __len__(self):
+        '''
+        Number of (user, article) pairs in the index.
+        '''
+        return(len(self.user_titles))
+
+    @classmethod
+    def from_revisions(cls, lang, revisions):
+        '''
+        Build an index from an iterable of revisions.
+
+        :param lang: Language code of the Wikipedia the revisions are from
+        :type lang: str
+
+        :param revisions: iterable of (username, title, is_major) tuples,
+                          where `is_major` is true if the revision is neither
+                          minor nor a revert.
+        '''
+        index = cls(lang)
+        index.add_revisions(revisions)
+        return(index)
+
+    @classmethod
+    def from_database(cls, lang):
+        '''
+        Build an index from the revision table of the given language.
+        Returns None if we're unable to read the revision table.
+
+        :param lang: Language code of the Wikipedia we're indexing
+        :type lang: str
+        '''
+        logging.info("building co-edit index for {}wiki".format(lang))
+        index = cls(lang)
+        if index.update_from_database() is None:
+            return(None)
+        return(index)
+
+    def update_from_database(self):
+        '''
+        Add the revisions in the revision table that are newer than the
+        most recent revision in the index, or all of them if the index is
+        empty.  Returns the number of revisions added, or None if we're
+        unable to read the revision table.
+
+        Revisions the recent changes daemon has since expired from the
+        revision table are not removed, rebuild the index to drop those.
+        '''
+
+        # Query to get every revision in the table, or only those newer
+        # than a given timestamp.  Both stop at the most recent timestamp
+        # when we started, so revisions added while we read the table are
+        # picked up by the next update.  We let the database work out the
+        # major/minor distinction to avoid handling BIT columns.
+        get_revisions_query = """
+            SELECT rev_user, rev_title,
+                   (rev_is_minor=0 AND rev_comment_is_revert=0) AS is_major
+            FROM {}
+            WHERE rev_timestamp <= %(mostrecent)s""".format(
+                config.revision_table[self.lang])
+
+        get_newer_revisions_query = """
+            SELECT rev_user, rev_title,
+                   (rev_is_minor=0 AND rev_comment_is_revert=0) AS is_major
+            FROM {}
+            WHERE rev_timestamp > %(timestamp)s
+            AND rev_timestamp <= %(mostrecent)s""".format(
+                config.revision_table[self.lang])
+
+        get_max_timestamp_query = """
+            SELECT MAX(rev_timestamp) AS mostrecent
+            FROM {}""".format(config.revision_table[self.lang])
+
+        sbdb = db.SuggestBotDatabase()
+        if not sbdb.connect():
+            logging.error("Unable to connect to the SuggestBot database")
+            return(None)
+
+        (dbconn, dbcursor) = sbdb.getConnection()
+
+        try:
+            dbcursor.execute(get_max_timestamp_query)
+            row = dbcursor.fetchone()
+            dbcursor.fetchall() # flush cursor
+            max_timestamp = row['mostrecent']
+
+            # Stream the revisions with a server-side cursor, the table
+            # is far too large to fetch in one go.
+            with db.cursor(dbconn, 'ss') as ss_cursor:
+                if self.max_timestamp is None:
+                    ss_cursor.execute(get_revisions_query,
+                                      {'mostrecent': max_timestamp})
+                else:
+                    ss_cursor.execute(get_newer_revisions_query,
+                                      {'timestamp': self.max_timestamp,
+                                       'mostrecent': max_timestamp})
+                num_revisions = self.add_revisions(
+                    ((user.decode('utf-8'), title.decode('utf-8'), is_major)
+                     for (user, title, is_major) in ss_cursor))
+        except MySQLdb.Error as e:
+            logging.error("Unable to read revisions for {}wiki".format(
+                self.lang))
+            logging.error("Error {0}: {1}".format(e.args[0], e.args[1]))
+            sbdb.disconnect()
+            return(None)
+
+        sbdb.disconnect()
+
+        if max_timestamp is not None:
+            self.max_timestamp = max_timestamp
+        logging.info("co-edit index for {}wiki has {} users, {} articles, and {} user/article pairs".format(self.lang, len(self.users), len(self.titles), len(self)))
+        return(num_revisions)
+
+    def save(self, path):
+        '''
+        Write a snapshot of the index to the given directory.  The
+        snapshot is written to a temporary directory first and then
+        swapped in, so processes reading the old one are unaffected.
+
+        :param path: Path to the snapshot directory
+        :type path: str
+        '''
+        new_path = '{}.new'.format(path)
+        old_path = '{}.old'.format(path)
+        if os.path.isdir(new_path):
+            shutil.rmtree(new_path)
+        os.makedirs(new_path)
+
+        for name in SNAPSHOT_ARRAYS:
+            np.save(os.path.join(new_path, '{}.npy'.format(name)),
+                    getattr(self, name))
+        for (name, values) in [('users', self.users),
+                               ('titles', self.titles)]:
+            with open(os.path.join(new_path, '{}.txt'.format(name)), 'w',
+                      encoding='utf-8') as outfile:
+                for value in values:
+                    outfile.write('{}\n'.format(value))
+
+        max_timestamp = None
+        if self.max_timestamp is not None:
+            max_timestamp = self.max_timestamp.strftime(TIMESTAMP_FORMAT)
+        with open(os.path.join(new_path, 'header.json'), 'w') as outfile:
+            json.dump({'version': SNAPSHOT_VERSION,
+                       'lang': self.lang,
+                       'max_timestamp': max_timestamp,
+                       'num_users': len(self.users),
+                       'num_titles': len(self.titles),
+                       'num_pairs': len(self)},
+                      outfile)
+
+        if os.path.isdir(path):
+            os.rename(path, old_path)
+        os.rename(new_path, path)
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+        logging.info("saved co-edit index snapshot for {}wiki to {}".format(
+            self.lang, path))
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Load an index from a snapshot directory, memory-mapping the arrays
+        so processes loading the same snapshot share their pages through
+        the OS page cache.  Returns None if the directory does not contain
+        a snapshot we can read.
+
+        :param path: Path to the snapshot directory
+        :type path: str
+        '''
+        try:
+            with open(os.path.join(path, 'header.json')) as infile:
+                header = json.load(infile)
+        except (IOError, ValueError):
+            logging.warning("Unable to read co-edit index snapshot header in {}".format(path))
+            return(None)
+
+        if header.get('version') != SNAPSHOT_VERSION:
+            logging.warning("Co-edit index snapshot in {} has version {}, expected {}".format(path, header.get('version'), SNAPSHOT_VERSION))
+            return(None)
+
+        index = cls(header['lang'])
+        for name in SNAPSHOT_ARRAYS:
+            setattr(index, name,
+                    np.load(os.path.join(path, '{}.npy'.format(name)),
+                            mmap_mode='r'))
+        with open(os.path.join(path, 'users.txt'), encoding='utf-8') as infile:
+            index.users = [line.rstrip('\n') for line in infile]
+        with open(os.path.join(path, 'titles.txt'), encoding='utf-8') as infile:
+            index.titles = [line.rstrip('\n') for line in infile]
+        index.user_ids = {user: user_id for (user_id, user)
+                          in enumerate(index.users)}
+        index.title_ids = {title: title_id for (title_id, title)
+                           in enumerate(index.titles)}
+        if header['max_timestamp'] is not None:
+            index.max_timestamp = datetime.strptime(header['max_timestamp'],
+                                                    TIMESTAMP_FORMAT)
+
+        if len(index) != header['num_pairs'] \
+           or len(index.users) != header['num_users'] \
+           or len(index.titles) != header['num_titles']:
+            logging.warning("Co-edit index snapshot in {} is inconsistent".format(path))
+            return(None)
+
+        logging.info("loaded co-edit index snapshot for {}wiki with revisions up to {}".format(index.lang, index.max_timestamp))
+        return(index)
+
+    def _intern_user(self, username):
+        try:
+            return(self.user_ids[username])
+        except KeyError:
+            user_id = len(self.users)
+            self.user_ids[username] = user_id
+            self.users.append(username)
+            return(user_id)
+
+    def _intern_title(self, title):
+        try:
+            return(self.title_ids[title])
+        except KeyError:
+            title_id = len(self.titles)
+            self.title_ids[title] = title_id
+            self.titles.append(title)
+            return(title_id)
+
+    def add_revisions(self, revisions):
+        '''
+        Add revisions to the index, merging them with the (user, article)
+        pairs we already have.  Returns the number of revisions added.
+
+        :param revisions: iterable of (username, title, is_major) tuples,
+                          where `is_major` is true if the revision is neither
+                          minor nor a revert.
+        '''
+        n_old_users = len(self.user_offsets) - 1
+
+        rev_users = array('l')
+        rev_titles = array('l')
+        rev_major = array('b')
+        for (username, title, is_major) in revisions:
+            rev_users.append(self._intern_user(username))
+            rev_titles.append(self._intern_title(title))
+            rev_major.append(1 if is_major else 0)
+
+        if not len(rev_users):
+            return(0)
+
+        n_titles = len(self.titles)
+
+        # Each (user, article) pair gets a unique key, sorting on it
+        # groups the pairs by user, then by article.
+        keys = np.array(rev_users, dtype=np.int64) * n_titles \
+               + np.array(rev_titles, dtype=np.int64)
+        (pairs, inverse) = np.unique(keys, return_inverse=True)
+        nrevs = np.bincount(inverse, minlength=len(pairs))
+        nmajor = np.bincount(inverse, weights=np.array(rev_major, dtype=np.int8),
+                             minlength=len(pairs))
+        flags = (np.where(nmajor > 0, MAJOR, 0) \
+                 | np.where(nrevs > nmajor, MINOR, 0)).astype(np.uint8)
+
+        # Merge with the pairs already in the index
+        if len(self.user_titles):
+            old_users = np.repeat(np.arange(n_old_users, dtype=np.int64),
+                                  np.diff(self.user_offsets))
+            old_keys = old_users * n_titles + self.user_titles
+            (pairs, inverse) = np.unique(np.concatenate((old_keys, pairs)),
+                                         return_inverse=True)
+            nrevs = np.bincount(
+                inverse, weights=np.concatenate((self.user_nrevs, nrevs)),
+                minlength=len(pairs))
+            merged_flags = np.zeros(len(pairs), dtype=np.uint8)
+            np.bitwise_or.at(merged_flags, inverse,
+                             np.concatenate((self.user_flags, flags)))
+            flags = merged_flags
+
+        self._build(pairs, nrevs, flags)
+        return(len(rev_users))
+
+    def _build(self, pairs, nrevs, flags):
+        '''
+        Build the row and column representations from sorted
+        (user, article) pair keys, with the number of revisions
+        and flags of each pair.
+        '''
+        n_users = len(self.users)
+        n_titles = len(self.titles)
+
+        pair_users = (pairs // max(n_titles, 1)).astype(np.int32)
+        pair_titles = (pairs % max(n_titles, 1)).astype(np.int32)
+
+        self.user_titles = pair_titles
+        self.user_flags = np.asarray(flags, dtype=np.uint8)
+        self.user_nrevs = nrevs.astype(np.int32)
+        self.user_offsets = np.zeros(n_users + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_users, minlength=n_users),
+                  out=self.user_offsets[1:])
+
+        # Re-sort by article (stable, so users stay sorted within an article)
+        order = np.argsort(pair_titles, kind='stable')
+        self.title_users = pair_users[order]
+        self.title_flags = self.user_flags[order]
+        self.title_nrevs = self.user_nrevs[order]
+        self.title_offsets = np.zeros(n_titles + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_titles, minlength=n_titles),
+                  out=self.title_offsets[1:])
+
+        self.user_editcount = np.bincount(
+            pair_users, weights=nrevs, minlength=n_users).astype(np.int64)
+        self.user_nmajor = np.bincount(
+            pair_users, weights=(flags & MAJOR), minlength=n_users
+        ).astype(np.int32)
+        self.user_maxrevs = np.zeros(n_users, dtype=np.int32)
+        np.maximum.at(self.user_maxrevs, pair_users, self.user_nrevs)
+
+        # Matrices are out of date
+        self._edit_matrix = None
+        self._major_matrix = None
+
+    def get_title_ids(self, titles):
+        '''
+        Translate article titles to title IDs, skipping unknown articles.
+
+        :param titles: article titles
+        :type titles: iterable
+        '''
+        return(np.array([self.title_ids[title] for title in titles
+                         if title in self.title_ids], dtype=np.int32))
+
+    def user_row(self, user_id):
+        '''
+        Get the articles, flags, and number of revisions for a given user.
+        '''
+        start = self.user_offsets[user_id]
+        end = self.user_offsets[user_id + 1]
+        return(self.user_titles[start:end],
+               self.user_flags[start:end],
+               self.user_nrevs[start:end])
+
+    def user_rows(self, user_ids):
+        '''
+        Get the articles and number of revisions for several users at once.
+        Returns a tuple of (title IDs, number of revisions, index into
+        `user_ids` of the user each entry belongs to).
+
+        :param user_ids: IDs of the users
+        :type user_ids: numpy.ndarray
+        '''
+        (positions, row_idx) = self._gather(self.user_offsets, user_ids)
+        return(self.user_titles[positions], self.user_nrevs[positions],
+               row_idx)
+
+    def title_row(self, title_id):
+        '''
+        Get the users, flags, and number of revisions for a given article.
+        '''
+        start = self.title_offsets[title_id]
+        end = self.title_offsets[title_id + 1]
+        return(self.title_users[start:end],
+               self.title_flags[start:end],
+               self.title_nrevs[start:end])
+
+    def _gather(self, offsets, ids):
+        '''
+        Gather the positions of all entries in the rows with the given IDs
+        from a row/column representation.  Returns a tuple of the positions
+        and the index (into `ids`) of the row each position belongs to.
+        '''
+        starts = offsets[ids]
+        lengths = offsets[ids + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+        row_idx = np.repeat(np.arange(len(ids)), lengths)
+        # position = start of row + offset within row
+        row_starts = np.cumsum(lengths) - lengths
+        positions = starts[row_idx] + (np.arange(total) - row_starts[row_idx])
+        return(positions, row_idx)
+
+    def find_neighbours(self, basket_ids, exclude_user, filter_threshold):
+        '''
+        Find potential neighbours of a basket of articles: every user
+        with a non-minor, non-reverting edit to one of the articles, and
+        every user with a minor or reverting edit to one of the articles
+        who has made fewer than `filter_threshold` edits.
+
+        :param basket_ids: title IDs of the articles in the basket
+        :type basket_ids: numpy.ndarray
+
+        :param exclude_user: user ID of a user who can't be a neighbour,
+                             or None
+        :type exclude_user: int
+
+        :param filter_threshold: number of edits required to be regarded
+                                 as an experienced user
+        :type filter_threshold: int
+        '''
+        (positions, _) = self._gather(self.title_offsets, basket_ids)
+        users = self.title_users[positions]
+        flags = self.title_flags[positions]
+
+        candidates = (flags & MAJOR) > 0
+        candidates |= self.user_editcount[users] < filter_threshold
+        neighbours = np.unique(users[candidates])
+        if exclude_user is not None:
+            neighbours = neighbours[neighbours != exclude_user]
+        return(neighbours)
+
+    def user_association(self, user_id, basket_ids, exp_threshold,
+                         basket_size=None):
+        '''
+        Calculate the association between a user and a basket of articles.
+        Experienced users (at least `exp_threshold` edits) are compared
+        using only their non-minor, non-reverting edits.
+
+        :param user_id: ID of the user we're examining
+        :type user_id: int
+
+        :param basket_ids: title IDs of the articles in the basket
+        :type basket_ids: numpy.ndarray
+
+        :param exp_threshold: threshold for being an "expert" user
+        :type exp_threshold: int
+
+        :param basket_size: size of the basket, if it has articles that
+                            are not in the index
+        :type basket_size: int
+        '''
+        (assoc, shared) = self.batch_association(
+            np.array([user_id], dtype=np.int32), basket_ids,
+            exp_threshold, basket_size)
+        return(float(assoc[0]), int(shared[0]))
+
+    def _matrices(self):
+        '''
+        Get the sparse user x article matrices, creating them if needed.
+        '''
+        if self._edit_matrix is None:
+            shape = (len(self.users), len(self.titles))
+            self._edit_matrix = sps.csr_matrix(
+                (np.ones(len(self.user_titles), dtype=np.float64),
+                 self.user_titles, self.user_offsets), shape=shape)
+            self._major_matrix = sps.csr_matrix(
+                ((self.user_flags & MAJOR).astype(np.float64),
+                 self.user_titles, self.user_offsets), shape=shape)
+        return(self._edit_matrix, self._major_matrix)
+
+    def batch_association(self, user_ids, basket_ids, exp_threshold,
+                          basket_size=None):
+        '''
+        Calculate the association between each of a set of users and
+        a basket of articles in one operation.  Association is the
+        Jaccard coefficient between the basket and the articles a user
+        edited, where experienced users (at least `exp_threshold` edits)
+        are compared using only their non-minor, non-reverting edits.
+
+        Returns a tuple of two arrays, the association and the number
+        of shared articles for each user in `user_ids`.
+
+        :param user_ids: IDs of the users we're examining
+        :type user_ids: numpy.ndarray
+
+        :param basket_ids: title IDs of the articles in the basket
+        :type basket_ids: numpy.ndarray
+
+        :param exp_threshold: threshold for being an "expert" user
+        :type exp_threshold: int
+
+        :param basket_size: size of the basket, if it has articles that
+                            are not in the index
+        :type basket_size: int
+        '''
+        if basket_size is None:
+            basket_size = len(basket_ids)
+
+        (edit_matrix, major_matrix) = self._matrices()
+        basket = np.bincount(basket_ids, minlength=len(self.titles))
+
+        expert = self.user_editcount[user_ids] >= exp_threshold
+        shared = np.where(expert,
+                          major_matrix[user_ids] @ basket,
+                          edit_matrix[user_ids] @ basket).astype(np.int64)
+        n_edited = np.where(expert,
+                            self.user_nmajor[user_ids],
+                            self.user_offsets[user_ids + 1] \
+                            - self.user_offsets[user_ids])
+
+        assoc = shared / (basket_size + n_edited - shared)
+        return(assoc, shared)
+
+    def group_association(self, baskets, exp_threshold, basket_sizes=None):
+        '''
+        Calculate the association between every user and each of a group
+        of baskets of articles, with one sparse matrix product for the
+        whole group.  Association is defined as in `batch_association()`.
+
+        Returns a list with a tuple of three arrays for each basket: the IDs
+        of the users who share at least one article with it, their
+        association, and their number of shared articles.
+
+        :param baskets: title IDs of the articles in each basket, without
+                        duplicates
+        :type baskets: list of numpy.ndarray
+
+        :param exp_threshold: threshold for being an "expert" user
+        :type exp_threshold: int
+
+        :param basket_sizes: size of each basket, if they have articles
+                             that are not in the index
+        :type basket_sizes: list of int
+        '''
+        if basket_sizes is None:
+            basket_sizes = [len(basket) for basket in baskets]
+        if not baskets:
+            return([])
+
+        # Baskets x articles matrix
+        basket_offsets = np.zeros(len(baskets) + 1, dtype=np.int64)
+        np.cumsum([len(basket) for basket in baskets],
+                  out=basket_offsets[1:])
+        basket_matrix = sps.csr_matrix(
+            (np.ones(basket_offsets[-1], dtype=np.float64),
+             np.concatenate(baskets).astype(np.int32), basket_offsets),
+            shape=(len(baskets), len(self.titles)))
+
+        # Baskets x users matrix of shared articles, using only the major
+        # edits of experienced users
+        (edit_matrix, major_matrix) = self._matrices()
+        expert = self.user_editcount >= exp_threshold
+        shared_matrix = sps.csr_matrix(
+            (basket_matrix @ edit_matrix.T).multiply(~expert) \
+            + (basket_matrix @ major_matrix.T).multiply(expert))
+        shared_matrix.eliminate_zeros()
+        shared_matrix.sort_indices()
+
+        n_edited = np.where(expert, self.user_nmajor,
+                            np.diff(self.user_offsets))
+
+        results = []
+        for (i, basket_size) in enumerate(basket_sizes):
+            start = shared_matrix.indptr[i]
+            end = shared_matrix.indptr[i + 1]
+            user_ids = shared_matrix.indices[start:end]
+            shared = shared_matrix.data[start:end].astype(np.int64)
+            assoc = shared / (basket_size + n_edited[user_ids] - shared)
+            results.append((user_ids, assoc, shared))
+        return(results)
+
+    def aggregate(self, user_ids, weights):
+        '''
+        Add up the weights of the given users over every article they edited,
+        once per revision.  Returns a tuple of (title IDs, summed weights,
+        number of revisions) for all articles edited by the users.
+
+        :param user_ids: IDs of the users
+        :type user_ids: numpy.ndarray
+
+        :param weights: weight of each user (e.g. their association)
+        :type weights: numpy.ndarray
+        '''
+        (positions, row_idx) = self._gather(self.user_offsets, user_ids)
+        titles = self.user_titles[positions]
+        nrevs = self.user_nrevs[positions]
+
+        scores = np.bincount(titles, weights=nrevs * weights[row_idx],
+                             minlength=len(self.titles))
+        counts = np.bincount(titles, weights=nrevs,
+                             minlength=len(self.titles))
+        edited = np.flatnonzero(counts)
+        return(edited, scores[edited], counts[edited].astype(np.int64))
+
+    def aggregate_titles(self, title_ids, user_ids, weights):
+        '''
+        Like `aggregate()`, but only for the given articles.  Returns a
+        tuple of (summed weights, number of revisions) for each article
+        in `title_ids`, counting only revisions by the given users.
+
+        :param title_ids: IDs of the articles
+        :type title_ids: numpy.ndarray
+
+        :param user_ids: IDs of the users
+        :type user_ids: numpy.ndarray
+
+        :param weights: weight of each user (e.g. their association)
+        :type weights: numpy.ndarray
+        '''
+        user_weights = np.zeros(len(self.users), dtype=np.float64)
+        user_weights[user_ids] = weights
+        is_selected = np.zeros(len(self.users), dtype=bool)
+        is_selected[user_ids] = True
+
+        (positions, col_idx) = self._gather(self.title_offsets, title_ids)
+        users = self.title_users[positions]
+        keep = is_selected[users]
+        col_idx = col_idx[keep]
+        nrevs = self.title_nrevs[positions][keep]
+
+        scores = np.bincount(col_idx, weights=nrevs * user_weights[users[keep]],
+                             minlength=len(title_ids))
+        counts = np.bincount(col_idx, weights=nrevs,
+                             minlength=len(title_ids))
+        return(scores, counts.astype(np.int64))
@@ -0,0 +1,140 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+MinHash signatures and locality-sensitive hashing (LSH) over the
+non-minor, non-reverting article sets of users in a co-edit index,
+used by the co-edit recommender for approximate neighbour search.
+
+Each user's set of articles with major edits is summarised by a MinHash
+signature of `bands` x `rows` hash values.  Two sets agree on any single
+value with probability equal to their Jaccard similarity, so users whose
+signatures agree on all values in at least one band are likely to be
+similar.  For every band we keep the users sorted on a key made from
+their values in that band, and look candidates up with binary search.
+
+Copyright (C) 2016 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+'''
+
+import logging
+
+import numpy as np
+
+from suggestbot.recommenders.coeditindex import MAJOR
+
+# Multiplier used to combine the hash values in a band into a single key
+BAND_MULTIPLIER = np.uint64(0x100000001b3)
+
+class CoeditLSH:
+    def __init__(self, index, bands, rows, seed=42):
+        '''
+        Build MinHash signatures and LSH tables for all users in the
+        given co-edit index who have at least one major edit.  There
+        is no default number of bands and rows, recall depends heavily
+        on them and on the wiki, see config.coedit_lsh.
+
+        :param index: The co-edit index we're approximating
+        :type index: CoeditIndex
+
+        :param bands: Number of LSH bands
+        :type bands: int
+
+        :param rows: Number of hash values in each band
+        :type rows: int
+
+        :param seed: Seed for picking the hash functions
+        :type seed: int
+        '''
+        self.bands = bands
+        self.rows = rows
+
+        # Multiply-shift hash functions, h(x) = (a*x + b mod 2^64) >> 32
+        # with odd multipliers, one per signature value.
+        rng = np.random.RandomState(seed)
+        self.hash_a = rng.randint(0, 2**63, size=bands*rows,
+                                  dtype=np.int64).astype(np.uint64) * 2 + 1
+        self.hash_b = rng.randint(0, 2**63, size=bands*rows,
+                                  dtype=np.int64).astype(np.uint64)
+
+        # Users with at least one major edit, and the start of each of
+        # their article lists in the major-only CSR arrays.
+        is_major = (index.user_flags & MAJOR) > 0
+        titles = index.user_titles[is_major].astype(np.uint64)
+        self.user_ids = np.flatnonzero(index.user_nmajor > 0).astype(np.int32)
+        starts = np.zeros(len(index.users) + 1, dtype=np.int64)
+        np.cumsum(index.user_nmajor, out=starts[1:])
+        starts = starts[self.user_ids]
+
+        # Per band: the band keys in sorted order, and the users they
+        # belong to.  Signatures are computed a band at a time to keep
+        # memory use down.
+        self.band_keys = []
+        self.band_users = []
+        for band in range(bands):
+            keys = np.zeros(len(self.user_ids), dtype=np.uint64)
+            if len(titles):
+                for i in range(band*rows, (band+1)*rows):
+                    minhash = np.minimum.reduceat(self._hash(titles, i),
+                                                  starts)
+                    keys = keys * BAND_MULTIPLIER + minhash
+            order = np.argsort(keys, kind='stable')
+            self.band_keys.append(keys[order])
+            self.band_users.append(self.user_ids[order])
+
+        logging.info("built LSH tables with {} bands of {} rows for {} users".format(bands, rows, len(self.user_ids)))
+
+    def _hash(self, title_ids, i):
+        '''
+        Apply the i-th hash function to an array of title IDs.
+        '''
+        return(((self.hash_a[i] * title_ids + self.hash_b[i])
+                >> np.uint64(32)))
+
+    def signature_keys(self, title_ids):
+        '''
+        Get the band keys of a set of articles.
+
+        :param title_ids: IDs of the articles
+        :type title_ids: numpy.ndarray
+        '''
+        title_ids = np.asarray(title_ids).astype(np.uint64)
+        keys = []
+        for band in range(self.bands):
+            key = np.zeros(1, dtype=np.uint64)
+            for i in range(band*self.rows, (band+1)*self.rows):
+                key = key * BAND_MULTIPLIER + self._hash(title_ids, i).min()
+            keys.append(key[0])
+        return(keys)
+
+    def candidates(self, title_ids):
+        '''
+        Find users who share a bucket with the given set of articles
+        in at least one band.  Returns an array of user IDs.
+
+        :param title_ids: IDs of the articles
+        :type title_ids: numpy.ndarray
+        '''
+        if not len(title_ids):
+            return(np.zeros(0, dtype=np.int32))
+
+        found = []
+        for (band, key) in enumerate(self.signature_keys(title_ids)):
+            keys = self.band_keys[band]
+            start = np.searchsorted(keys, key, side='left')
+            end = np.searchsorted(keys, key, side='right')
+            found.append(self.band_users[band][start:end])
+        return(np.unique(np.concatenate(found)))
@@ -0,0 +1,268 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Precomputed item-item co-edit similarities, used by the co-edit
+recommender's item-based mode.  For every article we keep the K most
+similar articles, where similarity is the cosine similarity of the sets
+of users who edited them.
+
+The table is computed offline from a co-edit index (see
+bin/update-coedit-similarities.py) and stored in a directory of numpy
+array files that are memory-mapped when loaded:
+
+  header.json     format version, language, K, and most recent revision
+  offsets.npy     int64, start of each article's list in the arrays below
+  neighbours.npy  int32, IDs of the similar articles
+  scores.npy      float32, similarity of each of them
+  titles.txt      UTF-8 article titles, one per line, in ID order
+
+Copyright (C) 2016 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+'''
+
+import os
+import json
+import logging
+
+import numpy as np
+import scipy.sparse as sps
+
+# Version of the on-disk format, bumped when it changes
+FORMAT_VERSION = 1
+
+class ItemSimilarityTable:
+    def __init__(self, lang):
+        '''
+        Instantiate an empty table.  Use `from_index()` or `load()`
+        to get one with data in it.
+
+        :param lang: Language code of the Wikipedia this table covers
+        :type lang: str
+        '''
+        self.lang = lang
+        self.k = 0
+
+        # Article titles, mapping IDs to titles and titles to IDs
+        self.titles = []
+        self.title_ids = {}
+
+        # Lists of similar articles and their similarity, grouped by article
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.neighbours = np.zeros(0, dtype=np.int32)
+        self.scores = np.zeros(0, dtype=np.float32)
+
+        # Timestamp of the most recent revision the table is based on
+        self.max_timestamp = None
+
+    def __len__(self):
+        '''
+        Number of (article, similar article) pairs in the table.
+        '''
+        return(len(self.neighbours))
+
+    @classmethod
+    def from_index(cls, index, k=50, min_coeditors=2,
+                   max_user_articles=5000, block_size=10000):
+        '''
+        Compute the table from a co-edit index.
+
+        :param index: The co-edit index to compute similarities from
+        :type index: CoeditIndex
+
+        :param k: Number of similar articles to keep per article
+        :type k: int
+
+        :param min_coeditors: Minimum number of users two articles need to
+                              have in common to be regarded as similar
+        :type min_coeditors: int
+
+        :param max_user_articles: Users who edited more articles than this
+                                  are left out, they add a lot of work and
+                                  very little information.
+        :type max_user_articles: int
+
+        :param block_size: Number of articles we compute similarities for
+                           at a time, which limits memory use
+        :type block_size: int
+        '''
+        table = cls(index.lang)
+        table.k = k
+        table.titles = list(index.titles)
+        table.title_ids = dict(index.title_ids)
+        table.max_timestamp = index.max_timestamp
+
+        n_users = len(index.users)
+        n_titles = len(index.titles)
+
+        # Binary user x article matrix without the most prolific users
+        n_articles = np.diff(index.user_offsets)
+        keep = np.repeat(n_articles <= max_user_articles, n_articles)
+        rows = np.repeat(np.arange(n_users), n_articles)[keep]
+        edits = sps.csr_matrix(
+            (np.ones(keep.sum(), dtype=np.float32),
+             (rows, index.user_titles[keep])),
+            shape=(n_users, n_titles))
+        edits_t = edits.T.tocsr()
+        n_editors = np.asarray(edits_t.sum(axis=1)).ravel()
+        norms = np.sqrt(np.maximum(n_editors, 1))
+
+        neighbours = []
+        scores = []
+        counts = np.zeros(n_titles, dtype=np.int64)
+        for start in range(0, n_titles, block_size):
+            end = min(start + block_size, n_titles)
+
+            # Number of co-editors between the articles in this block
+            # and all other articles
+            coedits = (edits_t[start:end] @ edits).tocsr()
+            coedits.sort_indices()
+            for i in range(end - start):
+                row_start = coedits.indptr[i]
+                row_end = coedits.indptr[i+1]
+                cols = coedits.indices[row_start:row_end]
+                shared = coedits.data[row_start:row_end]
+
+                keep = (shared >= min_coeditors) & (cols != start + i)
+                cols = cols[keep]
+                sims = shared[keep] / (norms[start + i] * norms[cols])
+                if len(sims) > k:
+                    top = np.argpartition(-sims, k)[:k]
+                    cols = cols[top]
+                    sims = sims[top]
+                order = np.argsort(-sims, kind='stable')
+                neighbours.append(cols[order].astype(np.int32))
+                scores.append(sims[order].astype(np.float32))
+                counts[start + i] = len(order)
+
+            logging.info("computed similarities for {} of {} articles".format(end, n_titles))
+
+        table.offsets = np.zeros(n_titles + 1, dtype=np.int64)
+        np.cumsum(counts, out=table.offsets[1:])
+        if neighbours:
+            table.neighbours = np.concatenate(neighbours)
+            table.scores = np.concatenate(scores)
+        return(table)
+
+    def save(self, path):
+        '''
+        Write the table to the given directory, creating it if needed.
+
+        :param path: Path to the directory
+        :type path: str
+        '''
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        np.save(os.path.join(path, 'offsets.npy'), self.offsets)
+        np.save(os.path.join(path, 'neighbours.npy'), self.neighbours)
+        np.save(os.path.join(path, 'scores.npy'), self.scores)
+        with open(os.path.join(path, 'titles.txt'), 'w',
+                  encoding='utf-8') as outfile:
+            for title in self.titles:
+                outfile.write('{}\n'.format(title))
+
+        # Header is written last, a directory without one is incomplete
+        with open(os.path.join(path, 'header.json'), 'w') as outfile:
+            json.dump({'version': FORMAT_VERSION,
+                       'lang': self.lang,
+                       'k': self.k,
+                       'max_timestamp': str(self.max_timestamp) \
+                       if self.max_timestamp is not None else None},
+                      outfile)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Load a table from the given directory, memory-mapping the arrays.
+        Returns None if the directory does not contain a table we can read.
+
+        :param path: Path to the directory
+        :type path: str
+        '''
+        try:
+            with open(os.path.join(path, 'header.json')) as infile:
+                header = json.load(infile)
+        except (IOError, ValueError):
+            logging.error("Unable to read similarity table header in {}".format(path))
+            return(None)
+
+        if header.get('version') != FORMAT_VERSION:
+            logging.error("Similarity table in {} has format version {}, expected {}".format(path, header.get('version'), FORMAT_VERSION))
+            return(None)
+
+        table = cls(header['lang'])
+        table.k = header['k']
+        table.max_timestamp = header['max_timestamp']
+        table.offsets = np.load(os.path.join(path, 'offsets.npy'),
+                                mmap_mode='r')
+        table.neighbours = np.load(os.path.join(path, 'neighbours.npy'),
+                                   mmap_mode='r')
+        table.scores = np.load(os.path.join(path, 'scores.npy'),
+                               mmap_mode='r')
+        with open(os.path.join(path, 'titles.txt'), encoding='utf-8') as infile:
+            table.titles = [line.rstrip('\n') for line in infile]
+        table.title_ids = {title: title_id for (title_id, title)
+                           in enumerate(table.titles)}
+
+        logging.info("loaded similarity table for {}wiki with {} articles and {} pairs".format(table.lang, len(table.titles), len(table)))
+        return(table)
+
+    def related(self, title_id):
+        '''
+        Get the IDs and similarities of the articles most similar
+        to the given article, in descending order of similarity.
+        '''
+        start = self.offsets[title_id]
+        end = self.offsets[title_id + 1]
+        return(self.neighbours[start:end], self.scores[start:end])
+
+    def merge(self, titles):
+        '''
+        Merge the lists of similar articles of the given articles.
+        Returns a tuple of two dicts, one mapping similar articles to
+        the sum of their similarities, and one mapping them to the number
+        of given articles they are similar to.  Unknown titles are skipped.
+
+        :param titles: Titles of the articles
+        :type titles: iterable
+        '''
+        related = []
+        similarities = []
+        for title in titles:
+            title_id = self.title_ids.get(title)
+            if title_id is None:
+                continue
+            (ids, sims) = self.related(title_id)
+            related.append(ids)
+            similarities.append(sims)
+
+        if not related:
+            return({}, {})
+
+        (ids, inverse, counts) = np.unique(np.concatenate(related),
+                                           return_inverse=True,
+                                           return_counts=True)
+        scores = np.bincount(inverse,
+                             weights=np.concatenate(similarities))
+
+        score_map = {}
+        count_map = {}
+        for (title_id, score, count) in zip(ids.tolist(), scores.tolist(),
+                                            counts.tolist()):
+            score_map[self.titles[title_id]] = score
+            count_map[self.titles[title_id]] = count
+        return(score_map, count_map)
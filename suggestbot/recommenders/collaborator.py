@@ -21,37 +21,24 @@ Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 Boston, MA  02110-1301, USA.
 '''
 
-import operator
+import os
 import logging
+import itertools
 
 import MySQLdb
 
+import numpy as np
+
 from suggestbot import config
 from suggestbot import db
-
-class RecUser:
-    def __init__(self, username, assoc, shared):
-        '''
-        Instantiate a user object.
-    
-        :param username: Name of the user
-        :type username: str
-
-        :param assoc: Association between this user and the user we're
-                      recommending for.
-        :type assoc: float
-
-        :param shared: Number of shared articles edited
-        :type shared: int
-        '''
-
-        self.username = username
-        self.assoc = assoc
-        self.shared = shared
+import suggestbot.utilities.userstats as sus
+from suggestbot.recommenders.neighbours import NeighbourTable
+from suggestbot.recommenders.coeditindex import CoeditIndex
 
 class CollabRecommender:
     def __init__(self, lang='en', nrecs=100, threshold=3, backoff=0,
-                 min_threshold=1, assoc_threshold=0.0001, exp_threshold=18):
+                 min_threshold=1, assoc_threshold=0.0001, exp_threshold=18,
+                 index=None):
         '''
         Instantiate an object for recommending collaborators.
 
@@ -75,6 +62,12 @@ class CollabRecommender:
 
         :param filter_threshold: threshold for labelling user as experienced
         :type filter_threshold: int
+
+        :param index: co-edit index to find collaborators in, instead
+                      of querying the revision table.  If not given, we
+                      load the snapshot of the co-edit recommender's
+                      index for `lang`, if there is one.
+        :type index: CoeditIndex
         '''
         
         self.lang = lang
@@ -85,10 +78,34 @@ class CollabRecommender:
         self.assoc_thresh = assoc_threshold
         self.exp_thresh = exp_threshold
 
+        # In-memory co-edit index, used for recommendations in its
+        # language instead of the revision table.
+        if index is None:
+            index = self.load_index(lang)
+        self.index = index
+
         # Database connection and cursor
         self.dbconn = None
         self.dbcursor = None
-        
+
+    def load_index(self, lang):
+        '''
+        Load the snapshot of the co-edit recommender's in-memory index
+        for the given language (see config.coedit_index_snapshot_dir and
+        bin/update-coedit-index.py).  Returns None if there is no snapshot
+        we can read, in which case we query the revision table.
+
+        :param lang: Language code of the Wikipedia we're recommending for
+        :type lang: str
+        '''
+        snapshot_path = config.coedit_index_snapshot_dir.format(lang)
+        if not os.path.isdir(snapshot_path):
+            return(None)
+        index = CoeditIndex.load(snapshot_path)
+        if index is None:
+            logging.warning("Unable to load co-edit index snapshot for {}wiki, using SQL queries".format(lang))
+        return(index)
+
     def recommend(self, contribs, username, lang, nrecs = 100, threshold = 3, backoff = 0):
 
         '''
@@ -120,6 +137,10 @@ class CollabRecommender:
         self.thresh  = threshold
         self.backoff = backoff
 
+        if self.index is not None and self.index.lang == lang:
+            return(self.recommend_group({username: contribs}, lang,
+                                        nrecs)[username])
+
         # SQL queries are defined here so as to not perform the string
         # formatting multiple times.
         self.get_articles_by_user_query = """SELECT rev_title
@@ -154,24 +175,124 @@ class CollabRecommender:
         # Turn contributions into a set, as we'll only use it that way
         contribs = set(contribs)
 
-        # Get some recs.
-        recs = self.get_recs_at_coedit_threshold(username, contribs)
+        # Find all co-editors once, the threshold is applied to the
+        # number of shared articles we get back with them.
+        neighbours = self.get_neighbours(username, contribs)
+        if neighbours is None:
+            return(recs)
+
+        # Find nhood of top k users
+        k = 250  # Larger nhood for more recs, hopefully
+        recs = neighbours.records(k, self.thresh)
 
         # If we're allowed to back off on the coedit threshold and don't have enough
         # recs, ease off on the threshold and try again.
         needed = nrecs - len(recs)
-        while backoff and self.thresh >= self.min_thresh and needed:
+        while backoff and self.thresh > self.min_thresh and needed > 0:
             self.thresh -= 1
             logging.info('Co-edit threshold is now {0}'.format(self.thresh))
-            recs = self.get_recs_at_coedit_threshold(username, contribs)
-            needed = nrecs = len(recs)
+            recs = neighbours.records(k, self.thresh)
+            needed = nrecs - len(recs)
 
-        # Return truncated to nrecs, switched from list of objects to list of dicts
-        return([{'item': rec.username, 'value': rec.assoc} for rec in recs[:nrecs]])
+        # Return truncated to nrecs, switched from list of tuples to list of dicts
+        return([{'item': user, 'value': assoc} for (user, assoc) in recs[:nrecs]])
 
-    def get_recs_at_coedit_threshold(self, username, contribs):
+    def recommend_group(self, user_contribs, lang, nrecs=100):
         '''
-        Get recommendations of other users based on a set of contributions.
+        Find `nrecs` number of neighbours for each of a group of users,
+        e.g. the members of a WikiProject, computing the association
+        between every user in the co-edit index and all of them at once.
+        Returns a dict mapping each username to a list of recommendations
+        in the same format as `recommend()`.  Neighbours must have at least
+        `self.thresh` articles in common with the user, backing off down to
+        `self.min_thresh` if `self.backoff` is set and we do not have
+        enough.  Requires a co-edit index for `lang`, see `__init__()`.
+
+        :param user_contribs: The contributions of each user, mapping
+                              usernames to lists of articles
+        :type user_contribs: dict
+
+        :param lang: Language code of the Wikipedia we're working on
+        :type lang: str
+
+        :param nrecs: Number of recommendations we seek for each user
+        :type nrecs: int
+        '''
+        if self.index is None or self.index.lang != lang:
+            raise ValueError("no co-edit index for {}wiki".format(lang))
+
+        usernames = list(user_contribs)
+        baskets = [set(user_contribs[username]) for username in usernames]
+
+        logging.info("Got request to recommend collaborators for {0} users in {1}".format(len(usernames), lang))
+
+        results = self.index.group_association(
+            [self.index.get_title_ids(basket) for basket in baskets],
+            self.exp_thresh,
+            basket_sizes=[len(basket) for basket in baskets])
+
+        recs = {}
+        for (username, (user_ids, assoc, shared)) in zip(usernames, results):
+            # User can't be their own neighbour
+            keep = assoc >= self.assoc_thresh
+            own_id = self.index.user_ids.get(username)
+            if own_id is not None:
+                keep &= user_ids != own_id
+            user_ids = user_ids[keep]
+            assoc = assoc[keep]
+            shared = shared[keep]
+
+            thresh = self.thresh
+            (top_ids, top_assoc) = self.top_users(
+                user_ids, assoc, shared >= thresh, nrecs)
+            while self.backoff and thresh > self.min_thresh \
+                  and len(top_ids) < nrecs:
+                thresh -= 1
+                logging.info('Co-edit threshold for {0} is now {1}'.format(username, thresh))
+                (top_ids, top_assoc) = self.top_users(
+                    user_ids, assoc, shared >= thresh, nrecs)
+
+            recs[username] = [{'item': self.index.users[user_id],
+                               'value': float(user_assoc)}
+                              for (user_id, user_assoc)
+                              in zip(top_ids.tolist(), top_assoc.tolist())]
+        return(recs)
+
+    def top_users(self, user_ids, assoc, keep, nrecs):
+        '''
+        Get the IDs and associations of the `nrecs` users with the
+        highest association out of those selected by `keep`, in descending
+        order of association with ties broken on user ID.
+
+        :param user_ids: IDs of the candidate users
+        :type user_ids: numpy.ndarray
+
+        :param assoc: Association of each candidate user
+        :type assoc: numpy.ndarray
+
+        :param keep: Which of the candidate users to consider
+        :type keep: numpy.ndarray of bool
+
+        :param nrecs: Number of users we seek
+        :type nrecs: int
+        '''
+        user_ids = user_ids[keep]
+        assoc = assoc[keep]
+
+        # Partial sort to find the top users, then order those
+        if len(assoc) > nrecs:
+            top = np.argpartition(-assoc, nrecs)[:nrecs]
+            user_ids = user_ids[top]
+            assoc = assoc[top]
+        order = np.lexsort((user_ids, -assoc))
+        return(user_ids[order], assoc[order])
+
+    def get_neighbours(self, username, contribs):
+        '''
+        Find the other users who edited any of a set of contributions,
+        with their association and number of shared articles, as a
+        `NeighbourTable`.  Returns None if we're unable to query the
+        revision table.
 
         :param username: User we are recommending for
         :type username: str
@@ -204,30 +325,19 @@ class CollabRecommender:
         OR rev_comment_is_revert = 1)""".format(revision_table=config.revision_table[self.lang])
         
 
-        # How many different users have coedited a given item with something
-        # in the basket
-        coedit_count = {}
-
-        # Find users who rated the given items
-        coeditor_map = {}
-        user_assoc = {}
-        user_shared = {}
-        
-        # Found co-editors, and recommendations we'll return
-        coeditors = {}
-        recs = []
+        # Number of co-editors found and their associations
+        n_coeditors = 0
+        neighbours = NeighbourTable()
 
         logging.info("user {0}:".format(username))
 
-        user = ""
-        num_edits = 0
-        page_title = ""
-        
-        print(contribs)
-        
+        # Major stakeholders and users who only made minor edits or
+        # reverts to the articles in the basket (dicts used as ordered sets)
+        major_editors = {}
+        minor_editors = {}
+
         for item in contribs:
             # For each article the user has edited, find other editors.
-            other_editors = {}
             
             # First we get major stakeholders in the article (non-minor/non-reverting edits)
             try:
@@ -236,76 +346,87 @@ class CollabRecommender:
             except MySQLdb.Error as e:
                 logging.error("unable to execute query to get users by article")
                 logging.error("Error {0}: {1}".format(e.args[0], e.args[1]))
-                return(recs)
+                return(None)
 
             for row in self.dbcursor:
                 user = row['rev_user'].decode('utf-8')
                 if user == username: # user can't be their own neighbour
                     continue
-                if  user in coeditor_map:
-                    continue
 
-                other_editors[user] = 1
+                major_editors[user] = 1
                 
-            # Then we check minor edits and reverts, and keep those users who are
-            # not in the top 10% of users (see `self.exp_thresh`).
-
-            # Users we've seen (so we don't re-run SQL queries all the time)...
-            seen_minors = {}
+            # Then we get minor edits and reverts
             try:
                 self.dbcursor.execute(get_minor_users_by_article_query,
                                {'title': item.encode('utf-8')})
             except MySQLdb.Error as e:
                 logging.error("unable to execute query to get users by article")
                 logging.error("Error {0}: {1}".format(e.args[0], e.args[1]))
-                return(recs)
+                return(None)
 
             for row in self.dbcursor:
-                if user == username \
-                   or user in coeditors \
-                   or user in other_editors:
+                user = row['rev_user'].decode('utf-8')
+                if user == username:
                     continue
 
-                seen_minors[user] = 1
+                minor_editors[user] = 1
+
+        for user in major_editors:
+            minor_editors.pop(user, None)
+
+        # Get the edit counts of all co-editors with one query to the
+        # user statistics table, falling back to counting revisions for
+        # users who are not in it.
+        edit_counts = sus.get_edit_counts(
+            self.dbcursor, self.lang,
+            itertools.chain(major_editors, minor_editors))
 
-            for username in seen_minors.keys():
+        # Now we have all relevant stakeholders, and can compute the
+        # appropriate association.
+        for user in itertools.chain(major_editors, minor_editors):
+            if user not in edit_counts:
                 try:
-                    self.dbcursor.execute(self.get_edit_count_query,
-                                   {'username': username.encode('utf-8')})
+                    edit_counts[user] = self.get_edit_count(user)
                 except MySQLdb.Error as e:
                     logging.error("unable to execute query to get editcount for user")
                     logging.error("Error {0}: {1}".format(e.args[0], e.args[1]))
                     continue
 
-                for row in self.dbcursor:
-                    if row['numedits'] >= self.exp_thresh:
-                        other_editors[username] = 1
+            # Minor edits and reverts only count for users who are
+            # not in the top 10% of users (see `self.exp_thresh`).
+            if user in minor_editors \
+               and edit_counts[user] >= self.exp_thresh:
+                continue
 
-            # Now we have all relevant stakeholders in the article, and can
-            # compute the appropriate association.
-            for username in other_editors:
-                user_obj = RecUser(username, 0, 0)
-                
-                # Add user to coeditors so we'll skip this user later
-                coeditors[username] = user_obj
+            n_coeditors += 1
 
-                (assoc, shared) = self.user_association(username, contribs)
-                if assoc < self.assoc_thresh:
-                    continue
+            (assoc, shared) = self.user_association(user, contribs,
+                                                    edit_counts[user])
+            if assoc < self.assoc_thresh:
+                continue
 
-                user_obj.assoc = assoc
-                user_obj.shared = shared
+            neighbours.add(user, assoc, shared)
 
-        logging.info("Found {0} pre-neighbours".format(len(coeditors)))
+        logging.info("Found {0} pre-neighbours".format(n_coeditors))
+        logging.info("neighbour table uses {0} bytes".format(
+            neighbours.memory_usage()))
+        return(neighbours)
 
-        # Find nhood of top k users
-        k = 250  # Larger nhood for more recs, hopefully
-        recs = sorted(user_assoc.items(),
-                      key=operator.attrgetter('assoc'),
-                      reverse=True)[:k]
-        return recs
+    def get_edit_count(self, user):
+        '''
+        Count the number of edits a user has made (in our dataset).
 
-    def user_association(self, user, basket):
+        :param user: The user we are looking up the edit count for.
+        :type user: str
+        '''
+        user_editcount = 0
+        self.dbcursor.execute(self.get_edit_count_query,
+                              {'username': user.encode('utf-8')})
+        for row in self.dbcursor:
+            user_editcount = row['numedits']
+        return(user_editcount)
+
+    def user_association(self, user, basket, user_editcount=None):
         '''
         Calculate the association between a given user and a basket
         of edits.  A user has to have at least self.exp_thresh edits
@@ -316,6 +437,9 @@ class CollabRecommender:
 
         :param basket: The basket of contributions we are comparing user to.
         :type basket: set
+
+        :param user_editcount: The user's number of edits, if already known.
+        :type user_editcount: int
         '''
 
         assoc = 0
@@ -326,20 +450,17 @@ class CollabRecommender:
         # is in the top 10% of users or not.  If they are (as defined by self.exp_thresh)
         # we'll only use non-minor, non-reverting article edits for comparison.
         # Otherwise, we use all articles the user edited.
-        user_editcount = 0
-        self.dbcursor.execute(self.get_edit_count_query,
-                              {'username': user.encode('utf-8')})
-        for row in self.dbcursor:
-            user_editcount = row['numedits']
+        if user_editcount is None:
+            user_editcount = self.get_edit_count(user)
 
         # Grab the users edits...
-        if user_editcount >= self.xp_thresh:
-            dbcursor.execute(self.get_articles_by_expert_user_query,
-                             {'username': user.encode('utf-8')})
+        if user_editcount >= self.exp_thresh:
+            self.dbcursor.execute(self.get_articles_by_expert_user_query,
+                                  {'username': user.encode('utf-8')})
         else:
-            dbcursor.execute(self.get_articles_by_user_query,
-                             {'username': user.encode('utf-8')})
-        for row in dbcursor:
+            self.dbcursor.execute(self.get_articles_by_user_query,
+                                  {'username': user.encode('utf-8')})
+        for row in self.dbcursor:
             user_edits.add(row['rev_title'].decode('utf-8'))
 
         # Calculate association using the Jaccard Coefficient
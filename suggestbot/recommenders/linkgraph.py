@@ -0,0 +1,581 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Local snapshot of the links between articles (namespace 0) of a
+Wikipedia, used by the link recommender to expand its set of candidate
+articles in memory instead of querying the pagelinks table.
+
+Links are stored as a compressed sparse row adjacency over page IDs,
+with redirects already resolved and links to pages the recommender
+excludes left out (see `links.Recommender.resolve_link()`).  The
+snapshot can also hold the titles of all articles and the page IDs they
+resolve to, so the recommender can look up page IDs and titles without
+querying the page table.  A snapshot is a directory of numpy array
+files that are memory-mapped when loaded:
+
+  header.json       format version, language, when it was built, sizes
+  page_ids.npy      int32, sorted IDs of the pages that have links
+  offsets.npy       int64, start of each page's links in links.npy
+  links.npy         int32, page IDs of the pages linked to
+  titles.npy        uint8, titles of all articles, including redirects,
+                    in UTF-8 one after another, sorted
+  title_offsets.npy int64, start of each title in titles.npy
+  title_targets.npy int32, ID of the page each article resolves to after
+                    following a single redirect, 0 for double redirects,
+                    in the order of the titles
+  title_ids.npy     int32, sorted IDs of all articles
+  title_rows.npy    int32, position of each article in title_ids.npy
+                    among the titles
+
+Copyright (C) 2016 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+'''
+
+import os
+import json
+import bisect
+import shutil
+import logging
+
+from datetime import datetime, timezone
+
+import numpy as np
+import scipy.sparse as sps
+
+# Version of the snapshot format, bumped when it changes
+SNAPSHOT_VERSION = 3
+
+# Format of timestamps in a snapshot header
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Number of links we copy at a time when writing a snapshot
+COPY_SIZE = 10000000
+
+class TitleTable:
+    '''
+    Sorted titles stored as UTF-8 bytes one after another with the
+    offsets where each one starts, so a snapshot's titles can be
+    memory-mapped rather than read into a list.  Indexing it gives
+    the encoded title at that position.
+    '''
+    def __init__(self, offsets, data):
+        '''
+        :param offsets: start of each title in `data`, and the end of
+                        the last one
+        :type offsets: numpy.ndarray
+
+        :param data: the encoded titles
+        :type data: numpy.ndarray
+        '''
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_titles(cls, titles):
+        '''
+        Build a table from sorted titles in memory.
+
+        :param titles: the titles, sorted
+        :type titles: list
+        '''
+        encoded = [title.encode('utf-8') for title in titles]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(title) for title in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return(cls(offsets, data))
+
+    def __len__(self):
+        return(len(self.offsets) - 1)
+
+    def __getitem__(self, i):
+        return(self.data[self.offsets[i]:self.offsets[i+1]].tobytes())
+
+    def title(self, i):
+        '''
+        Get the title at the given position.
+
+        :param i: position of the title
+        :type i: int
+        '''
+        return(self[i].decode('utf-8'))
+
+    def find(self, title):
+        '''
+        Get the position of the given title, or None if we don't have it.
+        UTF-8 bytes sort in the same order as the titles, so this is a
+        binary search over the mapped bytes.
+
+        :param title: the title
+        :type title: str
+        '''
+        key = title.encode('utf-8')
+        i = bisect.bisect_left(self, key)
+        if i < len(self) and self[i] == key:
+            return(i)
+        return(None)
+
+class LinkGraph:
+    def __init__(self, lang):
+        '''
+        Instantiate an empty graph.  Use `from_links()`, `write()`,
+        or `load()` to get one with data in it.
+
+        :param lang: Language code of the Wikipedia this graph covers
+        :type lang: str
+        '''
+        self.lang = lang
+
+        # IDs of pages with links, and where their links start
+        self.page_ids = np.zeros(0, dtype=np.int32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+
+        # Page IDs of the pages linked to, grouped by linking page
+        self.links = np.zeros(0, dtype=np.int32)
+
+        # When the graph was built
+        self.built = None
+
+        # Sorted titles of all articles (with underscores, as in the
+        # page table) and the IDs they resolve to, and the sorted IDs
+        # of the articles and their positions among the titles.  None
+        # if we don't have titles.
+        self.titles = None
+        self.title_targets = None
+        self.title_ids = None
+        self.title_rows = None
+
+        # IDs of all pages in the graph and the transposed transition
+        # matrix of a random walk over them, built when first needed
+        # by `personalized_pagerank()`
+        self.nodes = None
+        self.transition = None
+
+    def __len__(self):
+        '''
+        Number of links in the graph.
+        '''
+        return(len(self.links))
+
+    @classmethod
+    def from_links(cls, lang, sources, targets):
+        '''
+        Build a graph from arrays of links in memory.
+
+        :param lang: Language code of the Wikipedia the links are from
+        :type lang: str
+
+        :param sources: page IDs of the pages the links are on
+        :type sources: numpy.ndarray
+
+        :param targets: page IDs of the pages linked to
+        :type targets: numpy.ndarray
+        '''
+        graph = cls(lang)
+        order = np.argsort(sources, kind='stable')
+        (graph.page_ids, counts) = np.unique(np.asarray(sources)[order],
+                                             return_counts=True)
+        graph.page_ids = graph.page_ids.astype(np.int32)
+        graph.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=graph.offsets[1:])
+        graph.links = np.asarray(targets, dtype=np.int32)[order]
+        graph.built = datetime.now(timezone.utc)
+        return(graph)
+
+    @classmethod
+    def write(cls, lang, path, blocks, pages=None):
+        '''
+        Write a snapshot from a stream of blocks of links, without
+        holding all the links in memory, and load it.  Each block is a
+        tuple of arrays of source and target page IDs, and the sources in
+        a block must all be larger than those in the blocks before it.
+        The snapshot is written to a temporary directory first and then
+        swapped in, so processes reading the old one are unaffected.
+
+        If `pages` is given, the titles of the articles are stored too.
+        It is a stream of blocks, each a tuple of an array of page IDs,
+        a list of their titles, and an array of the IDs of the pages
+        they resolve to (0 if they don't resolve).
+
+        :param lang: Language code of the Wikipedia the links are from
+        :type lang: str
+
+        :param path: Path to the snapshot directory
+        :type path: str
+
+        :param blocks: blocks of (sources, targets) arrays
+        :type blocks: iterable
+
+        :param pages: blocks of (page IDs, titles, targets)
+        :type pages: iterable
+        '''
+        new_path = '{}.new'.format(path)
+        old_path = '{}.old'.format(path)
+        if os.path.isdir(new_path):
+            shutil.rmtree(new_path)
+        os.makedirs(new_path)
+
+        # Links are appended to a raw file as we go, and copied into
+        # a .npy file once we know how many there are.
+        raw_path = os.path.join(new_path, 'links.raw')
+        page_ids = []
+        counts = []
+        num_links = 0
+        with open(raw_path, 'wb') as outfile:
+            for (sources, targets) in blocks:
+                order = np.argsort(sources, kind='stable')
+                (block_ids, block_counts) = np.unique(
+                    np.asarray(sources)[order], return_counts=True)
+                page_ids.append(block_ids.astype(np.int32))
+                counts.append(block_counts)
+                np.asarray(targets, dtype=np.int32)[order].tofile(outfile)
+                num_links += len(order)
+                logging.info("wrote {} links".format(num_links))
+
+        page_ids = np.concatenate(page_ids) if page_ids \
+                   else np.zeros(0, dtype=np.int32)
+        offsets = np.zeros(len(page_ids) + 1, dtype=np.int64)
+        if counts:
+            np.cumsum(np.concatenate(counts), out=offsets[1:])
+
+        np.save(os.path.join(new_path, 'page_ids.npy'), page_ids)
+        np.save(os.path.join(new_path, 'offsets.npy'), offsets)
+        links = np.lib.format.open_memmap(
+            os.path.join(new_path, 'links.npy'), mode='w+',
+            dtype=np.int32, shape=(num_links,))
+        if num_links:
+            raw_links = np.memmap(raw_path, dtype=np.int32, mode='r')
+            for start in range(0, num_links, COPY_SIZE):
+                links[start:start+COPY_SIZE] = \
+                    raw_links[start:start+COPY_SIZE]
+            del(raw_links)
+        links.flush()
+        del(links)
+        os.remove(raw_path)
+
+        num_titles = 0
+        if pages is not None:
+            num_titles = cls.write_titles(new_path, pages)
+
+        # Header is written last, a directory without one is incomplete
+        with open(os.path.join(new_path, 'header.json'), 'w') as outfile:
+            json.dump({'version': SNAPSHOT_VERSION,
+                       'lang': lang,
+                       'built': datetime.now(timezone.utc).strftime(
+                           TIMESTAMP_FORMAT),
+                       'num_pages': len(page_ids),
+                       'num_links': num_links,
+                       'num_titles': num_titles},
+                      outfile)
+
+        if os.path.isdir(path):
+            os.rename(path, old_path)
+        os.rename(new_path, path)
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+        logging.info("saved link graph snapshot for {}wiki to {}".format(
+            lang, path))
+        return(cls.load(path))
+
+    @staticmethod
+    def write_titles(path, pages):
+        '''
+        Write the titles of the articles to a snapshot directory, see
+        `write()`.  The titles are sorted in memory, so this needs
+        enough of it to hold them all once.  Returns the number of
+        articles written.
+
+        :param path: Path to the snapshot directory
+        :type path: str
+
+        :param pages: blocks of (page IDs, titles, targets)
+        :type pages: iterable
+        '''
+        title_ids = []
+        titles = []
+        title_targets = []
+        for (page_ids, block_titles, targets) in pages:
+            title_ids.append(np.asarray(page_ids, dtype=np.int32))
+            titles.extend(title.encode('utf-8') for title in block_titles)
+            title_targets.append(np.asarray(targets, dtype=np.int32))
+            logging.info("read {} titles".format(len(titles)))
+
+        title_ids = np.concatenate(title_ids) if title_ids \
+                    else np.zeros(0, dtype=np.int32)
+        title_targets = np.concatenate(title_targets) if title_targets \
+                        else np.zeros(0, dtype=np.int32)
+
+        # Sorting the encoded titles sorts them in the same order
+        # as the strings
+        order = sorted(range(len(titles)), key=titles.__getitem__)
+        titles = [titles[i] for i in order]
+        order = np.asarray(order, dtype=np.int64)
+
+        offsets = np.zeros(len(titles) + 1, dtype=np.int64)
+        np.cumsum([len(title) for title in titles], out=offsets[1:])
+        with open(os.path.join(path, 'titles.npy'), 'wb') as outfile:
+            np.lib.format.write_array_header_1_0(
+                outfile, {'descr': np.lib.format.dtype_to_descr(
+                              np.dtype(np.uint8)),
+                          'fortran_order': False,
+                          'shape': (int(offsets[-1]),)})
+            for title in titles:
+                outfile.write(title)
+        del(titles)
+
+        # IDs of the articles in the order of their titles, sorted by ID
+        title_ids = title_ids[order]
+        id_order = np.argsort(title_ids, kind='stable')
+
+        np.save(os.path.join(path, 'title_offsets.npy'), offsets)
+        np.save(os.path.join(path, 'title_targets.npy'),
+                title_targets[order])
+        np.save(os.path.join(path, 'title_ids.npy'), title_ids[id_order])
+        np.save(os.path.join(path, 'title_rows.npy'),
+                id_order.astype(np.int32))
+        logging.info("wrote {} titles".format(len(order)))
+        return(len(order))
+
+    def save(self, path):
+        '''
+        Write a snapshot of the graph to the given directory.
+
+        :param path: Path to the snapshot directory
+        :type path: str
+        '''
+        sources = np.repeat(self.page_ids, np.diff(self.offsets))
+        pages = None
+        if self.titles is not None:
+            pages = [(self.title_ids[np.argsort(self.title_rows)],
+                      [self.titles.title(i) for i in range(len(self.titles))],
+                      self.title_targets)]
+        self.write(self.lang, path, [(sources, self.links)], pages=pages)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Load a graph from a snapshot directory, memory-mapping the arrays.
+        Returns None if the directory does not contain a snapshot we
+        can read.
+
+        :param path: Path to the snapshot directory
+        :type path: str
+        '''
+        try:
+            with open(os.path.join(path, 'header.json')) as infile:
+                header = json.load(infile)
+        except (IOError, ValueError):
+            logging.warning("Unable to read link graph snapshot header in {}".format(path))
+            return(None)
+
+        if header.get('version') != SNAPSHOT_VERSION:
+            logging.warning("Link graph snapshot in {} has version {}, expected {}".format(path, header.get('version'), SNAPSHOT_VERSION))
+            return(None)
+
+        graph = cls(header['lang'])
+        for name in ['page_ids', 'offsets', 'links']:
+            setattr(graph, name,
+                    np.load(os.path.join(path, '{}.npy'.format(name)),
+                            mmap_mode='r'))
+        graph.built = datetime.strptime(header['built'],
+                                        TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+        if header['num_titles']:
+            for name in ['title_targets', 'title_ids', 'title_rows']:
+                setattr(graph, name,
+                        np.load(os.path.join(path, '{}.npy'.format(name)),
+                                mmap_mode='r'))
+            graph.titles = TitleTable(
+                np.load(os.path.join(path, 'title_offsets.npy'),
+                        mmap_mode='r'),
+                np.load(os.path.join(path, 'titles.npy'), mmap_mode='r'))
+
+        if len(graph) != header['num_links'] \
+           or len(graph.page_ids) != header['num_pages'] \
+           or len(graph.offsets) != len(graph.page_ids) + 1 \
+           or (graph.titles is not None
+               and (len(graph.titles) != header['num_titles']
+                    or len(graph.titles.data) != graph.titles.offsets[-1]
+                    or len(graph.title_targets) != header['num_titles']
+                    or len(graph.title_ids) != header['num_titles']
+                    or len(graph.title_rows) != header['num_titles'])):
+            logging.warning("Link graph snapshot in {} is inconsistent".format(path))
+            return(None)
+
+        logging.info("loaded link graph snapshot for {}wiki built {} with {} pages and {} links".format(graph.lang, graph.built, len(graph.page_ids), len(graph)))
+        return(graph)
+
+    def set_titles(self, page_ids, titles, targets):
+        '''
+        Set the titles of the articles, see `write()`.
+
+        :param page_ids: IDs of the articles
+        :type page_ids: numpy.ndarray
+
+        :param titles: titles of the articles, with underscores
+        :type titles: list
+
+        :param targets: IDs of the pages the articles resolve to, 0 if
+                        they don't resolve
+        :type targets: numpy.ndarray
+        '''
+        order = sorted(range(len(titles)), key=titles.__getitem__)
+        self.titles = TitleTable.from_titles([titles[i] for i in order])
+        order = np.asarray(order, dtype=np.int64)
+        self.title_targets = np.asarray(targets, dtype=np.int32)[order]
+        title_ids = np.asarray(page_ids, dtype=np.int32)[order]
+        id_order = np.argsort(title_ids, kind='stable')
+        self.title_ids = title_ids[id_order]
+        self.title_rows = id_order.astype(np.int32)
+
+    def get_page_ids(self, titles):
+        '''
+        Get the page IDs of the given articles, resolving single
+        redirects, the same way as `links.Recommender.get_page_ids()`.
+        Returns a dict mapping titles to page IDs, articles that do not
+        exist or are double redirects are left out.
+
+        :param titles: titles of the articles
+        :type titles: list
+        '''
+        page_ids = {}
+        for title in titles:
+            i = self.titles.find(title.replace(' ', '_'))
+            if i is not None and self.title_targets[i]:
+                page_ids[title] = int(self.title_targets[i])
+        return(page_ids)
+
+    def get_titles(self, page_ids):
+        '''
+        Get the titles of the given articles, with spaces rather than
+        underscores.  Returns a dict mapping page IDs to titles, pages
+        we don't have are left out.
+
+        :param page_ids: IDs of the articles
+        :type page_ids: list
+        '''
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        rows = np.searchsorted(self.title_ids, page_ids)
+        found = rows < len(self.title_ids)
+        found[found] = self.title_ids[rows[found]] == page_ids[found]
+        rows = self.title_rows[rows[found]]
+        return({page_id: self.titles.title(row).replace('_', ' ')
+                for (page_id, row) in zip(page_ids[found].tolist(),
+                                          rows.tolist())})
+
+    def expand(self, page_ids):
+        '''
+        Get the links from the given pages, with one entry per link,
+        so a page linked to from several of them is listed several
+        times.  Pages that are not in the graph have no links.
+
+        :param page_ids: IDs of the pages
+        :type page_ids: numpy.ndarray
+        '''
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        rows = np.searchsorted(self.page_ids, page_ids)
+        found = rows < len(self.page_ids)
+        found[found] = self.page_ids[rows[found]] == page_ids[found]
+        rows = rows[found]
+
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return(np.zeros(0, dtype=np.int32))
+
+        # position = start of row + offset within row
+        row_starts = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - row_starts, lengths) \
+                    + np.arange(total)
+        return(self.links[positions])
+
+    def build_transition(self):
+        '''
+        Build the transition matrix used by `personalized_pagerank()`,
+        where a walker on a page follows each of its links with equal
+        probability.  It is stored transposed so a step of the walk is
+        a single sparse matrix-vector product.
+        '''
+        self.nodes = np.union1d(self.page_ids, self.links).astype(np.int32)
+        n_nodes = len(self.nodes)
+
+        # Links from each node, nodes without links have none
+        rows = np.searchsorted(self.nodes, self.page_ids)
+        counts = np.zeros(n_nodes, dtype=np.int64)
+        counts[rows] = np.diff(self.offsets)
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+
+        indices = np.searchsorted(self.nodes, self.links).astype(np.int32)
+        weights = np.repeat(1.0 / np.maximum(counts, 1), counts)
+        self.transition = sps.csr_matrix(
+            (weights.astype(np.float32), indices, indptr),
+            shape=(n_nodes, n_nodes)).T.tocsr()
+        logging.info("built transition matrix for {}wiki link graph with {} pages".format(self.lang, n_nodes))
+
+    def personalized_pagerank(self, page_ids, damping=0.85, max_iter=50,
+                              tol=1e-6):
+        '''
+        Score all pages by personalized PageRank, the probability of
+        a random walk that restarts at the given pages being on them.
+        At each step the walker follows a link with probability `damping`
+        and otherwise restarts, walkers on pages without links always
+        restart.  Iterates until the L1 change in scores is below `tol`
+        or we have done `max_iter` iterations.  Returns a tuple of arrays
+        of page IDs and their scores, for pages with a non-zero score.
+
+        :param page_ids: IDs of the pages the walk restarts at
+        :type page_ids: numpy.ndarray
+
+        :param damping: Probability of following a link
+        :type damping: float
+
+        :param max_iter: Maximum number of iterations
+        :type max_iter: int
+
+        :param tol: Convergence tolerance
+        :type tol: float
+        '''
+        if self.transition is None:
+            self.build_transition()
+
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        rows = np.searchsorted(self.nodes, page_ids)
+        found = rows < len(self.nodes)
+        found[found] = self.nodes[rows[found]] == page_ids[found]
+        rows = np.unique(rows[found])
+        if not len(rows):
+            return((np.zeros(0, dtype=np.int32), np.zeros(0)))
+
+        restart = np.zeros(len(self.nodes))
+        restart[rows] = 1.0 / len(rows)
+        scores = restart.copy()
+        n_iter = 0
+        delta = 0.0
+        while n_iter < max_iter:
+            n_iter += 1
+            new_scores = damping * (self.transition @ scores)
+            # Walkers that didn't follow a link restart
+            new_scores += (1.0 - new_scores.sum()) * restart
+            delta = np.abs(new_scores - scores).sum()
+            scores = new_scores
+            if delta < tol:
+                break
+        logging.info("personalized PageRank ran {} iterations, last change {:.2e}".format(n_iter, delta))
+
+        nonzero = np.flatnonzero(scores)
+        return((self.nodes[nonzero], scores[nonzero]))
@@ -25,24 +25,277 @@ import os
 import re
 import json
 import math
+import time
 import logging
 import operator
+import threading
 
 import MySQLdb
 import MySQLdb.cursors
 
-from collections import defaultdict
+import numpy as np
+
+from array import array
+
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from more_itertools import chunked
 
+from suggestbot.recommenders.linkgraph import LinkGraph
+
+# SQL query to get linked articles from a set of pages, selected by
+# the condition filled in with format().  Single redirects are resolved,
+# double redirects are marked as such so they can be ignored.
+# See `Recommender.resolve_link()`.
+LINKED_PAGES_QUERY = r'''SELECT pl.pl_from AS source,
+                                link.page_id AS lpage,
+                                link.page_title AS lpage_title,
+                                redir.page_id AS rpage,
+                                redir.page_title AS rpage_title,
+                                redir.page_is_redirect AS is_double_redirect
+                         FROM pagelinks AS pl
+                         JOIN page AS link
+                         ON (pl.pl_namespace=link.page_namespace
+                             AND pl.pl_title=link.page_title)
+                         LEFT JOIN redirect AS rd
+                         ON link.page_id=rd.rd_from
+                         LEFT JOIN page AS redir
+                         ON (rd.rd_namespace=redir.page_namespace
+                             AND rd.rd_title=redir.page_title)
+                         WHERE pl.pl_namespace=0
+                         AND {condition}'''
+
 class DatabaseConnectionError(Exception):
     """
     Raised if we're unable to connect to a given database.
     """
     pass
 
+class LRUCache():
+    '''
+    Cache with a bounded number of entries, where the least recently
+    used entry is evicted when it is full.  Counts hits and misses.
+    Safe to use from several threads.
+    '''
+    def __init__(self, max_size):
+        '''
+        @param max_size: Maximum number of entries in the cache
+        @type max_size: int
+        '''
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return(len(self.entries))
+
+    def get(self, key, default=None):
+        '''
+        Get the value stored for `key`, or `default` if it's not cached.
+        '''
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return(default)
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return(value)
+
+    def put(self, key, value):
+        '''
+        Store `value` for `key`, evicting the least recently used
+        entry if the cache is full.
+        '''
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        '''
+        Fraction of lookups that were found in the cache.
+        '''
+        lookups = self.hits + self.misses
+        if not lookups:
+            return(0.0)
+        return(self.hits / lookups)
+
+class TitleExcluder():
+    '''
+    Decides whether to exclude articles in a given language based on
+    their titles: those containing a year, lists, and those starting
+    with a date.  The rules are combined into a single regular expression
+    so a title is checked in one pass, and verdicts are cached by page ID.
+    '''
+    def __init__(self, months, lists, cache_size):
+        '''
+        @param months: Regular expression for titles starting with a date
+        @type months: str
+
+        @param lists: Regular expression for lists
+        @type lists: str
+
+        @param cache_size: Maximum number of verdicts we cache
+        @type cache_size: int
+        '''
+        # \A anchors the date rule at the start of the title, as match() did
+        self.pattern = re.compile(
+            r'\d{{4}}|(?:{lists})|\A(?:{months})'.format(lists=lists,
+                                                       months=months),
+            re.U|re.I)
+        self.verdicts = LRUCache(cache_size)
+
+    def exclude(self, title):
+        '''
+        Should the article with the given title be excluded?
+
+        @param title: title of the article
+        @type title: str
+        '''
+        return(self.pattern.search(title) is not None)
+
+    def exclude_page(self, page_id, title):
+        '''
+        Should the article with the given page ID be excluded?  Its title
+        is only checked if we don't have a cached verdict.
+
+        @param page_id: ID of the article
+        @type page_id: int
+
+        @param title: title of the article, as returned by the database
+        @type title: bytes
+        '''
+        verdict = self.verdicts.get(page_id)
+        if verdict is None:
+            verdict = self.exclude(title.decode('utf-8'))
+            self.verdicts.put(page_id, verdict)
+        return(verdict)
+
+class ConnectionPool():
+    '''
+    Bounded pool of open database connections that are borrowed with
+    `acquire()` and handed back with `release()`.  Connections that have
+    been idle for a while are pinged before they're handed out, and
+    replaced with a new connection if they're no longer alive.
+    '''
+    def __init__(self, connect, max_size=4, check_interval=30, timeout=60):
+        '''
+        @param connect: Function that opens a new connection
+        @type connect: callable
+
+        @param max_size: Maximum number of connections, in use or idle
+        @type max_size: int
+
+        @param check_interval: Number of seconds a connection can be idle
+                               before we check that it's alive
+        @type check_interval: float
+
+        @param timeout: Number of seconds we wait for a connection when
+                        all of them are in use
+        @type timeout: float
+        '''
+        self.connect = connect
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.timeout = timeout
+
+        # Idle connections as tuples of the connection and when it
+        # was released, and the number of connections we have open
+        self.idle = []
+        self.size = 0
+        self.lock = threading.Condition()
+
+    def acquire(self):
+        '''
+        Borrow a connection, opening a new one if none are idle and the
+        pool isn't full.  Raises DatabaseConnectionError if we're unable
+        to connect, or no connection became available within the timeout.
+        '''
+        conn = None
+        released = None
+        deadline = time.monotonic() + self.timeout
+        with self.lock:
+            while not self.idle and self.size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logging.error("Timed out waiting for a database connection")
+                    raise DatabaseConnectionError
+                self.lock.wait(remaining)
+
+            if self.idle:
+                (conn, released) = self.idle.pop()
+            else:
+                self.size += 1
+
+        if conn is not None \
+           and time.monotonic() - released > self.check_interval:
+            try:
+                conn.ping()
+            except MySQLdb.Error:
+                # Close the dead connection but keep its slot for the
+                # new one, if connecting fails the slot is handed back below
+                logging.info("Database connection is gone, reconnecting")
+                try:
+                    conn.close()
+                except:
+                    pass
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self.connect()
+            except:
+                with self.lock:
+                    self.size -= 1
+                    self.lock.notify()
+                raise DatabaseConnectionError
+
+        return(conn)
+
+    def release(self, conn):
+        '''
+        Hand a borrowed connection back to the pool.
+        '''
+        with self.lock:
+            self.idle.append((conn, time.monotonic()))
+            self.lock.notify()
+
+    def discard(self, conn):
+        '''
+        Close a borrowed connection instead of handing it back, e.g.
+        because it failed or was left in an unknown state.
+        '''
+        try:
+            conn.close()
+        except:
+            pass
+        with self.lock:
+            self.size -= 1
+            self.lock.notify()
+
+    def close(self):
+        '''
+        Close all idle connections.
+        '''
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for (conn, released) in idle:
+            self.discard(conn)
+
 class Recommender():
     def __init__(self, lang='en', nrecs=10, max_depth=2, verbose=False,
-                 sliceSize=25, n_docs=1000):
+                 sliceSize=25, n_docs=1000, page_cache_size=100000,
+                 expansion='exhaustive', beam_width=2000, scoring='links',
+                 damping=0.85, pagerank_iterations=50,
+                 pagerank_tolerance=1e-6, db_pool_size=4, fetch_workers=1,
+                 exclusion_cache_size=1000000):
         '''
         Initialize the link recommender object.
 
@@ -64,6 +317,57 @@ class Recommender():
         @param n_docs: The number of links used as a basis to regard an article
                        as popular.
         @type n_docs: int
+
+        @param page_cache_size: How many page ID lookups we cache.
+        @type page_cache_size: int
+
+        @param expansion: How we follow links at each depth, either
+                          "exhaustive" (all pages found so far) or
+                          "frontier" (only pages found at the previous
+                          depth), see `expand_recs()`.
+        @type expansion: str
+
+        @param beam_width: In "frontier" mode, the maximum number of
+                           pages we follow links from at each depth,
+                           or None for no limit.
+        @type beam_width: int
+
+        @param scoring: How we score candidate articles, either "links"
+                        (number of links to them, weighted by how popular
+                        they are) or "pagerank" (personalized PageRank
+                        over a local link graph, see `get_pagerank_recs()`).
+                        Languages without a local link graph are scored
+                        by links.  If the link graph has the titles of the
+                        articles, "pagerank" needs no database connections.
+        @type scoring: str
+
+        @param damping: Probability of following a link in the random
+                        walk used to calculate personalized PageRank.
+        @type damping: float
+
+        @param pagerank_iterations: Maximum number of iterations when
+                                    calculating personalized PageRank.
+        @type pagerank_iterations: int
+
+        @param pagerank_tolerance: Convergence tolerance when calculating
+                                   personalized PageRank.
+        @type pagerank_tolerance: float
+
+        @param db_pool_size: Maximum number of connections we keep open
+                             to each database, per language.
+        @type db_pool_size: int
+
+        @param fetch_workers: How many slices of articles we find links
+                              for at the same time, each on its own pooled
+                              connection.  Limited to one less than
+                              `db_pool_size`, as each request also holds
+                              a connection.
+        @type fetch_workers: int
+
+        @param exclusion_cache_size: How many decisions on whether to
+                                     exclude a linked article we cache,
+                                     per language.
+        @type exclusion_cache_size: int
         '''
         self.lang = lang
         self.nrecs = nrecs
@@ -71,11 +375,51 @@ class Recommender():
         self.verbose = verbose
         self.sliceSize = sliceSize
         self.n_docs = n_docs
+        self.expansion = expansion
+        self.beam_width = beam_width
+        self.scoring = scoring
+        self.damping = damping
+        self.pagerank_iterations = pagerank_iterations
+        self.pagerank_tolerance = pagerank_tolerance
+
+        ## Number of link rows fetched at each depth in the last
+        ## call to `expand_recs()`
+        self.depth_rows = []
+
+        ## Cache of page ID lookups shared across requests, mapping
+        ## (language code, page title) to a tuple of the page's ID and
+        ## the ID of the page it resolves to (see `get_page_ids()`).
+        self.page_cache = LRUCache(page_cache_size)
+
+        ## Local link graph snapshots, mapping language codes to
+        ## LinkGraph objects.  Languages without one are expanded
+        ## by querying the pagelinks table.
+        self.link_graphs = {}
+
+        ## Inlink counts of all articles, mapping language codes to a tuple
+        ## of the time the inlink table was last updated when we loaded
+        ## them, and a dense array of counts indexed by page ID.
+        self.inlink_counts = {}
 
         ## Database connection to the replicated Wikipedia database,
-        ## and the tool database with our inlink count tables.
+        ## and the tool database with our inlink count tables, borrowed
+        ## from the pools of the language we're working with.
         self.wiki_db_conn = None
         self.tool_db_conn = None
+        self.db_lang = None
+
+        ## Connection pools shared across requests, mapping language
+        ## codes to a tuple of the wiki and tool database pools.
+        self.db_pools = {}
+        self.db_pool_size = db_pool_size
+
+        ## Worker threads fetching slices of links in parallel, see
+        ## `get_links()`, or None if we fetch them one at a time.
+        self.fetch_executor = None
+        fetch_workers = min(fetch_workers, db_pool_size - 1)
+        if fetch_workers > 1:
+            self.fetch_executor = ThreadPoolExecutor(
+                max_workers=fetch_workers)
 
         self.db_config = os.path.expandvars('$HOME/replica.my.cnf')
 
@@ -121,12 +465,12 @@ class Recommender():
             'fr': r"[Ll]iste[ _]d[e']",
             }
 
-        # Compile the regular expressions
-        self.months_re = dict()
-        self.lists_re = dict()
+        # Compile the regular expressions, one per language
+        self.excluders = dict()
         for lang in self.months.keys():
-            self.months_re[lang] = re.compile(self.months[lang], re.U|re.I)
-            self.lists_re[lang] = re.compile(self.lists[lang], re.U|re.I)
+            self.excluders[lang] = TitleExcluder(self.months[lang],
+                                                 self.lists[lang],
+                                                 exclusion_cache_size)
 
         self.rec_map = defaultdict(int)
 
@@ -152,55 +496,153 @@ class Recommender():
         if not item:
             return(False)
 
-        # date
-        ## FIXME: what's the false positive rate on this one?
-        if re.search(r'\d{4}', item):
-            return(True)
+        # date, list, or starting with a month name
+        ## FIXME: what's the false positive rate on the date rule?
+        return(self.excluders[self.lang].exclude(item))
 
-        # is a list
-        if self.lists_re[self.lang].search(item):
-            return(True)
-        
-        # starting with a month name
-        if self.months_re[self.lang].match(item):
-            return(True)
+    def get_page_ids(self, lang, titles):
+        '''
+        Get the page IDs of the given articles, resolving single redirects
+        and ignoring double redirects.  Returns a dict mapping titles to
+        page IDs, articles that do not exist or are double redirects
+        are left out.  Lookups are cached across requests, and those not
+        in the cache are done with one query per slice of titles.
+
+        @param lang: language code of the wiki we're working with
+        @type lang: str
+
+        @param titles: titles of the articles
+        @type titles: list
+        '''
+
+        # Query to get the page ID of a set of pages and if they are
+        # redirects also get the page ID of the page they redirect to
+        getPageIdsQuery = '''SELECT p.page_title, p.page_id,
+                                    p.page_is_redirect,
+                                    redir.page_id AS redir_page_id,
+                                    redir.page_is_redirect AS double_redirect
+                             FROM page p LEFT JOIN redirect rd
+                             ON p.page_id=rd.rd_from
+                             LEFT JOIN page redir
+                             ON (rd.rd_namespace=redir.page_namespace
+                                 AND rd.rd_title=redir.page_title)
+                             WHERE p.page_namespace=0
+                             AND p.page_title IN ({titlelist})'''
+
+        # Use the titles in the local link graph if we have them
+        graph = self.link_graphs.get(lang)
+        if graph is not None and graph.titles is not None:
+            return(graph.get_page_ids(titles))
+
+        page_ids = {}
+        missing = []
+        for page_title in titles:
+            cached = self.page_cache.get((lang, page_title))
+            if cached is None:
+                missing.append(page_title)
+            elif cached[1]:
+                page_ids[page_title] = cached[1]
+
+        with self.wiki_db_conn.cursor(MySQLdb.cursors.DictCursor) as db_cursor:
+            for subset in chunked(missing, self.sliceSize):
+                # Titles as they are in the database, mapped to
+                # the titles we were given
+                db_titles = defaultdict(list)
+                for page_title in subset:
+                    db_titles[re.sub(b' ', b'_', page_title.encode('utf-8'))].append(page_title)
+                try:
+                    db_cursor.execute(
+                        getPageIdsQuery.format(
+                            titlelist=','.join(['%s'] * len(db_titles))),
+                        list(db_titles.keys()))
+                    for row in db_cursor:
+                        page_id = None
+                        if not row['page_is_redirect']:
+                            page_id = row['page_id']
+                        elif not row['double_redirect']:
+                            page_id = row['redir_page_id']
 
-        return(False)
+                        for page_title in db_titles[row['page_title']]:
+                            self.page_cache.put((lang, page_title),
+                                                (row['page_id'], page_id))
+                            if page_id:
+                                page_ids[page_title] = page_id
+                except MySQLdb.Error as e:
+                    logging.warning("Failed to get page IDs")
+                    logging.warning("MySQL error {0}: {1}".format(e.args[0], e.args[1]))
 
-    def get_links(self):
-        '''Get all links from the articles in self.rec_map'''
-        if not self.rec_map:
+        logging.info("page ID cache has {0} entries, {1} hits and {2} misses".format(len(self.page_cache), self.page_cache.hits, self.page_cache.misses))
+        return(page_ids)
+
+    def resolve_link(self, row):
+        '''
+        Get the page ID of the page a link goes to from a row returned by
+        `LINKED_PAGES_QUERY`, following single redirects.  Returns None
+        for double redirects and links to pages we exclude.
+
+        @param row: the link, as returned by a dictionary cursor
+        @type row: dict
+        '''
+        # If the link is a double redirect, we skip it
+        if row['is_double_redirect']:
             return(None)
 
+        ## If the page is a redirect, use the rediected page
+        if row['rpage']:
+            pageId = row['rpage']
+            pageTitle = row['rpage_title']
+        else:
+            pageId = row['lpage']
+            pageTitle = row['lpage_title']
+
+        # Does the link go to a page that we exclude?
+        # (e.g. lists, dates)
+        if self.excluders[self.lang].exclude_page(pageId, pageTitle):
+            return(None)
+
+        return(pageId)
+
+    def get_links(self, page_ids=None):
+        '''
+        Get all links from the given articles, adding them to self.rec_map.
+        Returns the number of link rows fetched.
+
+        @param page_ids: IDs of the articles, defaults to all in self.rec_map
+        @type page_ids: list
+        '''
+        if page_ids is None:
+            page_ids = list(self.rec_map.keys())
+        if not page_ids:
+            return(0)
+
         # SQL query to get linked articles from an input set of page IDs.
-        # Single redirects are resolved, double redirects are marked
-        # as such so they can be ignored.  Inlink counts for both links
-        # and redirects (if present) are also listed.
-        getLinkedPagesQuery = r'''SELECT link.page_id AS lpage,
-                                         link.page_title AS lpage_title,
-                                         redir.page_id AS rpage,
-                                         redir.page_title AS rpage_title,
-                                         redir.page_is_redirect AS is_double_redirect
-                                  FROM pagelinks AS pl
-                                  JOIN page AS link
-                                  ON (pl.pl_namespace=link.page_namespace
-                                      AND pl.pl_title=link.page_title)
-                                  LEFT JOIN redirect AS rd
-                                  ON link.page_id=rd.rd_from
-                                  LEFT JOIN page AS redir
-                                  ON (rd.rd_namespace=redir.page_namespace
-                                      AND rd.rd_title=redir.page_title)
-                                  WHERE pl.pl_namespace=0
-                                  AND pl.pl_from IN ({idlist})'''
-
-        logging.info("Ready to find recs based on {n} articles.".format(n=len(self.rec_map)))
-
-        # Get a snapshot of the current set of recommendations,
-        # and extend recommendations based on it.
-        current_recs = list(self.rec_map.keys())
+        getLinkedPagesQuery = LINKED_PAGES_QUERY.format(
+            condition='pl.pl_from IN ({idlist})')
+
+        logging.info("Ready to find recs based on {n} articles.".format(n=len(page_ids)))
+
         i = 0
+        n_rows = 0
+        if self.fetch_executor is not None:
+            # Slices are fetched by the workers, and their links added
+            # to rec_map here as they come in.
+            wiki_pool = self.db_pools[self.db_lang][0]
+            futures = [self.fetch_executor.submit(
+                self.get_slice_links, wiki_pool, getLinkedPagesQuery.format(
+                    idlist=','.join([str(p) for p in subset])))
+                       for subset in chunked(page_ids, self.sliceSize)]
+            for future in futures:
+                (slice_rows, slice_links) = future.result()
+                n_rows += slice_rows
+                for pageId in slice_links:
+                    self.rec_map[pageId] += 1
+
+                logging.info("fetched links for slice {0}, rec_map now contains {1} items".format(i, len(self.rec_map)))
+                i += 1
+            return(n_rows)
+
         with self.wiki_db_conn.cursor(MySQLdb.cursors.DictCursor) as db_cursor:
-            for subset in chunked(current_recs, self.sliceSize):
+            for subset in chunked(page_ids, self.sliceSize):
                 logging.info("fetching links for slice {}".format(i))
 
                 # Get linked pages
@@ -209,28 +651,10 @@ class Recommender():
                         getLinkedPagesQuery.format(
                             idlist=','.join([str(p) for p in subset])))
                     for row in db_cursor:
-                        # If the link is a double redirect, we skip it
-                        if row['is_double_redirect']:
-                            continue
-                        
-                        pageId = None
-                        pageTitle = None
-                        numLinks = None
-
-                        ## If the page is a redirect, use the rediected page
-                        if row['rpage']:
-                            pageId = row['rpage']
-                            pageTitle = row['rpage_title'].decode('utf-8')
-                        else:
-                            pageId = row['lpage']
-                            pageTitle = row['lpage_title'].decode('utf-8')
-                        
-                        # Does the link go to a page that we exclude?
-                        # (e.g. lists, dates)
-                        if self.exclude_item(pageTitle):
-                            continue
-
-                        self.rec_map[pageId] += 1
+                        n_rows += 1
+                        pageId = self.resolve_link(row)
+                        if pageId:
+                            self.rec_map[pageId] += 1
 
                 except MySQLdb.Error as e:
                     logging.warning("Failed to get page links")
@@ -240,8 +664,392 @@ class Recommender():
                 i += 1
                 
         # OK, done
+        return(n_rows)
+
+    def get_slice_links(self, pool, query):
+        '''
+        Get the links from a slice of articles on a connection borrowed
+        from the given pool, run by the workers in `get_links()`.
+        Returns a tuple of the number of link rows fetched and a list
+        of the IDs of the pages linked to, see `resolve_link()`.
+
+        @param pool: connection pool of the wiki we're working with
+        @type pool: ConnectionPool
+
+        @param query: query to get the links, see `LINKED_PAGES_QUERY`
+        @type query: str
+        '''
+        # Failed slices are logged and skipped, as in `get_links()`.
+        # The connection goes back to the pool only if the query
+        # succeeded, otherwise it's in an unknown state and is closed.
+        conn = None
+        rows = None
+        try:
+            conn = pool.acquire()
+            with conn.cursor(MySQLdb.cursors.DictCursor) as db_cursor:
+                db_cursor.execute(query)
+                rows = db_cursor.fetchall()
+        except DatabaseConnectionError:
+            logging.warning("Failed to get page links, no database connection")
+            return((0, []))
+        except MySQLdb.Error as e:
+            logging.warning("Failed to get page links")
+            logging.warning("MySQL error {0}: {1}".format(e.args[0], e.args[1]))
+            return((0, []))
+        finally:
+            if conn is not None:
+                if rows is None:
+                    pool.discard(conn)
+                else:
+                    pool.release(conn)
+
+        links = [pageId for pageId in map(self.resolve_link, rows) if pageId]
+        return((len(rows), links))
+
+    def get_links_from_graph(self, graph, page_ids=None):
+        '''
+        Get all links from the given articles from a local link graph,
+        giving the same result as `get_links()` as of when the graph
+        was built.  Returns the number of links found.
+
+        @param graph: link graph of the wiki we're recommending for
+        @type graph: LinkGraph
+
+        @param page_ids: IDs of the articles, defaults to all in self.rec_map
+        @type page_ids: list
+        '''
+        if page_ids is None:
+            page_ids = list(self.rec_map.keys())
+        if not page_ids:
+            return(0)
+
+        links = graph.expand(np.array(page_ids, dtype=np.int64))
+        (link_ids, counts) = np.unique(links, return_counts=True)
+        for (pageId, count) in zip(link_ids.tolist(), counts.tolist()):
+            self.rec_map[pageId] += count
+
+        logging.info("rec_map now contains {0} items".format(len(self.rec_map)))
+        return(len(links))
+
+    def get_frontier(self, found):
+        '''
+        Get the pages we follow links from at the next depth: the given
+        pages found at the current depth, limited to the self.beam_width
+        pages with the highest scores in self.rec_map.  Ties are broken
+        on page ID so the frontier is deterministic.
+
+        @param found: IDs of the pages found at the current depth
+        @type found: list
+        '''
+        page_ids = np.array(found, dtype=np.int64)
+        scores = np.array([self.rec_map[pageId] for pageId in found],
+                          dtype=np.float64)
+        order = np.lexsort((page_ids, -scores))
+        if self.beam_width is not None:
+            order = order[:self.beam_width]
+        return(page_ids[order].tolist())
+
+    def expand_recs(self, lang, n_items, n_recs):
+        '''
+        Follow links from the articles in self.rec_map until it holds
+        enough candidates or we reach the maximum depth.  In "exhaustive"
+        mode, links are followed from every page in self.rec_map at each
+        depth, including pages we followed at earlier depths.  In
+        "frontier" mode, they are only followed from pages found at the
+        previous depth, limited to the highest-scoring ones (see
+        `get_frontier()`).  The number of link rows fetched at each depth
+        is stored in self.depth_rows.
+
+        @param lang: language code of the wiki we're recommending for
+        @type lang: str
+
+        @param n_items: number of articles the user has edited
+        @type n_items: int
+
+        @param n_recs: number of recommendations we are to return
+        @type n_recs: int
+        '''
+        self.depth_rows = []
+        depth = 0
+        frontier = list(self.rec_map.keys())
+        while (len(self.rec_map) - n_items) < n_recs \
+                and depth < self.max_depth and frontier:
+            logging.info("Expanding {n} pages at depth {d}, with {m} recs in the map.".format(n=len(frontier), d=depth, m=len(self.rec_map)))
+            # Pages we had before this depth, the rest are found at it
+            if self.expansion == 'frontier':
+                known = set(self.rec_map.keys())
+            if lang in self.link_graphs:
+                n_rows = self.get_links_from_graph(self.link_graphs[lang],
+                                                   frontier)
+            else:
+                n_rows = self.get_links(frontier)
+            self.depth_rows.append(n_rows)
+            depth += 1
+
+            if self.expansion == 'frontier':
+                frontier = self.get_frontier(
+                    [pageId for pageId in self.rec_map if pageId not in known])
+            else:
+                frontier = list(self.rec_map.keys())
+
+        logging.info("Fetched {0} link rows per depth".format(self.depth_rows))
+        verdicts = self.excluders[self.lang].verdicts
+        logging.info("exclusion cache has {0} entries, {1} hits and {2} misses ({3:.1%} hit rate)".format(len(verdicts), verdicts.hits, verdicts.misses, verdicts.hit_rate()))
         return()
 
+    def get_pagerank_recs(self, graph, n_items, n_recs):
+        '''
+        Replace the articles in self.rec_map with the highest-scoring
+        articles by personalized PageRank, restarting the random walk
+        at the articles currently in self.rec_map.  Enough articles are
+        kept that we can return `n_recs` after removing the `n_items`
+        articles the user has edited.
+
+        @param graph: link graph of the wiki we're recommending for
+        @type graph: LinkGraph
+
+        @param n_items: number of articles the user has edited
+        @type n_items: int
+
+        @param n_recs: number of recommendations we are to return
+        @type n_recs: int
+        '''
+        seeds = np.fromiter(self.rec_map.keys(), dtype=np.int64,
+                            count=len(self.rec_map))
+        (page_ids, scores) = graph.personalized_pagerank(
+            seeds, damping=self.damping, max_iter=self.pagerank_iterations,
+            tol=self.pagerank_tolerance)
+
+        n_keep = n_items + n_recs
+        if len(scores) > n_keep:
+            top = np.argpartition(-scores, n_keep - 1)[:n_keep]
+            page_ids = page_ids[top]
+            scores = scores[top]
+        self.rec_map = dict(zip(page_ids.tolist(), scores.tolist()))
+
+        logging.info("Scored by personalized PageRank, rec set now contains {n} articles".format(n=len(self.rec_map)))
+        return()
+
+    def load_link_graph(self, lang, path):
+        '''
+        Load a local link graph snapshot (see `build_link_graph()`) and
+        use it for recommendations in the given language.  Returns True
+        if the snapshot was loaded.
+
+        @param lang: language code of the wiki the snapshot is for
+        @type lang: str
+
+        @param path: path to the snapshot directory
+        @type path: str
+        '''
+        graph = LinkGraph.load(path)
+        if graph is None:
+            return(False)
+
+        if self.scoring == 'pagerank':
+            graph.build_transition()
+        self.link_graphs[lang] = graph
+        return(True)
+
+    def build_link_graph(self, lang, path, block_size=100000):
+        '''
+        Build a local snapshot of the links between articles in the given
+        language from the replicated Wikipedia database, see `LinkGraph`,
+        including the titles of all articles and the page IDs they
+        resolve to.  Returns the graph, or None if we're unable to read
+        the links.
+
+        @param lang: language code of the wiki we're working with
+        @type lang: str
+
+        @param path: path to the snapshot directory
+        @type path: str
+
+        @param block_size: size of the ranges of page IDs we get links for
+        @type block_size: int
+        '''
+        self.setLang(lang)
+        self.connect(lang)
+        graph = None
+        try:
+            with self.wiki_db_conn.cursor(MySQLdb.cursors.DictCursor) as db_cursor:
+                graph = LinkGraph.write(
+                    lang, path, self.get_link_blocks(db_cursor, block_size),
+                    pages=self.get_page_blocks(db_cursor, block_size))
+        except MySQLdb.Error as e:
+            logging.error("Failed to build link graph for {0}wiki".format(lang))
+            logging.error("MySQL error {0}: {1}".format(e.args[0], e.args[1]))
+
+        self.close()
+        return(graph)
+
+    def get_link_blocks(self, db_cursor, block_size):
+        '''
+        Get the links from all articles, one range of page IDs at a time.
+        Redirects are resolved and links are excluded the same way as in
+        `get_links()`.  Yields a tuple of arrays of source and target page
+        IDs for each range.
+
+        @param db_cursor: dictionary cursor on the replicated Wikipedia database
+        @type db_cursor: MySQLdb.cursors.DictCursor
+
+        @param block_size: size of the ranges of page IDs
+        @type block_size: int
+        '''
+
+        # Query to get links from all articles in a range of page IDs
+        getLinkedPagesQuery = LINKED_PAGES_QUERY.format(
+            condition='''pl.pl_from_namespace=0
+                         AND pl.pl_from >= %(start)s
+                         AND pl.pl_from < %(end)s''')
+
+        max_page_id = self.get_max_page_id(db_cursor)
+        for start in range(0, max_page_id + 1, block_size):
+            sources = array('i')
+            targets = array('i')
+            db_cursor.execute(getLinkedPagesQuery,
+                              {'start': start, 'end': start + block_size})
+            for row in db_cursor:
+                pageId = self.resolve_link(row)
+                if pageId:
+                    sources.append(row['source'])
+                    targets.append(pageId)
+            yield (np.frombuffer(sources, dtype=np.int32),
+                   np.frombuffer(targets, dtype=np.int32))
+
+    def get_page_blocks(self, db_cursor, block_size):
+        '''
+        Get the titles of all articles, one range of page IDs at a time,
+        and the ID of the page each resolves to, following single
+        redirects and ignoring double redirects the same way as
+        `get_page_ids()`.  Yields a tuple of an array of page IDs, a list
+        of titles, and an array of the IDs they resolve to (0 if they
+        don't) for each range.
+
+        @param db_cursor: dictionary cursor on the replicated Wikipedia database
+        @type db_cursor: MySQLdb.cursors.DictCursor
+
+        @param block_size: size of the ranges of page IDs
+        @type block_size: int
+        '''
+
+        # Query to get the articles in a range of page IDs and if they
+        # are redirects also get the page ID of the page they redirect to
+        getPagesQuery = '''SELECT p.page_id, p.page_title,
+                                  p.page_is_redirect,
+                                  redir.page_id AS redir_page_id,
+                                  redir.page_is_redirect AS double_redirect
+                           FROM page p LEFT JOIN redirect rd
+                           ON p.page_id=rd.rd_from
+                           LEFT JOIN page redir
+                           ON (rd.rd_namespace=redir.page_namespace
+                               AND rd.rd_title=redir.page_title)
+                           WHERE p.page_namespace=0
+                           AND p.page_id >= %(start)s
+                           AND p.page_id < %(end)s'''
+
+        max_page_id = self.get_max_page_id(db_cursor)
+        for start in range(0, max_page_id + 1, block_size):
+            page_ids = array('i')
+            titles = []
+            targets = array('i')
+            db_cursor.execute(getPagesQuery,
+                              {'start': start, 'end': start + block_size})
+            for row in db_cursor:
+                page_id = None
+                if not row['page_is_redirect']:
+                    page_id = row['page_id']
+                elif not row['double_redirect']:
+                    page_id = row['redir_page_id']
+
+                page_ids.append(row['page_id'])
+                titles.append(row['page_title'].decode('utf-8'))
+                targets.append(page_id or 0)
+            yield (np.frombuffer(page_ids, dtype=np.int32), titles,
+                   np.frombuffer(targets, dtype=np.int32))
+
+    def get_max_page_id(self, db_cursor):
+        '''
+        Get the largest page ID of any article.
+
+        @param db_cursor: dictionary cursor on the replicated Wikipedia database
+        @type db_cursor: MySQLdb.cursors.DictCursor
+        '''
+        # Query to get the largest page ID
+        getMaxPageIdQuery = '''SELECT MAX(page_id) AS max_page_id
+                               FROM page
+                               WHERE page_namespace=0'''
+
+        db_cursor.execute(getMaxPageIdQuery)
+        max_page_id = db_cursor.fetchone()['max_page_id'] or 0
+        db_cursor.fetchall() # flush cursor
+        return(max_page_id)
+
+    def get_inlink_counts(self, lang):
+        '''
+        Get the inlink counts of all articles in the given language as
+        a dense array indexed by page ID, where pages without a count
+        are -1.  The counts are kept in memory and reloaded from the
+        inlink count table whenever the inlink table updater has finished
+        an update since we last loaded them.  Returns None if they are
+        not available.  Expects that we're connected, see `connect()`.
+
+        @param lang: language code of the wiki we're working with
+        @type lang: str
+        '''
+
+        # Query to get when the inlink count table was last updated,
+        # and whether an update is running
+        getUpdateStatusQuery = '''SELECT ilcu_timestamp, ilcu_update_running
+                                  FROM {status_table}
+                                  WHERE ilcu_lang=%(lang)s'''.format(
+                                      status_table=self.tool_status_table)
+
+        # Query to get all inlink counts
+        getInlinkCountsQuery = '''SELECT ilc_page_id, ilc_numlinks
+                                  FROM {ilc_table}'''.format(
+                                      ilc_table=self.tool_ilc_table.format(
+                                          lang_code=lang))
+
+        (loaded_at, inlink_counts) = self.inlink_counts.get(lang, (None, None))
+        try:
+            with self.tool_db_conn.cursor(MySQLdb.cursors.DictCursor) as db_cursor:
+                db_cursor.execute(getUpdateStatusQuery, {'lang': lang})
+                row = db_cursor.fetchone()
+                db_cursor.fetchall() # flush cursor
+            updated_at = None
+            update_running = False
+            if row:
+                updated_at = row['ilcu_timestamp']
+                update_running = row['ilcu_update_running']
+
+            # Keep what we have while an update is running
+            if inlink_counts is not None \
+               and (update_running or updated_at == loaded_at):
+                return(inlink_counts)
+
+            page_ids = array('q')
+            num_links = array('q')
+            with self.tool_db_conn.cursor(MySQLdb.cursors.SSCursor) as db_cursor:
+                db_cursor.execute(getInlinkCountsQuery)
+                for (page_id, page_links) in db_cursor:
+                    if page_links is not None:
+                        page_ids.append(page_id)
+                        num_links.append(page_links)
+        except MySQLdb.Error as e:
+            logging.warning("Failed to get inlink counts")
+            logging.warning("MySQL error {0}: {1}".format(e.args[0], e.args[1]))
+            return(inlink_counts)
+
+        page_ids = np.frombuffer(page_ids, dtype=np.int64)
+        inlink_counts = np.full(page_ids.max() + 1 if len(page_ids) else 0,
+                                -1, dtype=np.int32)
+        inlink_counts[page_ids] = np.frombuffer(num_links, dtype=np.int64)
+        self.inlink_counts[lang] = (updated_at, inlink_counts)
+
+        logging.info("loaded inlink counts for {0} articles in {1}wiki, last updated {2}".format(len(page_ids), lang, updated_at))
+        return(inlink_counts)
+
     def recommend(self, user, lang, user_edits, n_recs):
         '''
         Get recommendations based on the given dictionary of items
@@ -261,31 +1069,22 @@ class Recommender():
         @type n_recs: int
         '''
 
-        # Query to get the page ID of a given page and if it's
-        # a redirect also get the page ID of the page it redirects to
-        getPageIdQuery = '''SELECT p.page_id, p.page_is_redirect,
-                                   redir.page_id AS redir_page_id,
-                                   redir.page_is_redirect AS double_redirect
-                            FROM page p LEFT JOIN redirect rd
-                            ON p.page_id=rd.rd_from
-                            LEFT JOIN page redir
-                            ON (rd.rd_namespace=redir.page_namespace
-                                AND rd.rd_title=redir.page_title)
-                            WHERE p.page_namespace=0
-                            AND p.page_title=%(title)s'''
-
         # Query to get the page titles for a list of page IDs
         getPageTitlesQuery = '''SELECT page_id, page_title
                                 FROM page
                                 WHERE page_id IN ({idlist})'''
 
-        # Query to get inlink counts for found pages
-        get_inlinkcount_query = '''SELECT ilc_page_id, ilc_numlinks
-                                   FROM {ilc_table}
-                                   WHERE ilc_page_id IN ({idlist})'''
-
-        # Connect to the database servers using the correct language
-        self.connect(lang)
+        # PageRank over a link graph with titles needs no database
+        graph = self.link_graphs.get(lang)
+        has_titles = graph is not None and graph.titles is not None
+        use_pagerank = self.scoring == 'pagerank' and graph is not None
+        use_db = not (use_pagerank and has_titles)
+
+        # Connect to the database servers using the correct language,
+        # and use its rules for which articles we exclude.
+        self.setLang(lang)
+        if use_db:
+            self.connect(lang)
         
         # We create our dictionary of recommendations by fetching page IDs
         # for all items we've received that are not to be excluded,
@@ -293,48 +1092,21 @@ class Recommender():
         # We also swap the keys in item_map from page titles to IDs
         # so we can use them for removal of edited articles later.
         self.rec_map = defaultdict(int)
-        newItemMap = {}
-        with self.wiki_db_conn.cursor(MySQLdb.cursors.DictCursor) as db_cursor:
-            for page_title in user_edits:
-                try:
-                    db_cursor.execute(
-                        getPageIdQuery,
-                        {'title':
-                         re.sub(b' ', b'_', page_title.encode('utf-8'))
-                         }
-                    )
-                    row = db_cursor.fetchone()
-                    db_cursor.fetchall() # flush cursor
-                    page_id = None
-                    if row:
-                        # Article exists, set pageId accordingly
-                        if not row['page_is_redirect']:
-                            page_id = row['page_id']
-                        elif not row ['double_redirect']:
-                            page_id = row['redir_page_id']
-
-                    if page_id:
-                        # Store `val` in new item map, add page ID to rec seed
-                        # if not an item to exclude
-                        newItemMap[page_id] = 1
-                        if not self.exclude_item(page_title):
-                            self.rec_map[page_id] = 0
-                except MySQLdb.Error as e:
-                    logging.warning("Failed to get page ID for {title}".format(title=page_title))
-                    logging.warning("MySQL error {0}: {1}".format(e.args[0], e.args[1]))
-
-        item_map = newItemMap
-        newItemMap = None
-
-        depth = 0
-        max_depth = self.max_depth
-        n_items = len(item_map)
-
-        while (len(self.rec_map) - n_items) < n_recs \
-                and depth < max_depth:
-            logging.info("Calling get_links(), with {n} recs in the map.".format(n=len(self.rec_map)))
-            self.get_links()
-            depth += 1
+        item_map = {}
+        page_ids = self.get_page_ids(lang, user_edits)
+        for page_title in user_edits:
+            page_id = page_ids.get(page_title)
+            if page_id:
+                # Store `val` in new item map, add page ID to rec seed
+                # if not an item to exclude
+                item_map[page_id] = 1
+                if not self.exclude_item(page_title):
+                    self.rec_map[page_id] = 0
+
+        if use_pagerank:
+            self.get_pagerank_recs(graph, len(item_map), n_recs)
+        else:
+            self.expand_recs(lang, len(item_map), n_recs)
 
         # Delete any articles that the user already edited
         for pageId in item_map.keys():
@@ -343,27 +1115,32 @@ class Recommender():
 
         logging.info("Deleted edited pages, rec set now contains {n} articles".format(n=len(self.rec_map)))
 
-        ## Grab inlink counts and use that to calculate new scores
-        with self.tool_db_conn.cursor(MySQLdb.cursors.DictCursor) as db_cursor:
-            for subset in chunked(self.rec_map.keys(), self.sliceSize):
-                db_cursor.execute(get_inlinkcount_query.format(
-                    ilc_table=self.tool_ilc_table.format(lang_code = lang),
-                    idlist=','.join([str(p) for p in subset])))
-
-                for row in db_cursor:
-                    # Classic idf = log(N/df).  We'd like to not give
-                    # singly-linked items quite so much clout, and so
-                    # we put the highest weight on things that have
-                    # a few links.  How to estimate?  The "right" way
-                    # is to make it a parameter and test against people.
-            
-                    # calculate penalty for popular links using
-                    # a classic idf = log(N/df)
-                    
-                    idf = math.log(
-                        self.n_docs/math.fabs(math.exp(3)-row['ilc_numlinks']))
-            
-                    self.rec_map[row['ilc_page_id']] *= idf
+        ## Grab inlink counts and use that to calculate new scores.
+        ## PageRank scores are used as they are.
+        page_ids = np.fromiter(self.rec_map.keys(), dtype=np.int64,
+                               count=len(self.rec_map))
+        scores = np.fromiter(self.rec_map.values(), dtype=np.float64,
+                             count=len(self.rec_map))
+        inlink_counts = None
+        if not use_pagerank:
+            inlink_counts = self.get_inlink_counts(lang)
+        if inlink_counts is not None:
+            num_links = np.full(len(page_ids), -1, dtype=np.int64)
+            known = page_ids < len(inlink_counts)
+            num_links[known] = inlink_counts[page_ids[known]]
+            known = num_links >= 0
+
+            # Classic idf = log(N/df).  We'd like to not give
+            # singly-linked items quite so much clout, and so
+            # we put the highest weight on things that have
+            # a few links.  How to estimate?  The "right" way
+            # is to make it a parameter and test against people.
+
+            # calculate penalty for popular links using
+            # a classic idf = log(N/df)
+            scores[known] *= np.log(
+                self.n_docs/np.fabs(math.exp(3)-num_links[known]))
+        self.rec_map = dict(zip(page_ids.tolist(), scores.tolist()))
 
         logging.info('Applied TF/IDF scores to all pages, rec set now contains {} articles'.format(len(self.rec_map)))
                     
@@ -377,23 +1154,29 @@ class Recommender():
         logging.info("Sorted and attempted truncation to {nrecs}, rec set now contains {n} articles".format(nrecs = n_recs, n=len(self.rec_map)))
 
         recs = {}
-        with self.wiki_db_conn.cursor(MySQLdb.cursors.DictCursor) as db_cursor:
-            for subset in chunked(self.rec_map.keys(), self.sliceSize):
-                try:
-                    db_cursor.execute(getPageTitlesQuery.format(
-                        idlist=','.join([str(p) for p in subset])))
-                    for row in db_cursor:
-                        pageId = row['page_id']
-                        pageTitle = row['page_title'].decode('utf-8')
-                        pageTitle = re.sub('_', ' ', pageTitle)
-                        recs[pageTitle] = self.rec_map[pageId]
+        if has_titles:
+            for (pageId, pageTitle) in graph.get_titles(
+                    list(self.rec_map.keys())).items():
+                recs[pageTitle] = self.rec_map[pageId]
+        else:
+            with self.wiki_db_conn.cursor(MySQLdb.cursors.DictCursor) as db_cursor:
+                for subset in chunked(self.rec_map.keys(), self.sliceSize):
+                    try:
+                        db_cursor.execute(getPageTitlesQuery.format(
+                            idlist=','.join([str(p) for p in subset])))
+                        for row in db_cursor:
+                            pageId = row['page_id']
+                            pageTitle = row['page_title'].decode('utf-8')
+                            pageTitle = re.sub('_', ' ', pageTitle)
+                            recs[pageTitle] = self.rec_map[pageId]
 
-                except pymysql.Error as e:
-                    logging.warning("Failed to get page titles")
-                    logging.warning("MySQL error {0}: {1}".format(e.args[0], e.args[1]))
+                    except pymysql.Error as e:
+                        logging.warning("Failed to get page titles")
+                        logging.warning("MySQL error {0}: {1}".format(e.args[0], e.args[1]))
 
         # Disconnect from the database servers
-        self.close()
+        if use_db:
+            self.close()
                     
         # Sort (again) and translate from tuples to dicts with item and value keys
         recs = sorted(recs.items(),
@@ -403,43 +1186,87 @@ class Recommender():
 
         return(recs)
 
+    def get_db_pools(self, lang):
+        '''
+        Get the connection pools for the Wikipedia and tool databases
+        of the given language, creating them if needed.  Connections
+        are in autocommit mode so long-lived connections see updates
+        to the tables.
+
+        @param lang: language code of the wiki we're working with
+        @type lang: str
+        '''
+        if lang not in self.db_pools:
+            wiki_pool = ConnectionPool(
+                lambda: MySQLdb.connect(
+                    host = self.wiki_host.format(lang_code = lang),
+                    database = self.wiki_db_name.format(lang_code = lang),
+                    read_default_file = self.db_config,
+                    charset = 'utf8',
+                    autocommit = True),
+                max_size=self.db_pool_size)
+            tool_pool = ConnectionPool(
+                lambda: MySQLdb.connect(
+                    host = self.tool_host,
+                    database = self.tool_db.format(lang_code = lang),
+                    read_default_file = self.db_config,
+                    charset = 'utf8',
+                    autocommit = True),
+                max_size=self.db_pool_size)
+            self.db_pools[lang] = (wiki_pool, tool_pool)
+        return(self.db_pools[lang])
+
     def connect(self, lang):
         '''
-        Connect to the appropriate Wikipedia and user databases.
+        Borrow connections to the appropriate Wikipedia and user databases
+        from their pools.
         
         @param lang: language code of the wiki we're working with
         @type lang: str
         '''
-        try:
-            self.wiki_db_conn = MySQLdb.connect(
-                host = self.wiki_host.format(lang_code = lang),
-                database = self.wiki_db_name.format(lang_code = lang),
-                read_default_file = self.db_config,
-                charset = 'utf8'
-        )
-        except:
-            raise DatabaseConnectionError
+        # Connections still held were left by a request that failed,
+        # we don't know what state they're in so they're not reused.
+        if self.wiki_db_conn is not None or self.tool_db_conn is not None:
+            self.close(discard=True)
 
+        (wiki_pool, tool_pool) = self.get_db_pools(lang)
+        self.wiki_db_conn = wiki_pool.acquire()
         try:
-            self.tool_db_conn = MySQLdb.connect(
-                host = self.tool_host,
-                database = self.tool_db.format(lang_code = lang),
-                read_default_file = self.db_config,
-                charset = 'utf8'
-            )
-        except:
-            raise DatabaseConnectionError
+            self.tool_db_conn = tool_pool.acquire()
+        except DatabaseConnectionError:
+            wiki_pool.release(self.wiki_db_conn)
+            self.wiki_db_conn = None
+            raise
+        self.db_lang = lang
 
         ## all ok
         return()
 
-    def close(self):
-        '''Close our database connections.'''
-        try:
-            self.wiki_db_conn.close()
-            self.tool_db_conn.close()
-        except:
-            raise DatabaseConnectionError
+    def close(self, discard=False):
+        '''
+        Hand our database connections back to their pools.
+
+        @param discard: close the connections instead of reusing them
+        @type discard: bool
+        '''
+        (wiki_pool, tool_pool) = self.db_pools[self.db_lang]
+        for (pool, conn) in [(wiki_pool, self.wiki_db_conn),
+                             (tool_pool, self.tool_db_conn)]:
+            if conn is None:
+                continue
+            if discard:
+                pool.discard(conn)
+            else:
+                pool.release(conn)
+        self.wiki_db_conn = None
+        self.tool_db_conn = None
 
         ## all ok
         return()
+
+    def close_pools(self):
+        '''Close all idle pooled database connections.'''
+        for (wiki_pool, tool_pool) in self.db_pools.values():
+            wiki_pool.close()
+            tool_pool.close()
+        return()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+'''
+Disk-backed cache of morelike search results, used by the text-based
+recommender so articles that are in many users' profiles are not searched
+for again every time.  Results are stored in an SQLite database keyed by
+language, title, and result limit, expire after a given time, and the
+least recently used entries are evicted when the cache grows too large.
+
+Copyright (C) 2016 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+'''
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+# Number of entries we store between checks of the size of the cache
+EVICT_INTERVAL = 1000
+
+class MorelikeCache:
+    def __init__(self, path, ttl, max_entries):
+        '''
+        Open the cache, creating it if it doesn't exist.
+
+        :param path: Path to the SQLite database file
+        :type path: str
+
+        :param ttl: Number of seconds results are kept
+        :type ttl: float
+
+        :param max_entries: Maximum number of results we keep
+        :type max_entries: int
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        # Number of entries stored since we last evicted
+        self.num_stored = 0
+
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        # One connection shared by all threads, serialised by the lock
+        self.lock = threading.Lock()
+        self.db_conn = sqlite3.connect(path, check_same_thread=False,
+                                       isolation_level=None)
+        self.db_conn.execute('PRAGMA journal_mode=WAL')
+        self.db_conn.execute('''CREATE TABLE IF NOT EXISTS morelike (
+                                  ml_lang TEXT NOT NULL,
+                                  ml_title TEXT NOT NULL,
+                                  ml_srlimit INTEGER NOT NULL,
+                                  ml_results TEXT NOT NULL,
+                                  ml_fetched REAL NOT NULL,
+                                  ml_accessed REAL NOT NULL,
+                                  PRIMARY KEY (ml_lang, ml_title, ml_srlimit))''')
+        self.db_conn.execute('''CREATE INDEX IF NOT EXISTS morelike_accessed
+                                ON morelike (ml_accessed)''')
+
+    def __len__(self):
+        with self.lock:
+            return(self.db_conn.execute(
+                'SELECT COUNT(*) FROM morelike').fetchone()[0])
+
+    def get(self, lang, title, srlimit):
+        '''
+        Get the cached results of a search, or None if they are not
+        cached or have expired.
+
+        :param lang: Language code of the Wikipedia searched
+        :type lang: str
+
+        :param title: Title of the article searched for
+        :type title: str
+
+        :param srlimit: Maximum number of results
+        :type srlimit: int
+        '''
+        now = time.time()
+        with self.lock:
+            row = self.db_conn.execute(
+                '''SELECT ml_results, ml_fetched FROM morelike
+                   WHERE ml_lang=? AND ml_title=? AND ml_srlimit=?''',
+                (lang, title, srlimit)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return(None)
+
+            self.db_conn.execute(
+                '''UPDATE morelike SET ml_accessed=?
+                   WHERE ml_lang=? AND ml_title=? AND ml_srlimit=?''',
+                (now, lang, title, srlimit))
+            self.hits += 1
+        return(json.loads(row[0]))
+
+    def put(self, lang, title, srlimit, results):
+        '''
+        Store the results of a search.
+
+        :param lang: Language code of the Wikipedia searched
+        :type lang: str
+
+        :param title: Title of the article searched for
+        :type title: str
+
+        :param srlimit: Maximum number of results
+        :type srlimit: int
+
+        :param results: Titles of the articles found, in ranked order
+        :type results: list
+        '''
+        now = time.time()
+        with self.lock:
+            self.db_conn.execute(
+                '''INSERT OR REPLACE INTO morelike
+                   (ml_lang, ml_title, ml_srlimit, ml_results,
+                    ml_fetched, ml_accessed)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                (lang, title, srlimit, json.dumps(results), now, now))
+            self.num_stored += 1
+            if self.num_stored >= EVICT_INTERVAL:
+                self._evict(now)
+
+    def _evict(self, now):
+        '''
+        Delete expired entries, then the least recently used ones until
+        the cache is within its size limit.  Expects the lock to be held.
+        '''
+        self.db_conn.execute('DELETE FROM morelike WHERE ml_fetched < ?',
+                             (now - self.ttl,))
+        num_entries = self.db_conn.execute(
+            'SELECT COUNT(*) FROM morelike').fetchone()[0]
+        if num_entries > self.max_entries:
+            self.db_conn.execute(
+                '''DELETE FROM morelike WHERE rowid IN
+                   (SELECT rowid FROM morelike
+                    ORDER BY ml_accessed LIMIT ?)''',
+                (num_entries - self.max_entries,))
+        self.num_stored = 0
+        logging.info("evicted morelike cache entries, {0} of {1} remain".format(min(num_entries, self.max_entries), num_entries))
+
+    def close(self):
+        '''
+        Close the cache database.
+        '''
+        with self.lock:
+            self.db_conn.close()
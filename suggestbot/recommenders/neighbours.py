@@ -0,0 +1,148 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Columnar table of candidate neighbours, used by the co-edit and
+collaborator recommenders while they score the users who edited the
+same articles as the user they're recommending for.  Usernames are
+interned to integer IDs and associations and shared article counts are
+kept in numpy arrays, rather than in a Python object or dict entry per
+candidate.
+
+Copyright (C) 2016 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+'''
+
+import sys
+
+import numpy as np
+
+class NeighbourTable:
+    def __init__(self, size=1024):
+        '''
+        Instantiate an empty table.
+
+        :param size: Initial number of neighbours we can hold
+        :type size: int
+        '''
+        # Interned usernames, mapping IDs to names and names to IDs.
+        # IDs are given out in the order users are added.
+        self.users = []
+        self.user_ids = {}
+
+        # Association and number of shared articles, indexed by user ID
+        self.assoc = np.zeros(size, dtype=np.float32)
+        self.shared = np.zeros(size, dtype=np.int32)
+
+    def __len__(self):
+        '''
+        Number of neighbours in the table.
+        '''
+        return(len(self.users))
+
+    def _grow(self, size):
+        '''
+        Make sure we can hold `size` neighbours.
+        '''
+        if size <= len(self.assoc):
+            return()
+        new_size = max(size, 2*len(self.assoc))
+        extra = new_size - len(self.assoc)
+        self.assoc = np.concatenate(
+            (self.assoc, np.zeros(extra, dtype=np.float32)))
+        self.shared = np.concatenate(
+            (self.shared, np.zeros(extra, dtype=np.int32)))
+
+    def add(self, username, assoc, shared):
+        '''
+        Add a neighbour to the table, or update it if already there.
+        Returns the neighbour's user ID.
+
+        :param username: Name of the user
+        :type username: str
+
+        :param assoc: Association between this user and the user we're
+                      recommending for
+        :type assoc: float
+
+        :param shared: Number of shared articles edited
+        :type shared: int
+        '''
+        user_id = self.user_ids.get(username)
+        if user_id is None:
+            user_id = len(self.users)
+            self._grow(user_id + 1)
+            self.users.append(username)
+            self.user_ids[username] = user_id
+
+        self.assoc[user_id] = assoc
+        self.shared[user_id] = shared
+        return(user_id)
+
+    def top(self, k, min_shared=0):
+        '''
+        Get the IDs of the `k` neighbours with the highest association,
+        in descending order of association.  Ties are broken in the
+        order the neighbours were added, like a stable sort would.
+
+        :param k: Number of neighbours
+        :type k: int
+
+        :param min_shared: Only consider neighbours with at least this
+                           many shared articles
+        :type min_shared: int
+        '''
+        n = len(self.users)
+        if k <= 0 or not n:
+            return(np.zeros(0, dtype=np.int64))
+
+        if min_shared > 0:
+            user_ids = np.flatnonzero(self.shared[:n] >= min_shared)
+        else:
+            user_ids = np.arange(n)
+        assoc = self.assoc[user_ids]
+        if len(user_ids) > k:
+            # Partial sort to find the k-th highest association, keeping
+            # everyone tied with it so ties are broken on ID below.
+            kth = np.partition(assoc, len(assoc) - k)[len(assoc) - k]
+            user_ids = user_ids[assoc >= kth]
+        order = np.lexsort((user_ids, -self.assoc[user_ids]))
+        return(user_ids[order][:k])
+
+    def records(self, k, min_shared=0):
+        '''
+        Get the `k` neighbours with the highest association as a list
+        of (username, association) tuples, see `top()`.
+
+        :param k: Number of neighbours
+        :type k: int
+
+        :param min_shared: Only consider neighbours with at least this
+                           many shared articles
+        :type min_shared: int
+        '''
+        top = self.top(k, min_shared)
+        return(list(zip([self.users[user_id] for user_id in top.tolist()],
+                        self.assoc[top].tolist())))
+
+    def memory_usage(self):
+        '''
+        Approximate number of bytes used by the table: its arrays,
+        the username list and mapping, and the usernames themselves.
+        '''
+        return(self.assoc.nbytes + self.shared.nbytes
+               + sys.getsizeof(self.users) + sys.getsizeof(self.user_ids)
+               + sum(sys.getsizeof(user) for user in self.users))
@@ -45,6 +45,12 @@ class RecommendationServer:
         self.dbconn = None
         self.dbcursor = None
 
+        # Prefetched edits and co-edit recommendations, mapping
+        # (language, username) tuples to tuples of all edited articles,
+        # useful edited articles, and co-edit recommendations (or None
+        # if we didn't get those).  See `prefetch()`.
+        self.prefetched = {}
+
     def is_unimportant_by_comment(self, comment_text, lang):
         '''
         Determine if an edit's comment suggests it is not an important
@@ -160,6 +166,67 @@ class RecommendationServer:
 
         return(recommendations)
 
+    def get_coedit_recs_batch(self, lang, user_edits):
+        '''
+        Connect to the coedit recommender and get recommendations for
+        several users in a single batch.  Returns a dict mapping usernames
+        to lists of recommendations, or an empty dict if it failed.
+
+        :param lang: Language code of the Wikipedia we're recommending for
+        :param user_edits: Dict mapping usernames to lists of edited articles
+        '''
+
+        recommendations = {}
+        sp = xmlrpc.client.ServerProxy("http://{hostname}:{port}".format(
+            hostname=config.coedit_hostname,
+            port=config.coedit_hostport))
+        try:
+            recommendations = sp.recommend_batch(lang,
+                                                 user_edits,
+                                                 config.nrecs_per_server,
+                                                 config.coedit_threshold,
+                                                 config.coedit_backoff)
+        except xmlrpc.client.Error as e:
+            logging.error('Failed to get coedit recommendations for a batch of {0} users on {1}wiki'.format(len(user_edits), lang))
+            logging.error(e)
+
+        return(recommendations)
+
+    def prefetch(self, lang, usernames):
+        '''
+        Get the edited articles of the given users, and co-edit
+        recommendations for all of them in one batch, so that a later
+        call to `recommend()` for any of them can use these.  Anything
+        prefetched earlier for the same language is discarded.
+        Returns the number of users we prefetched for.
+
+        :param lang: Language code of the Wikipedia we're recommending for
+        :param usernames: Names of the users we're going to recommend to
+        :type usernames: list
+        '''
+        for key in [key for key in self.prefetched if key[0] == lang]:
+            del(self.prefetched[key])
+
+        all_edits = {}
+        user_edits = {}
+        for username in usernames:
+            (all_articles, user_articles) = self.get_edited_items(lang,
+                                                                  username)
+            if user_articles:
+                all_edits[username] = all_articles
+                user_edits[username] = user_articles
+
+        if not user_edits:
+            return(0)
+
+        logging.info('Getting co-edit recommendations for a batch of {} users'.format(len(user_edits)))
+        coedit_recs = self.get_coedit_recs_batch(lang, user_edits)
+        for username in user_edits:
+            self.prefetched[(lang, username)] = (all_edits[username],
+                                                 user_edits[username],
+                                                 coedit_recs.get(username))
+        return(len(user_edits))
+
     def get_textmatch_recs(self,lang, user, user_edits):
         '''
         Connect to the text recommender and get recommendations for
@@ -273,12 +340,18 @@ class RecommendationServer:
         all_articles = {}
         user_articles = []
 
+        # Co-edit recommendations, if prefetched
+        coedit_recs = None
+
         if 'articles' in rec_params and len(rec_params['articles']) > 0:
             # We were given a set of articles to use as a basis
             all_articles = {k: 1 for k in rec_params['articles']}
             user_articles = list(all_articles.keys())
             if len(user_articles) > config.nedits:
                 user_articles = user_articles[:config.nedits]
+        elif (lang, username) in self.prefetched:
+            (all_articles, user_articles, coedit_recs) = \
+                self.prefetched.pop((lang, username))
         else:
             (all_articles, user_articles) = self.get_edited_items(
                 lang, username)
@@ -313,9 +386,13 @@ class RecommendationServer:
         # Recommendations form each of our rec servers
         rec_lists = {}
 
-        logging.info('Getting recommendations from the co-edit recommender')
-        rec_lists['coedits'] = self.get_coedit_recs(lang, username,
-                                                    user_articles)
+        if coedit_recs is not None:
+            logging.info('Using prefetched co-edit recommendations')
+            rec_lists['coedits'] = coedit_recs
+        else:
+            logging.info('Getting recommendations from the co-edit recommender')
+            rec_lists['coedits'] = self.get_coedit_recs(lang, username,
+                                                        user_articles)
         if rec_lists['coedits']:
             logging.info('Successfully retrieved co-edit recommendations')
 
@@ -22,16 +22,329 @@ Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 Boston, MA  02110-1301, USA.
 '''
 
+import time
 import logging
 import operator
+import threading
 import itertools
 import collections
 
+from concurrent.futures import Future, ThreadPoolExecutor
+
 from suggestbot import config
+from suggestbot.recommenders.morelikecache import MorelikeCache
+from suggestbot.recommenders.textindex import TextIndex
 
 import pywikibot
 
+class SingleFlight:
+    '''
+    Lets concurrent calls with the same key share a single call: the
+    first caller makes it, and callers that come in while it's running
+    wait for it and get the same result (or exception).  Counts the
+    calls made and the calls that were coalesced into them.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        # Calls in progress, mapping keys to Futures of their results
+        self.in_flight = {}
+
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args):
+        '''
+        Call `func(*args)` unless a call with the same key is in
+        progress, in which case we wait for its result.
+
+        :param key: identifies calls that give the same result
+        :type key: hashable
+
+        :param func: the function to call
+        :type func: callable
+        '''
+        is_leader = False
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                future = Future()
+                self.in_flight[key] = future
+                self.calls += 1
+                is_leader = True
+
+        if not is_leader:
+            return(future.result())
+
+        try:
+            result = func(*args)
+            future.set_result(result)
+        except BaseException as e:
+            # Also on KeyboardInterrupt and SystemExit, so those waiting
+            # for this call are not left blocked
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del(self.in_flight[key])
+        return(result)
+
+class SiteBackoff:
+    '''
+    A pause shared by all searches against the same site.  Pywikibot
+    waits and retries a request when the API reports database lag or
+    rate limiting, but only that request waits: searches running in
+    other threads keep hitting the site.  When any search against the
+    site sees lag or rate limiting we set a time to resume at, and
+    every search waits until then before it is submitted.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        # When searches can resume, in time.monotonic() seconds
+        self.resume_at = 0.0
+
+        self.pauses = 0
+
+    def pause(self, delay):
+        '''
+        Hold off all searches against the site for the given time.
+
+        :param delay: number of seconds to pause
+        :type delay: float
+        '''
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+            self.pauses += 1
+
+    def wait(self):
+        '''
+        Wait until searches against the site can resume.  Checks again
+        after sleeping in case another search extended the pause.
+        '''
+        while True:
+            with self.lock:
+                delay = self.resume_at - time.monotonic()
+            if delay <= 0:
+                return()
+            time.sleep(delay)
+
+    def watch(self, site):
+        '''
+        Pause searches when pywikibot pauses a request to the site due
+        to database lag.  Pywikibot sleeps in the site throttle's
+        `lag()` while holding a lock that only write requests take, so
+        we wrap it to also set our pause.
+
+        :param site: the Wikipedia we're searching
+        :type site: pywikibot.Site
+        '''
+        throttle = site.throttle
+        lag = throttle.lag
+
+        def lag_and_pause(lagtime=None):
+            # Same wait as pywikibot's Throttle.lag()
+            delay = lagtime or pywikibot.config.retry_wait
+            if throttle.retry_after:
+                delay = max(throttle.retry_after, delay / 5)
+            self.pause(min(delay, pywikibot.config.retry_max))
+            lag(lagtime)
+
+        throttle.lag = lag_and_pause
+
+class MorelikeRequest(pywikibot.data.api.Request):
+    '''
+    API request that pauses all searches against its site when
+    pywikibot waits to retry it, e.g. after the API reports that we
+    are rate limited.
+    '''
+    def __init__(self, backoff, **kwargs):
+        self.backoff = backoff
+        super().__init__(**kwargs)
+
+    def wait(self, delay=None, **kwargs):
+        self.backoff.pause(delay or pywikibot.config.retry_wait)
+        super().wait(delay, **kwargs)
+
 class Recommender:
+    def __init__(self, workers=None, cache=None, backend=None):
+        '''
+        Instantiate the recommender.
+
+        :param workers: maximum number of search requests we have
+                        running at the same time, across all
+                        recommendation requests.  Defaults to
+                        config.text_search_workers.
+        :type workers: int
+
+        :param cache: cache of search results.  Defaults to the one
+                      in config.text_cache_path, if set.
+        :type cache: MorelikeCache
+
+        :param backend: where we search for similar articles, either
+                        "cirrussearch" (the search API of the Wikipedia)
+                        or "bm25" (a local text index, see `TextIndex`).
+                        Defaults to config.text_backend.
+        :type backend: str
+        '''
+        if workers is None:
+            workers = config.text_search_workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        if cache is None and config.text_cache_path:
+            cache = MorelikeCache(config.text_cache_path,
+                                  config.text_cache_ttl,
+                                  config.text_cache_size)
+        self.cache = cache
+
+        if backend is None:
+            backend = config.text_backend
+        self.backend = backend
+
+        # Local text indexes, mapping language codes to TextIndex objects
+        self.text_indexes = {}
+
+        # Searches in progress, shared by requests searching for
+        # the same article at the same time
+        self.searches = SingleFlight()
+
+        # Logged-in sites, mapping language codes to a tuple of the site,
+        # the search limit we're allowed, and when we logged in
+        self.sites = {}
+        self.site_lock = threading.Lock()
+
+        # Pauses of the searches against each site, mapping language
+        # codes to SiteBackoff objects
+        self.backoffs = {}
+
+    def get_site(self, lang):
+        '''
+        Get a logged-in site for the given language and the number of
+        search results we can ask for.  Sites are kept for the lifetime of
+        the recommender, so the login, user rights, and HTTP connections
+        are reused across requests.  After config.text_site_ttl seconds
+        the login and rights are checked again, and pywikibot logs in
+        again if the API reports that a session expired in between.
+        Returns a tuple of the site and the search limit.
+
+        :param lang: language code of the Wikipedia we're recommending for
+        :type lang: str
+        '''
+        with self.site_lock:
+            (site, srlimit, logged_in_at) = self.sites.get(lang,
+                                                           (None, None, None))
+            if site is not None \
+               and time.time() - logged_in_at < config.text_site_ttl:
+                return((site, srlimit))
+
+            if site is None:
+                # initialize Pywikibot site
+                site = pywikibot.Site(lang)
+                backoff = SiteBackoff()
+                backoff.watch(site)
+                self.backoffs[site.code] = backoff
+            else:
+                # forget the cached user info so login() checks the session
+                del site.userinfo
+            site.login()
+
+            # Can we get more results back? (Note: we don't necessarily need
+            # too many, as we're looking for _similar_ articles)
+            srlimit = 50
+            if site.has_right('apihighlimits'):
+                srlimit = 100
+
+            self.sites[lang] = (site, srlimit, time.time())
+            logging.info("logged in to {lang}wiki, search limit is {srlimit}".format(lang=lang, srlimit=srlimit))
+        return((site, srlimit))
+
+    def get_morelike(self, site, page_title, srlimit):
+        '''
+        Get the articles similar to the given article from our cache, or
+        search for them.  If the same article is being searched for by
+        another request, we wait for and share its results.  Returns a
+        list of titles ranked by similarity, or None if the search failed.
+
+        :param site: the Wikipedia we're searching
+        :type site: pywikibot.Site
+
+        :param page_title: title of the article
+        :type page_title: str
+
+        :param srlimit: maximum number of results
+        :type srlimit: int
+        '''
+        if self.cache is not None:
+            results = self.cache.get(site.code, page_title, srlimit)
+            if results is not None:
+                return(results)
+
+        return(self.searches.do((site.code, page_title, srlimit),
+                                self.search_morelike,
+                                site, page_title, srlimit))
+
+    def search_morelike(self, site, page_title, srlimit):
+        '''
+        Search for articles similar to the given article, and cache the
+        results.  Returns a list of titles ranked by similarity, or None
+        if the search failed.  Pywikibot waits and retries if the API
+        reports database lag or rate limiting, and we then hold off all
+        searches against the same site until the wait is over (see
+        `SiteBackoff`).
+
+        :param site: the Wikipedia we're searching
+        :type site: pywikibot.Site
+
+        :param page_title: title of the article
+        :type page_title: str
+
+        :param srlimit: maximum number of results
+        :type srlimit: int
+        '''
+        backoff = self.backoffs[site.code]
+        q = MorelikeRequest(backoff, site=site, action='query')
+        q['list'] = 'search'
+        # q['srbackend'] = u'CirrusSearch'
+        q['srnamespace'] = 0
+        # FIXME: add quotes around title and escape quotes in title?
+        q['srsearch'] = 'morelike:{title}'.format(title=page_title)
+        q['srlimit'] = srlimit
+        try:
+            backoff.wait()
+            reqdata = q.submit()
+        except pywikibot.exceptions.MaxlagTimeoutError:
+            logging.warning('gave up on query on {title} due to database lag'.format(title=page_title))
+            return(None)
+
+        if not 'query' in reqdata \
+           or not 'search' in reqdata['query']:
+            logging.warning('no results for query on {title}'.format(title=page_title))
+            return(None)
+
+        logging.info('completed fetching recommendations for {title}'.format(title=page_title))
+        results = [article['title'] for article in reqdata['query']['search']]
+        if self.cache is not None:
+            self.cache.put(site.code, page_title, srlimit, results)
+        return(results)
+
+    def get_text_index(self, lang):
+        '''
+        Get the local text index for the given language, loading it
+        from config.text_index_dir the first time it's needed.  Returns
+        None if there is no index we can read.
+
+        :param lang: language code of the Wikipedia we're recommending for
+        :type lang: str
+        '''
+        if lang not in self.text_indexes:
+            index = TextIndex.load(config.text_index_dir.format(lang))
+            if index is None:
+                return(None)
+            self.text_indexes[lang] = index
+        return(self.text_indexes[lang])
+
     def recommend(self, user, lang, articles, params):
         """
         Find articles matching a given set of articles for a given user.
@@ -59,59 +372,61 @@ class Recommender:
         # print got request info
         logging.info("got request for {lang}:User:{username} to find {nrecs} recommend articles based on {num} articles".format(lang=lang, username=user, nrecs=nrecs, num=numArticles))
 
-        # initialize Pywikibot site
-        site = pywikibot.Site(lang)
-        site.login()
-
-        # Can we get more results back? (Note: we don't necessarily need
-        # too many, as we're looking for _similar_ articles)
-        srlimit = 50
-        if site.has_right('apihighlimits'):
-            srlimit = 100
-        
         # dict of resulting recommendations mapping titles to Borda scores
         # (as ints, defaults are 0)
         recs = collections.defaultdict(int)
 
-        # query parameters:
-        # action=query
-        # list=search
-        # srsearch=morelike:{title}
-        # srnamespace=0 (is the default)
-        # srlimit=50 (tested by trial & error, bots can get <= 500)
-        # format=json
-
         # FIXME: start timing
 
-        for page_title in articles:
-            q = pywikibot.data.api.Request(site=site,
-                                           action='query')
-            q['list'] = 'search'
-            # q['srbackend'] = u'CirrusSearch'
-            q['srnamespace'] = 0
-            # FIXME: add quotes around title and escape quotes in title?
-            q['srsearch'] = 'morelike:{title}'.format(title=page_title)
-            q['srlimit'] = srlimit
-            reqdata = q.submit()
+        if self.backend == 'bm25':
+            # Search the local index, which has no limits on results
+            index = self.get_text_index(lang)
+            if index is None:
+                logging.error("no text index available for {lang}wiki".format(lang=lang))
+                return([])
 
-            if not 'query' in reqdata \
-               or not 'search' in reqdata['query']:
-                logging.warning('no results for query on {title}'.format(title=page_title))
-            else:
-                results = reqdata['query']['search']
+            srlimit = 100
+            all_results = (index.morelike(page_title, srlimit)
+                           for page_title in articles)
+        else:
+            (site, srlimit) = self.get_site(lang)
+
+            # query parameters:
+            # action=query
+            # list=search
+            # srsearch=morelike:{title}
+            # srnamespace=0 (is the default)
+            # srlimit=50 (tested by trial & error, bots can get <= 500)
+            # format=json
+
+            # The searches run concurrently, their results are merged
+            # in the order of the articles so ties are broken the same
+            # way regardless of which search finished first.
+            searches = [self.executor.submit(self.get_morelike,
+                                             site, page_title, srlimit)
+                        for page_title in articles]
+            all_results = (search.result() for search in searches)
+
+        for results in all_results:
+            if results:
                 # calculate a Borda score for each article (len(list) - rank)
                 # and throw it into the result set.
                 n = len(results)
                 score = itertools.count(n, step=-1)
                 for article in results:
                     s = next(score)
-                    recs[article['title']] += s
-                
-                logging.info('completed fetching recommendations for {title}'.format(title=page_title))
+                    recs[article] += s
+
                 logging.info('number of recommendations currently {0}'.format(len(recs)))
 
         # FIXME: end timing, write out if verbose
 
+        if self.backend != 'bm25':
+            if self.cache is not None:
+                lookups = self.cache.hits + self.cache.misses
+                logging.info("morelike cache has had {0} hits and {1} misses ({2:.1%} hit rate)".format(self.cache.hits, self.cache.misses, self.cache.hits / lookups if lookups else 0.0))
+            logging.info("made {0} morelike searches, {1} more were coalesced with searches in progress".format(self.searches.calls, self.searches.coalesced))
+
         # take out edits from results
         for page_title in articles:
             try:
@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+'''
+Local full-text index of the articles (namespace 0) of a Wikipedia,
+used by the text-based recommender to find similar articles with BM25
+instead of searching CirrusSearch.  The index is built from an XML page
+dump or a JSON lines dump (one object with "title" and "text" per line,
+as in the CirrusSearch dumps) and queried in-process.
+
+Articles and terms are numbered in the order they're found.  An index
+is a directory of numpy array files that are memory-mapped when loaded:
+
+  header.json        format version, language, when it was built, sizes
+  titles.json        titles of the articles, by article ID
+  terms.json         the terms, by term ID
+  doc_lengths.npy    int32, number of terms in each article
+  doc_offsets.npy    int64, start of each article's terms in doc_terms.npy
+  doc_terms.npy      int32, IDs of the terms in each article
+  doc_freqs.npy      int32, number of times each term occurs in the article
+  term_offsets.npy   int64, start of each term's postings in post_docs.npy
+  post_docs.npy      int32, IDs of the articles each term occurs in
+  post_freqs.npy     int32, number of times the term occurs in the article
+
+Copyright (C) 2016 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+'''
+
+import os
+import re
+import bz2
+import gzip
+import json
+import shutil
+import logging
+import collections
+
+import xml.etree.ElementTree as ET
+
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+import mwparserfromhell as mwp
+
+# Version of the index format, bumped when it changes
+INDEX_VERSION = 1
+
+# Format of timestamps in an index header
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Arrays stored in an index directory
+ARRAY_NAMES = ['doc_lengths', 'doc_offsets', 'doc_terms', 'doc_freqs',
+               'term_offsets', 'post_docs', 'post_freqs']
+
+# Terms are runs of letters and digits, terms that are only digits
+# or shorter than this are skipped
+TOKEN_RE = re.compile(r'\w+', re.U)
+MIN_TOKEN_LENGTH = 2
+
+def tokenize(text):
+    '''
+    Split plain text into lowercase terms.
+
+    :param text: the text
+    :type text: str
+    '''
+    return([token for token in TOKEN_RE.findall(text.lower())
+            if len(token) >= MIN_TOKEN_LENGTH and not token.isdigit()])
+
+def open_dump(path):
+    '''
+    Open a dump file for reading as text, decompressing it if it's
+    compressed with bzip2 or gzip.
+    '''
+    if path.endswith('.bz2'):
+        return(bz2.open(path, 'rt', encoding='utf-8'))
+    elif path.endswith('.gz'):
+        return(gzip.open(path, 'rt', encoding='utf-8'))
+    return(open(path, 'r', encoding='utf-8'))
+
+def read_xml_dump(path):
+    '''
+    Read articles from an XML page dump, skipping redirects and pages
+    outside the article namespace.  Yields tuples of title and plain
+    text, with the wiki markup stripped.
+
+    :param path: path to the dump file
+    :type path: str
+    '''
+    with open_dump(path) as infile:
+        root = None
+        title = None
+        namespace = None
+        is_redirect = False
+        for (event, elem) in ET.iterparse(infile, events=('start', 'end')):
+            if event == 'start':
+                # Keep the root so we can remove the pages we've read
+                if root is None:
+                    root = elem
+                continue
+            # Tags are qualified with the export format's namespace
+            tag = elem.tag.rsplit('}', 1)[-1]
+            if tag == 'title':
+                title = elem.text
+            elif tag == 'ns':
+                namespace = elem.text
+            elif tag == 'redirect':
+                is_redirect = True
+            elif tag == 'page':
+                if namespace == '0' and not is_redirect:
+                    text = ''
+                    for child in elem.iter():
+                        if child.tag.rsplit('}', 1)[-1] == 'text':
+                            text = child.text or ''
+                    yield (title, mwp.parse(text).strip_code())
+                title = None
+                namespace = None
+                is_redirect = False
+                # Clearing the page alone leaves it attached to the root
+                root.clear()
+
+def read_json_dump(path):
+    '''
+    Read articles from a JSON lines dump, where each article is an object
+    with "title" and "text" keys.  Lines without them (e.g. the index
+    actions in CirrusSearch dumps) and articles outside the article
+    namespace are skipped.  Yields tuples of title and plain text.
+
+    :param path: path to the dump file
+    :type path: str
+    '''
+    with open_dump(path) as infile:
+        for line in infile:
+            line = line.strip()
+            if not line:
+                continue
+            article = json.loads(line)
+            if 'title' not in article or 'text' not in article \
+               or article.get('namespace', 0) != 0:
+                continue
+            yield (article['title'], article['text'])
+
+class TextIndex:
+    def __init__(self, lang):
+        '''
+        Instantiate an empty index.  Use `build()` or `load()` to get
+        one with data in it.
+
+        :param lang: Language code of the Wikipedia this index covers
+        :type lang: str
+        '''
+        self.lang = lang
+
+        # Titles of the articles and terms, and mappings to their IDs
+        self.titles = []
+        self.title_ids = {}
+        self.terms = []
+        self.term_ids = {}
+
+        # Forward index of the terms in each article
+        self.doc_lengths = np.zeros(0, dtype=np.int32)
+        self.doc_offsets = np.zeros(1, dtype=np.int64)
+        self.doc_terms = np.zeros(0, dtype=np.int32)
+        self.doc_freqs = np.zeros(0, dtype=np.int32)
+
+        # Inverted index of the articles each term occurs in
+        self.term_offsets = np.zeros(1, dtype=np.int64)
+        self.post_docs = np.zeros(0, dtype=np.int32)
+        self.post_freqs = np.zeros(0, dtype=np.int32)
+
+        # Average number of terms in an article
+        self.avg_length = 0.0
+
+        # When the index was built
+        self.built = None
+
+    def __len__(self):
+        '''
+        Number of articles in the index.
+        '''
+        return(len(self.titles))
+
+    @classmethod
+    def build(cls, lang, articles):
+        '''
+        Build an index from the given articles.
+
+        :param lang: Language code of the Wikipedia the articles are from
+        :type lang: str
+
+        :param articles: tuples of title and plain text, e.g. from
+                         `read_xml_dump()` or `read_json_dump()`
+        :type articles: iterable
+        '''
+        index = cls(lang)
+        doc_lengths = array('i')
+        doc_offsets = array('q', [0])
+        doc_terms = array('i')
+        doc_freqs = array('i')
+        for (title, text) in articles:
+            if title in index.title_ids:
+                continue
+            tokens = tokenize(text)
+            counts = collections.Counter(tokens)
+            for (term, freq) in counts.items():
+                term_id = index.term_ids.get(term)
+                if term_id is None:
+                    term_id = len(index.terms)
+                    index.terms.append(term)
+                    index.term_ids[term] = term_id
+                doc_terms.append(term_id)
+                doc_freqs.append(freq)
+
+            index.title_ids[title] = len(index.titles)
+            index.titles.append(title)
+            doc_lengths.append(len(tokens))
+            doc_offsets.append(len(doc_terms))
+            if len(index.titles) % 10000 == 0:
+                logging.info("indexed {} articles".format(len(index.titles)))
+
+        index.doc_lengths = np.frombuffer(doc_lengths, dtype=np.int32)
+        index.doc_offsets = np.frombuffer(doc_offsets, dtype=np.int64)
+        index.doc_terms = np.frombuffer(doc_terms, dtype=np.int32)
+        index.doc_freqs = np.frombuffer(doc_freqs, dtype=np.int32)
+
+        # Invert it, articles are in ascending order within each term
+        docs = np.repeat(np.arange(len(index.titles), dtype=np.int32),
+                         np.diff(index.doc_offsets))
+        order = np.argsort(index.doc_terms, kind='stable')
+        index.post_docs = docs[order]
+        index.post_freqs = index.doc_freqs[order]
+        index.term_offsets = np.zeros(len(index.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(index.doc_terms, minlength=len(index.terms)),
+                  out=index.term_offsets[1:])
+
+        if len(index.titles):
+            index.avg_length = float(index.doc_lengths.mean())
+        index.built = datetime.now(timezone.utc)
+        logging.info("built text index for {}wiki with {} articles and {} terms".format(lang, len(index.titles), len(index.terms)))
+        return(index)
+
+    def save(self, path):
+        '''
+        Write the index to the given directory.  It is written to
+        a temporary directory first and then swapped in, so processes
+        reading the old one are unaffected.
+
+        :param path: Path to the index directory
+        :type path: str
+        '''
+        new_path = '{}.new'.format(path)
+        old_path = '{}.old'.format(path)
+        if os.path.isdir(new_path):
+            shutil.rmtree(new_path)
+        os.makedirs(new_path)
+
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(new_path, '{}.npy'.format(name)),
+                    getattr(self, name))
+        for name in ['titles', 'terms']:
+            with open(os.path.join(new_path, '{}.json'.format(name)),
+                      'w', encoding='utf-8') as outfile:
+                json.dump(getattr(self, name), outfile, ensure_ascii=False)
+
+        # Header is written last, a directory without one is incomplete
+        with open(os.path.join(new_path, 'header.json'), 'w') as outfile:
+            json.dump({'version': INDEX_VERSION,
+                       'lang': self.lang,
+                       'built': self.built.strftime(TIMESTAMP_FORMAT),
+                       'num_docs': len(self.titles),
+                       'num_terms': len(self.terms)},
+                      outfile)
+
+        if os.path.isdir(path):
+            os.rename(path, old_path)
+        os.rename(new_path, path)
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+        logging.info("saved text index for {}wiki to {}".format(self.lang,
+                                                                path))
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Load an index from a directory, memory-mapping the arrays.
+        Returns None if the directory does not contain an index we
+        can read.
+
+        :param path: Path to the index directory
+        :type path: str
+        '''
+        try:
+            with open(os.path.join(path, 'header.json')) as infile:
+                header = json.load(infile)
+        except (IOError, ValueError):
+            logging.warning("Unable to read text index header in {}".format(path))
+            return(None)
+
+        if header.get('version') != INDEX_VERSION:
+            logging.warning("Text index in {} has version {}, expected {}".format(path, header.get('version'), INDEX_VERSION))
+            return(None)
+
+        index = cls(header['lang'])
+        for name in ARRAY_NAMES:
+            setattr(index, name,
+                    np.load(os.path.join(path, '{}.npy'.format(name)),
+                            mmap_mode='r'))
+        for name in ['titles', 'terms']:
+            with open(os.path.join(path, '{}.json'.format(name)),
+                      encoding='utf-8') as infile:
+                setattr(index, name, json.load(infile))
+        index.title_ids = {title: i for (i, title) in enumerate(index.titles)}
+        index.term_ids = {term: i for (i, term) in enumerate(index.terms)}
+        if len(index.titles):
+            index.avg_length = float(index.doc_lengths.mean())
+        index.built = datetime.strptime(header['built'],
+                                        TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+        if len(index.titles) != header['num_docs'] \
+           or len(index.terms) != header['num_terms'] \
+           or len(index.doc_lengths) != len(index.titles) \
+           or len(index.term_offsets) != len(index.terms) + 1:
+            logging.warning("Text index in {} is inconsistent".format(path))
+            return(None)
+
+        logging.info("loaded text index for {}wiki built {} with {} articles and {} terms".format(index.lang, index.built, len(index.titles), len(index.terms)))
+        return(index)
+
+    def idf(self, term_ids):
+        '''
+        BM25 inverse document frequency of the given terms.
+
+        :param term_ids: IDs of the terms
+        :type term_ids: numpy.ndarray
+        '''
+        doc_freq = self.term_offsets[term_ids + 1] - self.term_offsets[term_ids]
+        return(np.log(1.0 + (len(self.titles) - doc_freq + 0.5)
+                      / (doc_freq + 0.5)))
+
+    def morelike(self, title, limit, max_query_terms=25, min_doc_freq=2,
+                 k1=1.2, b=0.75):
+        '''
+        Find the articles most similar to the given article, like
+        CirrusSearch's morelike: search.  The article's most distinctive
+        terms by tf-idf are used as a query, and articles are ranked
+        by their BM25 score for it.  Returns a list of titles ranked
+        by similarity, or None if the article is not in the index.
+
+        :param title: Title of the article
+        :type title: str
+
+        :param limit: Maximum number of articles returned
+        :type limit: int
+
+        :param max_query_terms: Maximum number of terms in the query
+        :type max_query_terms: int
+
+        :param min_doc_freq: Terms found in fewer articles than this
+                             are not used in the query
+        :type min_doc_freq: int
+
+        :param k1: BM25 term frequency saturation
+        :type k1: float
+
+        :param b: BM25 document length normalisation
+        :type b: float
+        '''
+        doc_id = self.title_ids.get(title)
+        if doc_id is None:
+            return(None)
+
+        # Pick the query terms, ties broken on term ID
+        start = self.doc_offsets[doc_id]
+        end = self.doc_offsets[doc_id + 1]
+        term_ids = np.asarray(self.doc_terms[start:end], dtype=np.int64)
+        freqs = np.asarray(self.doc_freqs[start:end])
+        doc_freq = self.term_offsets[term_ids + 1] - self.term_offsets[term_ids]
+        keep = doc_freq >= min_doc_freq
+        term_ids = term_ids[keep]
+        idf = self.idf(term_ids)
+        weights = freqs[keep] * idf
+        order = np.lexsort((term_ids, -weights))[:max_query_terms]
+        term_ids = term_ids[order]
+        idf = idf[order]
+
+        scores = np.zeros(len(self.titles))
+        for (term_id, term_idf) in zip(term_ids.tolist(), idf.tolist()):
+            docs = self.post_docs[self.term_offsets[term_id]:
+                                  self.term_offsets[term_id + 1]]
+            tf = self.post_freqs[self.term_offsets[term_id]:
+                                 self.term_offsets[term_id + 1]]
+            norm = k1 * (1.0 - b + b * self.doc_lengths[docs]
+                         / self.avg_length)
+            scores[docs] += term_idf * tf * (k1 + 1.0) / (tf + norm)
+        scores[doc_id] = 0.0
+
+        # Best scoring articles, ties broken on article ID
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > limit:
+            kth = np.partition(scores[candidates],
+                               len(candidates) - limit)[len(candidates) - limit]
+            candidates = candidates[scores[candidates] >= kth]
+        order = np.lexsort((candidates, -scores[candidates]))[:limit]
+        return([self.titles[i] for i in candidates[order].tolist()])
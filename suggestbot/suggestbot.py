@@ -179,6 +179,28 @@ class SuggestBot:
 
         return(recs)
 
+    def prefetchRecs(self, usernames):
+        '''Ask the main recommendation server to prepare recommendations
+           for the given users in a single batch, so that later calls to
+           getRecs() for them are faster.  Returns the number of users
+           recommendations were prepared for.
+
+           @param usernames: Names of the users we will recommend articles to
+           @type usernames: list
+           '''
+
+        recServer = xmlrpc.client.ServerProxy("http://{hostname}:{port}".format(hostname=config.main_server_hostname,
+                                                                            port=config.main_server_hostport),
+                                          allow_none=True)
+        n_users = 0
+        try:
+            n_users = recServer.prefetch(config.wp_langcode, usernames)
+        except xmlrpc.client.Fault as e:
+            logging.error("something went wrong when trying to prefetch suggestions:")
+            logging.error("{}".format(e))
+
+        return(n_users)
+
     def create_invoke(self, recs, module_name, method_name,
                       cat_order=[], add_include_clause=False):
         '''
@@ -21,6 +21,7 @@ from time import sleep
 from suggestbot import config
 from suggestbot import db
 import suggestbot.utilities.reverts as sur
+import suggestbot.utilities.userstats as sus
 
 class RecentChangesDaemon:
     def __init__(self):
@@ -244,6 +245,13 @@ class RecentChangesDaemon:
                           rev_is_minor=%(minor)s""".format(
                               config.revision_table[lang])
 
+        # Query to find users with revisions older than a given timestamp,
+        # their statistics change when those revisions are deleted
+        get_expired_users_query = """SELECT DISTINCT rev_user
+                                     FROM {}
+                                     WHERE rev_timestamp < %(timestamp)s""".format(
+                                         config.revision_table[lang])
+
         # Query to delete revisions that are older than a given timestamp
         delete_query = """DELETE FROM {}
                           WHERE rev_timestamp < %(timestamp)s""".format(
@@ -275,6 +283,9 @@ class RecentChangesDaemon:
 
         ## counter to trigger commits
         num_inserted_revisions = 0
+
+        # users whose statistics need updating
+        updated_users = set()
         
         for revdata in generator:
             is_revert = 0
@@ -335,6 +346,7 @@ class RecentChangesDaemon:
                                    'revert': is_revert,
                                    'minor': is_minor})
                 num_inserted_revisions += 1
+                updated_users.add(revdata['user'])
             except MySQLdb.Error as e:
                 logging.error('failed to insert revision data')
                 logging.error('MySQL Error: {} : {}'.format(e.args[0],
@@ -351,6 +363,9 @@ class RecentChangesDaemon:
         cutoff = datetime.datetime.utcnow() \
                  - datetime.timedelta(days=config.rc_keep[lang])
         try:
+            db_cursor.execute(get_expired_users_query, {'timestamp': cutoff})
+            for row in db_cursor.fetchall():
+                updated_users.add(row['rev_user'].decode('utf-8'))
             db_cursor.execute(delete_query, {'timestamp': cutoff})
             db_conn.commit()
         except MySQLdb.Error as e:
@@ -359,5 +374,10 @@ class RecentChangesDaemon:
 
         logging.info("info: done deleting old revisions")
 
+        # Update the statistics of users who got new or lost old revisions
+        logging.info("updating statistics for {} users".format(
+            len(updated_users)))
+        sus.update_user_stats(db_conn, db_cursor, lang, updated_users)
+
         # ok, done
         return()
@@ -846,7 +846,13 @@ class Subscribers:
             shuffle(userQueue)
 
         # for each user on said list...
-        for user in userQueue:
+        for (i, user) in enumerate(userQueue):
+            # Prepare recommendations for the next batch of users in one go,
+            # their profiles often overlap.
+            if not i % config.rec_batch_size:
+                sbot.prefetchRecs([next_user['username'] for next_user
+                                   in userQueue[i:i+config.rec_batch_size]])
+
             # update database to processing
             dbcursor.execute(setStatusQuery,
                              {'status': 'processing',
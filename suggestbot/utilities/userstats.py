@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8  -*-
+'''
+Library for maintaining and reading the per-user edit statistics tables,
+which hold the number of edits, number of non-minor/non-reverting edits,
+and number of distinct articles for every user in a revision table.
+
+Copyright (C) 2016 SuggestBot Dev Group
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+Boston, MA  02110-1301, USA.
+'''
+
+import logging
+
+import MySQLdb
+
+from more_itertools import chunked
+
+from suggestbot import config
+
+# Number of users we update statistics for in each statement
+SLICE_SIZE = 500
+
+def update_user_stats(db_conn, db_cursor, lang, usernames):
+    '''
+    Recompute the statistics of the given users from the revision table.
+    Users who no longer have any revisions are removed from the table.
+
+    :param db_conn: open connection to the SuggestBot database
+    :type db_conn: MySQLdb.Connection
+
+    :param db_cursor: cursor on `db_conn`
+    :type db_cursor: MySQLdb.cursors.Cursor
+
+    :param lang: language code of the Wikipedia we're updating for
+    :type lang: str
+
+    :param usernames: names of the users whose statistics changed
+    :type usernames: iterable
+    '''
+
+    delete_query = """DELETE FROM {userstats_table}
+                      WHERE us_user IN ({userlist})"""
+
+    insert_query = """INSERT INTO {userstats_table}
+                      (us_user, us_edits, us_major_edits, us_articles,
+                       us_major_articles, us_max_article_edits)
+                      SELECT rev_user, SUM(num_edits), SUM(num_major_edits),
+                             COUNT(*), SUM(num_major_edits > 0),
+                             MAX(num_edits)
+                      FROM (SELECT rev_user, rev_title,
+                                   COUNT(*) AS num_edits,
+                                   SUM(rev_is_minor=0
+                                       AND rev_comment_is_revert=0)
+                                   AS num_major_edits
+                            FROM {revision_table}
+                            WHERE rev_user IN ({userlist})
+                            GROUP BY rev_user, rev_title) AS user_articles
+                      GROUP BY rev_user"""
+
+    num_users = 0
+    for subset in chunked(usernames, SLICE_SIZE):
+        userlist = ','.join(['%s'] * len(subset))
+        params = [user.encode('utf-8') for user in subset]
+        try:
+            db_cursor.execute(delete_query.format(
+                userstats_table=config.userstats_table[lang],
+                userlist=userlist), params)
+            db_cursor.execute(insert_query.format(
+                userstats_table=config.userstats_table[lang],
+                revision_table=config.revision_table[lang],
+                userlist=userlist), params)
+            db_conn.commit()
+            num_users += len(subset)
+        except MySQLdb.Error as e:
+            logging.error("unable to update user statistics")
+            logging.error("MySQL Error {}: {}".format(e.args[0], e.args[1]))
+            db_conn.rollback()
+
+    logging.info("updated statistics for {} users".format(num_users))
+    return(num_users)
+
+def rebuild_user_stats(db_conn, db_cursor, lang):
+    '''
+    Rebuild the statistics table for the given language from scratch.
+
+    :param db_conn: open connection to the SuggestBot database
+    :type db_conn: MySQLdb.Connection
+
+    :param db_cursor: cursor on `db_conn`
+    :type db_cursor: MySQLdb.cursors.Cursor
+
+    :param lang: language code of the Wikipedia we're updating for
+    :type lang: str
+    '''
+
+    delete_query = """DELETE FROM {}""".format(config.userstats_table[lang])
+
+    insert_query = """INSERT INTO {userstats_table}
+                      (us_user, us_edits, us_major_edits, us_articles,
+                       us_major_articles, us_max_article_edits)
+                      SELECT rev_user, SUM(num_edits), SUM(num_major_edits),
+                             COUNT(*), SUM(num_major_edits > 0),
+                             MAX(num_edits)
+                      FROM (SELECT rev_user, rev_title,
+                                   COUNT(*) AS num_edits,
+                                   SUM(rev_is_minor=0
+                                       AND rev_comment_is_revert=0)
+                                   AS num_major_edits
+                            FROM {revision_table}
+                            GROUP BY rev_user, rev_title) AS user_articles
+                      GROUP BY rev_user""".format(
+                          userstats_table=config.userstats_table[lang],
+                          revision_table=config.revision_table[lang])
+
+    try:
+        db_cursor.execute(delete_query)
+        db_cursor.execute(insert_query)
+        db_conn.commit()
+    except MySQLdb.Error as e:
+        logging.error("unable to rebuild user statistics for {}wiki".format(
+            lang))
+        logging.error("MySQL Error {}: {}".format(e.args[0], e.args[1]))
+        db_conn.rollback()
+        return(False)
+
+    logging.info("rebuilt user statistics for {}wiki".format(lang))
+    return(True)
+
+def get_user_stats(db_cursor, lang, usernames):
+    '''
+    Get the statistics of a set of users in a single query.  Returns a dict
+    mapping usernames to dicts with the keys 'edits', 'major_edits',
+    'articles', 'major_articles', and 'max_article_edits'.  Users who are
+    not in the statistics table are left out.
+
+    :param db_cursor: dictionary cursor on the SuggestBot database
+    :type db_cursor: MySQLdb.cursors.DictCursor
+
+    :param lang: language code of the Wikipedia we're working with
+    :type lang: str
+
+    :param usernames: names of the users we want statistics for
+    :type usernames: iterable
+    '''
+
+    get_stats_query = """SELECT us_user, us_edits, us_major_edits,
+                                us_articles, us_major_articles,
+                                us_max_article_edits
+                         FROM {userstats_table}
+                         WHERE us_user IN ({userlist})"""
+
+    user_stats = {}
+    usernames = list(usernames)
+    if not usernames:
+        return(user_stats)
+
+    try:
+        db_cursor.execute(
+            get_stats_query.format(
+                userstats_table=config.userstats_table[lang],
+                userlist=','.join(['%s'] * len(usernames))),
+            [user.encode('utf-8') for user in usernames])
+        for row in db_cursor:
+            user_stats[row['us_user'].decode('utf-8')] = {
+                'edits': row['us_edits'],
+                'major_edits': row['us_major_edits'],
+                'articles': row['us_articles'],
+                'major_articles': row['us_major_articles'],
+                'max_article_edits': row['us_max_article_edits'],
+            }
+    except MySQLdb.Error as e:
+        logging.warning("unable to get user statistics for {}wiki".format(
+            lang))
+        logging.warning("MySQL Error {}: {}".format(e.args[0], e.args[1]))
+
+    return(user_stats)
+
+def get_edit_counts(db_cursor, lang, usernames):
+    '''
+    Get the number of edits for a set of users in a single query.
+    Returns a dict mapping usernames to edit counts, users who are not
+    in the statistics table are left out.
+
+    :param db_cursor: dictionary cursor on the SuggestBot database
+    :type db_cursor: MySQLdb.cursors.DictCursor
+
+    :param lang: language code of the Wikipedia we're working with
+    :type lang: str
+
+    :param usernames: names of the users we want edit counts for
+    :type usernames: iterable
+    '''
+    return({user: stats['edits'] for (user, stats)
+            in get_user_stats(db_cursor, lang, usernames).items()})
@@ -0,0 +1,115 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Benchmark the co-edit recommender's threshold backoff on users with
+little overlap with other editors, comparing recomputing the
+neighbourhood at every threshold (the old behaviour) with computing
+it once and re-ranking at each threshold.
+
+Uses a synthetic in-memory co-edit index, so no database is needed.
+'''
+
+import time
+import random
+import logging
+
+from suggestbot import config
+from suggestbot.recommenders.coedit import Recommender
+from suggestbot.recommenders.coeditindex import CoeditIndex
+
+def synthetic_revisions(n_users, n_titles, n_revisions, seed=42):
+    '''
+    Generate revisions where both user activity and article popularity
+    are heavily skewed, similar to what we see on Wikipedia.
+    '''
+    rng = random.Random(seed)
+    for i in range(n_revisions):
+        user = int(n_users * rng.random() ** 3)
+        title = int(n_titles * rng.random() ** 2)
+        yield ('User {}'.format(user), 'Article {}'.format(title),
+               rng.random() < 0.7)
+
+def recommend_with_recompute(recommender, lang, username, contribs, params):
+    '''
+    Threshold backoff the way it used to be done, finding the
+    neighbourhood again from scratch for every threshold.
+    '''
+    recs = recommender.get_recs_at_coedit_threshold(lang, username,
+                                                    contribs, params)
+    while params['backoff'] \
+          and (params['threshold'] > params['min-threshold']) \
+          and (len(recs) < params['nrecs']):
+        params['threshold'] -= 1
+        recs = recommender.get_recs_at_coedit_threshold(lang, username,
+                                                        contribs, params)
+    return(recs[:params['nrecs']])
+
+def main():
+    import argparse
+    cli_parser = argparse.ArgumentParser(
+        description="Benchmark co-edit threshold backoff on a synthetic index."
+        )
+    cli_parser.add_argument('--users', type=int, default=50000,
+                            help='number of users in the synthetic index')
+    cli_parser.add_argument('--titles', type=int, default=200000,
+                            help='number of articles in the synthetic index')
+    cli_parser.add_argument('--revisions', type=int, default=2000000,
+                            help='number of revisions in the synthetic index')
+    cli_parser.add_argument('--samples', type=int, default=20,
+                            help='number of low-overlap users to test')
+    cli_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='Be more verbose')
+    args = cli_parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    test_lang = 'en'
+
+    index = CoeditIndex.from_revisions(
+        test_lang, synthetic_revisions(args.users, args.titles,
+                                       args.revisions))
+    print("Built index with {} users, {} articles, {} user/article pairs".format(len(index.users), len(index.titles), len(index)))
+
+    recommender = Recommender()
+    recommender.indexes[test_lang] = index
+
+    # Low-overlap users have a handful of edits to rarely edited articles,
+    # which forces the recommender to back off on the threshold.
+    params = {
+        'backoff': True,
+        'nrecs': config.nrecs_per_server,
+        'threshold': config.coedit_threshold,
+        'min-threshold': config.coedit_min_threshold,
+        'association-threshold': config.coedit_assoc_threshold,
+        'filter-threshold': config.coedit_filter_threshold,
+    }
+
+    rng = random.Random(7)
+    rare_titles = ['Article {}'.format(i)
+                   for i in range(args.titles//2, args.titles)
+                   if 'Article {}'.format(i) in index.title_ids]
+    test_users = []
+    for i in range(args.samples):
+        contribs = rng.sample(rare_titles, 10)
+        test_users.append(('Benchmark user {}'.format(i), contribs))
+
+    for (label, method) in [('recompute per threshold',
+                             lambda u, c: recommend_with_recompute(
+                                 recommender, test_lang, u, c, dict(params))),
+                            ('single pass',
+                             lambda u, c: recommender.recommend(
+                                 u, test_lang, c, params['nrecs'],
+                                 params['threshold'], params['backoff']))]:
+        n_recs = 0
+        start = time.perf_counter()
+        for (username, contribs) in test_users:
+            n_recs += len(method(username, contribs))
+        elapsed = time.perf_counter() - start
+        print("{}: {:.3f}s for {} users ({:.1f}ms/user), {} recs".format(
+            label, elapsed, len(test_users),
+            1000 * elapsed / len(test_users), n_recs))
+    return()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Report recall and latency of approximate (MinHash/LSH) neighbour search
+in the co-edit recommender against exact neighbour search, for a range
+of LSH settings.  Recall is measured both for the neighbourhood (top 250
+neighbours) and for the recommendations.
+
+Runs on a synthetic index by default, or on the revision table of a
+given language so a setting can be picked for it (see config.coedit_lsh).
+'''
+
+import time
+import random
+import logging
+
+from suggestbot import config
+from suggestbot.recommenders.coedit import Recommender
+from suggestbot.recommenders.coeditindex import CoeditIndex
+from suggestbot.recommenders.coeditlsh import CoeditLSH
+
+def synthetic_revisions(n_users, n_titles, n_revisions, seed=42):
+    '''
+    Generate revisions from users who each mostly edit within one of a
+    set of topics, with skewed user activity.
+    '''
+    rng = random.Random(seed)
+    n_topics = max(n_titles // 50, 1)
+    user_topics = [rng.randrange(n_topics) for i in range(n_users)]
+    for i in range(n_revisions):
+        user = int(n_users * rng.random() ** 3)
+        if rng.random() < 0.8:
+            title = user_topics[user] * 50 + int(50 * rng.random() ** 2)
+        else:
+            title = rng.randrange(n_titles)
+        yield ('User {}'.format(user), 'Article {}'.format(title),
+               rng.random() < 0.7)
+
+def recall(exact, approximate):
+    '''
+    Fraction of the items in `exact` that are also in `approximate`.
+    '''
+    if not exact:
+        return(1.0)
+    return(len(set(exact) & set(approximate)) / len(exact))
+
+def main():
+    import argparse
+    cli_parser = argparse.ArgumentParser(
+        description="Report recall and latency of LSH neighbour search in the co-edit recommender."
+        )
+    cli_parser.add_argument('-l', '--lang', type=str, default=None,
+                            help='build the index from the revision table of this language instead of using synthetic data')
+    cli_parser.add_argument('-s', '--setting', action='append', default=[],
+                            help='LSH setting to test as BANDSxROWS, e.g. 64x1 (can be repeated)')
+    cli_parser.add_argument('--users', type=int, default=20000,
+                            help='number of users in the synthetic index')
+    cli_parser.add_argument('--titles', type=int, default=100000,
+                            help='number of articles in the synthetic index')
+    cli_parser.add_argument('--revisions', type=int, default=1000000,
+                            help='number of revisions in the synthetic index')
+    cli_parser.add_argument('--samples', type=int, default=50,
+                            help='number of users to recommend for')
+    cli_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='Be more verbose')
+    args = cli_parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    settings = [tuple(int(x) for x in setting.split('x'))
+                for setting in args.setting]
+    if not settings:
+        settings = [(64, 1), (32, 1), (32, 2), (16, 4)]
+
+    if args.lang:
+        test_lang = args.lang
+        index = CoeditIndex.from_database(test_lang)
+        if index is None:
+            return()
+    else:
+        test_lang = 'en'
+        index = CoeditIndex.from_revisions(
+            test_lang, synthetic_revisions(args.users, args.titles,
+                                           args.revisions))
+    print("Index has {} users, {} articles, {} user/article pairs".format(len(index.users), len(index.titles), len(index)))
+
+    recommender = Recommender()
+    recommender.indexes[test_lang] = index
+
+    params = {
+        'backoff': False,
+        'nrecs': config.nrecs_per_server,
+        'threshold': config.coedit_threshold,
+        'min-threshold': config.coedit_min_threshold,
+        'association-threshold': config.coedit_assoc_threshold,
+        'filter-threshold': config.coedit_filter_threshold,
+        'aggregation': 'exhaustive',
+    }
+
+    # Test on existing users with enough major edits, recommending
+    # based on their own articles.
+    rng = random.Random(7)
+    active_users = [user_id for user_id in range(len(index.users))
+                    if index.user_nmajor[user_id] >= 10]
+    test_users = []
+    for user_id in rng.sample(active_users,
+                              min(args.samples, len(active_users))):
+        (titles, flags, nrevs) = index.user_row(user_id)
+        contribs = [index.titles[title_id] for title_id in titles.tolist()]
+        test_users.append((index.users[user_id], contribs))
+
+    def run(lsh):
+        results = []
+        start = time.perf_counter()
+        for (username, contribs) in test_users:
+            (nhood, assoc) = recommender.get_neighbourhood_from_index(
+                index, username, contribs, params, lsh=lsh)
+            (rec_map, coedit_count, complete) = recommender.gather_candidates(
+                test_lang, username, contribs, (nhood, assoc), params)
+            recs = recommender.rank_candidates(
+                rec_map, coedit_count, params['threshold'], params['nrecs'])
+            results.append((nhood.tolist(), [rec['item'] for rec in recs]))
+        elapsed = time.perf_counter() - start
+        return(results, 1000 * elapsed / len(test_users))
+
+    (exact, exact_time) = run(None)
+    print("exact: {:.1f}ms/user".format(exact_time))
+
+    for (bands, rows) in settings:
+        start = time.perf_counter()
+        lsh = CoeditLSH(index, bands=bands, rows=rows)
+        build_time = time.perf_counter() - start
+
+        (approximate, lsh_time) = run(lsh)
+        nhood_recall = sum(recall(e[0], a[0]) for (e, a)
+                           in zip(exact, approximate)) / len(exact)
+        recs_recall = sum(recall(e[1], a[1]) for (e, a)
+                          in zip(exact, approximate)) / len(exact)
+        print("{}x{}: {:.1f}ms/user, neighbourhood recall {:.3f}, recommendation recall {:.3f}, built in {:.1f}s".format(bands, rows, lsh_time, nhood_recall, recs_recall, build_time))
+    return()
+
+if __name__ == "__main__":
+    main()
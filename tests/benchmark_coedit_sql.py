@@ -0,0 +1,152 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Benchmark the co-edit recommender's SQL modes against each other on a
+synthetic revision table: "loop", which looks up editors and articles
+one at a time, and "join", which finds the neighbourhood and the
+candidates with one grouped query each.
+
+Needs access to the SuggestBot database.  The synthetic revision and
+user statistics tables are created next to the enwiki ones (with the
+same format) and dropped afterwards unless --keep is given.
+'''
+
+import time
+import random
+import logging
+import datetime
+
+from more_itertools import chunked
+
+from suggestbot import config, db
+from suggestbot.recommenders.coedit import Recommender
+import suggestbot.utilities.userstats as sus
+
+def synthetic_revisions(n_users, n_titles, n_revisions, seed=42):
+    '''
+    Generate revisions where both user activity and article popularity
+    are heavily skewed, similar to what we see on Wikipedia.
+    '''
+    rng = random.Random(seed)
+    for i in range(n_revisions):
+        user = int(n_users * rng.random() ** 3)
+        title = int(n_titles * rng.random() ** 2)
+        yield ('User {}'.format(user), 'Article {}'.format(title),
+               rng.random() < 0.7)
+
+def create_tables(db_conn, db_cursor, lang, revisions):
+    '''
+    Create the synthetic revision table and its user statistics table.
+    '''
+    timestamp = datetime.datetime(2016, 1, 1)
+    for (table, template) in [(config.revision_table[lang],
+                               config.revision_table['en']),
+                              (config.userstats_table[lang],
+                               config.userstats_table['en'])]:
+        db_cursor.execute("DROP TABLE IF EXISTS {}".format(table))
+        db_cursor.execute("CREATE TABLE {} LIKE {}".format(table, template))
+
+    insert_query = """INSERT INTO {}
+                      (rev_title, rev_user, rev_timestamp,
+                       rev_is_minor, rev_comment_is_revert)
+                      VALUES (%s, %s, %s, %s, 0)""".format(
+                          config.revision_table[lang])
+    for subset in chunked(revisions, 10000):
+        db_cursor.executemany(insert_query,
+                              [(title.encode('utf-8'), user.encode('utf-8'),
+                                timestamp, 0 if is_major else 1)
+                               for (user, title, is_major) in subset])
+        db_conn.commit()
+
+    sus.rebuild_user_stats(db_conn, db_cursor, lang)
+
+def drop_tables(db_conn, db_cursor, lang):
+    '''
+    Drop the synthetic tables.
+    '''
+    for table in [config.revision_table[lang], config.userstats_table[lang]]:
+        db_cursor.execute("DROP TABLE IF EXISTS {}".format(table))
+    db_conn.commit()
+
+def main():
+    import argparse
+    cli_parser = argparse.ArgumentParser(
+        description="Benchmark the co-edit recommender's SQL modes on a synthetic revision table."
+        )
+    cli_parser.add_argument('--users', type=int, default=20000,
+                            help='number of users in the synthetic table')
+    cli_parser.add_argument('--titles', type=int, default=100000,
+                            help='number of articles in the synthetic table')
+    cli_parser.add_argument('--revisions', type=int, default=500000,
+                            help='number of revisions in the synthetic table')
+    cli_parser.add_argument('--samples', type=int, default=20,
+                            help='number of users to recommend for')
+    cli_parser.add_argument('--basket', type=int, default=20,
+                            help='number of articles each user has edited')
+    cli_parser.add_argument('--keep', action='store_true',
+                            help='keep the synthetic tables afterwards')
+    cli_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='Be more verbose')
+    args = cli_parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    test_lang = 'bench'
+    config.revision_table[test_lang] = 'benchwiki_revisions'
+    config.userstats_table[test_lang] = 'benchwiki_userstats'
+
+    sbdb = db.SuggestBotDatabase()
+    if not sbdb.connect():
+        logging.error("unable to connect to the SuggestBot database")
+        return()
+    (db_conn, db_cursor) = sbdb.getConnection()
+
+    start = time.perf_counter()
+    create_tables(db_conn, db_cursor, test_lang,
+                  synthetic_revisions(args.users, args.titles,
+                                      args.revisions))
+    print("Created synthetic revision table with {} revisions in {:.1f}s".format(args.revisions, time.perf_counter() - start))
+
+    # Users edit a mix of popular and less popular articles
+    rng = random.Random(7)
+    test_users = []
+    for i in range(args.samples):
+        contribs = ['Article {}'.format(int(args.titles * rng.random() ** 2))
+                    for j in range(args.basket)]
+        test_users.append(('Benchmark user {}'.format(i),
+                           list(dict.fromkeys(contribs))))
+
+    recommender = Recommender()
+    results = {}
+    try:
+        for sql_mode in ['loop', 'join']:
+            results[sql_mode] = []
+            elapsed = 0.0
+            for (username, contribs) in test_users:
+                params = recommender.get_params()
+                params['sql-mode'] = sql_mode
+                start = time.perf_counter()
+                recommender.connect(test_lang)
+                results[sql_mode].append(recommender.get_recs(
+                    test_lang, username, contribs, params))
+                recommender.disconnect()
+                elapsed += time.perf_counter() - start
+            print("{}: {:.3f}s for {} users ({:.1f}ms/user)".format(
+                sql_mode, elapsed, len(test_users),
+                1000 * elapsed / len(test_users)))
+
+        n_same = sum(1 for (loop_recs, join_recs)
+                     in zip(results['loop'], results['join'])
+                     if [rec['item'] for rec in loop_recs] \
+                     == [rec['item'] for rec in join_recs])
+        print("Identical recommendations for {} of {} users".format(
+            n_same, len(test_users)))
+    finally:
+        if not args.keep:
+            drop_tables(db_conn, db_cursor, test_lang)
+        sbdb.disconnect()
+    return()
+
+if __name__ == "__main__":
+    main()
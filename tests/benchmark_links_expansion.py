@@ -0,0 +1,134 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Compare the link recommender's expansion modes: "exhaustive", which
+follows links from every page found so far at each depth, and
+"frontier", which only follows the highest-scoring pages found at the
+previous depth.  Reports link rows fetched per depth, latency, and
+recall of the top candidates found by exhaustive expansion, for a range
+of beam widths.
+
+Runs on a synthetic link graph by default, or on the link graph
+snapshot of a given language (see bin/update-link-graph.py).  Candidates
+are ranked on link counts alone, the inlink count re-weighting needs
+the tool database and is the same for both modes.
+'''
+
+import time
+import random
+import logging
+
+from collections import defaultdict
+
+import numpy as np
+
+from suggestbot import config
+from suggestbot.recommenders.links import Recommender
+from suggestbot.recommenders.linkgraph import LinkGraph
+
+def synthetic_graph(n_pages, n_links, seed=42):
+    '''
+    Generate a link graph where pages mostly link within one of a set
+    of topics, and link popularity is skewed.
+    '''
+    rng = np.random.RandomState(seed)
+    n_topics = max(n_pages // 200, 1)
+    sources = rng.randint(1, n_pages + 1, size=n_links)
+    topics = (sources * 7919) % n_topics
+    targets = topics * 200 + (200 * rng.random_sample(n_links) ** 2).astype(np.int64) + 1
+    popular = rng.random_sample(n_links) < 0.2
+    targets[popular] = (n_pages * rng.random_sample(popular.sum()) ** 3).astype(np.int64) + 1
+    targets = np.minimum(targets, n_pages)
+    return(LinkGraph.from_links('bench', sources, targets))
+
+def top_candidates(recommender, seeds, n_recs):
+    '''
+    Get the IDs of the `n_recs` highest-scoring candidates found,
+    leaving out the seed pages.
+    '''
+    recs = [(page_id, score) for (page_id, score)
+            in recommender.rec_map.items() if page_id not in seeds]
+    recs.sort(key=lambda rec: (-rec[1], rec[0]))
+    return([page_id for (page_id, score) in recs[:n_recs]])
+
+def main():
+    import argparse
+    cli_parser = argparse.ArgumentParser(
+        description="Compare exhaustive and frontier link expansion in the link recommender."
+        )
+    cli_parser.add_argument('-l', '--lang', type=str, default=None,
+                            help='use the link graph snapshot of this language instead of a synthetic graph')
+    cli_parser.add_argument('-b', '--beam', type=int, action='append',
+                            default=[],
+                            help='beam width to test (can be repeated)')
+    cli_parser.add_argument('--pages', type=int, default=200000,
+                            help='number of pages in the synthetic graph')
+    cli_parser.add_argument('--links', type=int, default=5000000,
+                            help='number of links in the synthetic graph')
+    cli_parser.add_argument('--samples', type=int, default=20,
+                            help='number of profiles to expand')
+    cli_parser.add_argument('--seeds', type=int, default=128,
+                            help='number of articles in each profile')
+    cli_parser.add_argument('--depth', type=int, default=2,
+                            help='maximum search depth')
+    cli_parser.add_argument('--nrecs', type=int, default=2500,
+                            help='number of candidates we need')
+    cli_parser.add_argument('--top', type=int, default=100,
+                            help='number of top candidates recall is measured for')
+    cli_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='Be more verbose')
+    args = cli_parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    if args.lang:
+        lang = args.lang
+        graph = LinkGraph.load(config.links_graph_dir.format(lang))
+        if graph is None:
+            logging.error("unable to load the link graph for {}wiki".format(lang))
+            return()
+    else:
+        lang = 'bench'
+        graph = synthetic_graph(args.pages, args.links)
+    print("Link graph has {} pages and {} links".format(len(graph.page_ids),
+                                                         len(graph)))
+
+    rng = random.Random(7)
+    page_ids = np.asarray(graph.page_ids).tolist()
+    profiles = [rng.sample(page_ids, min(args.seeds, len(page_ids)))
+                for i in range(args.samples)]
+
+    settings = [('exhaustive', None)] \
+               + [('frontier', beam) for beam in (args.beam or [100, 500, 2000])]
+    results = {}
+    for (expansion, beam) in settings:
+        recommender = Recommender(max_depth=args.depth, expansion=expansion,
+                                  beam_width=beam)
+        recommender.link_graphs[lang] = graph
+        results[(expansion, beam)] = []
+        depth_rows = []
+        elapsed = 0.0
+        for seeds in profiles:
+            recommender.rec_map = defaultdict(int, {p: 0 for p in seeds})
+            start = time.perf_counter()
+            recommender.expand_recs(lang, len(seeds), args.nrecs)
+            elapsed += time.perf_counter() - start
+            depth_rows.append(recommender.depth_rows)
+            results[(expansion, beam)].append(
+                top_candidates(recommender, set(seeds), args.top))
+
+        mean_rows = [int(np.mean([rows[d] for rows in depth_rows
+                                  if len(rows) > d]))
+                     for d in range(max(len(rows) for rows in depth_rows))]
+        recall = np.mean([
+            len(set(exact) & set(found)) / len(exact) if exact else 1.0
+            for (exact, found) in zip(results[('exhaustive', None)],
+                                      results[(expansion, beam)])])
+        print("{} (beam {}): {:.1f}ms/profile, rows per depth {}, recall@{} {:.3f}".format(
+            expansion, beam, 1000 * elapsed / len(profiles), mean_rows,
+            args.top, recall))
+    return()
+
+if __name__ == "__main__":
+    main()
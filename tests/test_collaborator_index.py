@@ -0,0 +1,145 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Test the collaborator recommender's co-edit index path: build a small
+synthetic co-edit index, save it as a snapshot, have the recommender
+load it, and check its recommendations against associations computed
+directly from the revisions.
+'''
+
+import os
+import random
+import shutil
+import logging
+import tempfile
+
+from collections import defaultdict
+
+from suggestbot import config
+from suggestbot.recommenders.coeditindex import CoeditIndex
+from suggestbot.recommenders.collaborator import CollabRecommender
+
+def synthetic_revisions(n_users, n_titles, n_revisions, seed=42):
+    '''
+    Generate revisions from users who mostly edit a few related articles.
+    '''
+    rng = random.Random(seed)
+    for i in range(n_revisions):
+        user = rng.randrange(n_users)
+        if rng.random() < 0.7:
+            title = (user * 3 + rng.randrange(8)) % n_titles
+        else:
+            title = rng.randrange(n_titles)
+        yield('User {}'.format(user), 'Article {}'.format(title),
+              rng.random() < 0.8)
+
+def expected_recs(revisions, username, basket, exp_threshold, threshold):
+    '''
+    Compute the association between the given user and everyone else
+    who edited the basket directly from the revisions.  Returns a dict
+    mapping usernames to association for the neighbours who share at
+    least `threshold` articles with the basket.
+    '''
+    edit_counts = defaultdict(int)
+    edited = defaultdict(set)
+    major = defaultdict(set)
+    for (user, title, is_major) in revisions:
+        edit_counts[user] += 1
+        edited[user].add(title)
+        if is_major:
+            major[user].add(title)
+
+    recs = {}
+    for user in edited:
+        if user == username:
+            continue
+        if edit_counts[user] >= exp_threshold:
+            articles = major[user]
+        else:
+            articles = edited[user]
+        shared = len(articles & basket)
+        if not shared or shared < threshold:
+            continue
+        recs[user] = shared / len(articles | basket)
+    return(recs)
+
+def check_recs(recs, expected, nrecs):
+    '''
+    Check that we got the `nrecs` neighbours with the highest association.
+    '''
+    assert len(recs) == min(nrecs, len(expected)), \
+        "expected {} recs, got {}".format(min(nrecs, len(expected)), len(recs))
+    values = sorted(expected.values(), reverse=True)
+    for (rec, value) in zip(recs, values):
+        assert rec['item'] in expected, \
+            "{} is not a neighbour".format(rec['item'])
+        assert abs(rec['value'] - expected[rec['item']]) < 1e-9
+        assert abs(rec['value'] - value) < 1e-9
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    test_lang = 'xx'
+    test_user = 'User 7'
+    exp_threshold = 18
+    nrecs = 10
+
+    revisions = list(synthetic_revisions(200, 300, 5000))
+    index = CoeditIndex.from_revisions(test_lang, revisions)
+    print("Index has {} users, {} articles, {} user/article pairs".format(
+        len(index.users), len(index.titles), len(index)))
+
+    basket = {title for (user, title, is_major) in revisions
+              if user == test_user}
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        config.coedit_index_snapshot_dir = os.path.join(tmp_dir,
+                                                        'coedit-index-{0}')
+        index.save(config.coedit_index_snapshot_dir.format(test_lang))
+
+        # The recommender loads the snapshot for its language
+        recommender = CollabRecommender(lang=test_lang,
+                                        exp_threshold=exp_threshold)
+        assert recommender.index is not None, "snapshot was not loaded"
+
+        for threshold in [1, 2, 3]:
+            recs = recommender.recommend(list(basket), test_user, test_lang,
+                                         nrecs, threshold=threshold)
+            expected = expected_recs(revisions, test_user, basket,
+                                     exp_threshold, threshold)
+            check_recs(recs, expected, nrecs)
+            print("Threshold {}: got {} recommendations back, {} neighbours".format(threshold, len(recs), len(expected)))
+
+        # Backing off from a threshold nobody meets gets us down to
+        # the minimum threshold
+        recs = recommender.recommend(list(basket), test_user, test_lang,
+                                     nrecs, threshold=len(basket) + 1,
+                                     backoff=1)
+        expected = expected_recs(revisions, test_user, basket,
+                                 exp_threshold, 1)
+        check_recs(recs, expected, nrecs)
+        print("Backoff: got {} recommendations back".format(len(recs)))
+
+        # A group of users gets the same recommendations as one at a time
+        group = {user: [title for (rev_user, title, is_major) in revisions
+                        if rev_user == user]
+                 for user in ['User 3', 'User 7', 'User 11']}
+        recommender = CollabRecommender(lang=test_lang, threshold=2,
+                                        exp_threshold=exp_threshold)
+        group_recs = recommender.recommend_group(group, test_lang, nrecs)
+        for (user, contribs) in group.items():
+            recs = recommender.recommend(contribs, user, test_lang, nrecs,
+                                         threshold=2)
+            assert recs == group_recs[user], \
+                "group recommendations for {} differ".format(user)
+        print("Group of {} users got the same recommendations".format(
+            len(group)))
+
+        for rec in recs:
+            print(rec)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/env/python
+# -*- coding: utf-8  -*-
+'''
+Test the text recommender's local BM25 backend: build a text index from
+a small sample XML dump, check that it finds the expected similar
+articles, and get recommendations from it without any network access.
+'''
+
+import os
+import socket
+import shutil
+import logging
+import tempfile
+
+import pywikibot
+
+from suggestbot import config
+from suggestbot.recommenders import textindex
+from suggestbot.recommenders.text import Recommender
+
+SAMPLE_DUMP = '''<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">
+{pages}
+</mediawiki>
+'''
+
+SAMPLE_PAGE = '''  <page>
+    <title>{title}</title>
+    <ns>{ns}</ns>
+    <id>{page_id}</id>{redirect}
+    <revision>
+      <id>{page_id}</id>
+      <text xml:space="preserve">{text}</text>
+    </revision>
+  </page>'''
+
+SAMPLE_ARTICLES = [
+    ('Violin', 0, "The '''violin''' is a wooden [[string instrument]] played with a bow. Violin players tune the strings in fifths."),
+    ('Viola', 0, "The '''viola''' is a [[string instrument]] played with a bow, slightly larger than a violin and tuned a fifth lower."),
+    ('Cello', 0, "The '''cello''' is a bowed string instrument with four strings, larger than the viola, played seated."),
+    ('Double bass', 0, "The '''double bass''' is the largest bowed string instrument in the orchestra, played standing."),
+    ('Trumpet', 0, "The '''trumpet''' is a brass instrument played by buzzing the lips into a mouthpiece, common in orchestras and jazz."),
+    ('Trombone', 0, "The '''trombone''' is a brass instrument with a slide, played by buzzing the lips, used in orchestras and jazz."),
+    ('Association football', 0, "'''Association football''' is a team sport played with a ball between two teams of eleven players."),
+    ('Basketball', 0, "'''Basketball''' is a team sport where two teams of five players score by shooting a ball through a hoop."),
+    ('Fiddle', 0, '#REDIRECT [[Violin]]'),
+    ('Talk:Violin', 1, 'Discussion about the violin, the string instrument played with a bow.'),
+]
+
+def write_sample_dump(path):
+    pages = []
+    for (page_id, (title, ns, text)) in enumerate(SAMPLE_ARTICLES, start=1):
+        redirect = ''
+        if text.startswith('#REDIRECT'):
+            redirect = '\n    <redirect title="Violin" />'
+        pages.append(SAMPLE_PAGE.format(title=title, ns=ns, page_id=page_id,
+                                        redirect=redirect, text=text))
+    with open(path, 'w', encoding='utf-8') as outfile:
+        outfile.write(SAMPLE_DUMP.format(pages='\n'.join(pages)))
+
+# The article most similar to each of these
+EXPECTED_NEIGHBOURS = {
+    'Violin': 'Viola',
+    'Cello': 'Viola',
+    'Trumpet': 'Trombone',
+    'Association football': 'Basketball',
+}
+
+def no_network(*args, **kwargs):
+    raise AssertionError("the bm25 backend should not use the network")
+
+def check_index(index):
+    '''
+    Check that the index has the articles from the sample dump and finds
+    the expected similar articles.
+    '''
+    assert index.titles == [title for (title, ns, text) in SAMPLE_ARTICLES
+                            if ns == 0 and not text.startswith('#REDIRECT')]
+    assert index.morelike('Fiddle', 3) is None, "redirect was indexed"
+    assert index.morelike('Talk:Violin', 3) is None, "talk page was indexed"
+    for (title, neighbour) in EXPECTED_NEIGHBOURS.items():
+        results = index.morelike(title, 3)
+        assert results[0] == neighbour, \
+            "expected {} to be most like {}, got {}".format(neighbour, title,
+                                                            results)
+        assert title not in results
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    test_lang = 'en'
+    test_user = 'Nettrom'
+    test_edits = ['Violin', 'Trumpet']
+
+    site = pywikibot.Site
+    connect = socket.socket.connect
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        dump_path = os.path.join(tmp_dir, 'sample-pages-articles.xml')
+        write_sample_dump(dump_path)
+        index = textindex.TextIndex.build(
+            test_lang, textindex.read_xml_dump(dump_path))
+        print("Built index with {} articles and {} terms".format(
+            len(index), len(index.terms)))
+        check_index(index)
+
+        config.text_index_dir = os.path.join(tmp_dir, 'text-index-{0}')
+        index.save(config.text_index_dir.format(test_lang))
+
+        # The loaded index gives the same results as the one we built
+        loaded = textindex.TextIndex.load(
+            config.text_index_dir.format(test_lang))
+        assert loaded is not None, "index was not loaded"
+        check_index(loaded)
+        assert loaded.built == index.built.replace(microsecond=0)
+        for title in index.titles:
+            assert loaded.morelike(title, 5) == index.morelike(title, 5), \
+                "results for {} differ after loading".format(title)
+        for title in test_edits:
+            print("More like {}: {}".format(title, loaded.morelike(title, 3)))
+
+        # Searching the index must not touch the network
+        pywikibot.Site = no_network
+        socket.socket.connect = no_network
+        config.text_cache_path = None
+        recommender = Recommender(backend='bm25')
+        recs = recommender.recommend(test_user, test_lang, test_edits,
+                                     {'nrecs': 5})
+        print("Got {} recommendations back".format(len(recs)))
+        for rec in recs:
+            print(rec)
+        assert len(recs) == 5
+        items = [rec['item'] for rec in recs]
+        assert items[0] == 'Viola' and 'Trombone' in items[:3], \
+            "expected Viola and Trombone at the top, got {}".format(items)
+        assert 'Fiddle' not in items and 'Talk:Violin' not in items
+    finally:
+        pywikibot.Site = site
+        socket.socket.connect = connect
+        shutil.rmtree(tmp_dir)
+    return()
+
+if __name__ == "__main__":
+    main()